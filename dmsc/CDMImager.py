@@ -4,15 +4,84 @@ import numpy as np
 import csv
 import sys
 import importlib.util
-from skimage.metrics import structural_similarity as ssim
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from utils import bayer_masks, mosaic_cfa
+from metrics import image_metrics
+from tiling import demosaic_tiled, TILE_SIZE
+from pipeline import run_pipeline, QUEUE_SIZE
+from writer import OUTPUT_FORMATS, ResultWriter, result_path, write_image
+from gt_cache import cached_image
+
+# algorithms of the RI_web package: they share Demosaicker/RI_web/run_RI_web.py instead of a run_<method>.py each
+RI_WEB_ALGORITHMS = ('HA', 'RI', 'MLRI', 'WMLRI', 'ARI')
+
+# demosaicking modules already imported by this process, keyed by the absolute path of their run script
+_demosaic_modules = {}
+
+
+def import_method_script(script_path):
+    """
+    Imports a run_<method>.py script with its folder temporarily at the front of sys.path.
+    The method's own modules (green_interpolation, red_interpolation, ...) are removed from sys.modules
+    afterwards, so that another method with same-named modules (e.g. GBTF and Prop) imports its own copies.
+    """
+    method_folder = os.path.dirname(script_path)
+    local_modules = [os.path.splitext(f)[0] for f in os.listdir(method_folder) if f.endswith('.py')]
+
+    # hide modules of other methods that share a name with the modules of this method
+    hidden = {name: sys.modules.pop(name) for name in local_modules if name in sys.modules}
+    sys.path.insert(0, method_folder)
+    try:
+        module_name = os.path.splitext(os.path.basename(script_path))[0]
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        demosaic_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(demosaic_module)
+    finally:
+        sys.path.remove(method_folder)
+        for name in local_modules:
+            sys.modules.pop(name, None)
+        sys.modules.update(hidden)
+
+    return demosaic_module
+
 
 class CDMImager:
-    def __init__(self, dataset_name):
+    def __init__(self, dataset_name, dtype=np.float64, tile_size=None, threads=1,
+                 output_format='png', png_compression=None, writer_threads=1, gt_cache=False, workspace=False,
+                 tile_timings=False):
         self.dataset_name = dataset_name
         self.input_folder = os.path.join("data", dataset_name, "GT")
         self.result_folder = os.path.join("data", dataset_name, f"result_{dataset_name}")
+        # with gt_cache, the GT images are decoded once into memory-mapped arrays in cache_folder
+        # (see gt_cache and load_image)
+        self.cache_folder = os.path.join("data", dataset_name, "cache")
+        self.gt_cache = gt_cache
         self.demosaicker_folder = "Demosaicker"
         self.bayer_type = 'grbg'
+        # floating point type of the mosaic and of the demosaicking intermediates (np.float64 or np.float32)
+        self.dtype = dtype
+        # with a tile_size, the images are demosaicked by tiles of tile_size x tile_size pixels
+        # (plus the halo of the method) to bound the memory used on very large frames
+        self.tile_size = tile_size
+        # with threads > 1 the tiles of each image are demosaicked by a pool of `threads` threads
+        # (if no tile_size is given, tiles of TILE_SIZE pixels or 4 times the halo of the method if larger,
+        # so that the halo does not dominate the work of methods with a large one such as ARI)
+        self.threads = threads
+        # with tile_timings, the demosaicking time of each tile is printed (see print_tile_timings)
+        self.tile_timings = tile_timings
+        # format of the saved results ('png', 'tiff', 'ppm' or 'npy', see writer.write_image), None to only
+        # compute the metrics; png_compression is the PNG compression level (0 to 9, OpenCV's default if None)
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {list(OUTPUT_FORMATS)} or None, got {output_format}")
+        self.output_format = output_format
+        self.png_compression = png_compression
+        # process_images writes the results in a pool of `writer_threads` background threads (0: synchronously)
+        self.writer_threads = writer_threads
+        self._writer = None
+        # with workspace, each thread keeps the scratch buffers of the RI_web methods for its next images
+        # of the same size (faster, but the buffers stay allocated, see run_RI_web.thread_workspace)
+        self.workspace = workspace
         
         # Create result folder if it doesn't exist
         if not os.path.exists(self.result_folder):
@@ -22,31 +91,24 @@ class CDMImager:
         """
         generate a mosaic from a rgb image
         pattern can be: 'grbg', 'rggb', 'gbrg', 'bggr'
+        the mask comes from the cached mask bank (utils.bayer_masks) and is read-only
+        the mosaic and the mask have type self.dtype
         """
-        num = np.zeros(len(pattern))
-        pattern_list = list(pattern)
-        print(pattern_list)
-        p = pattern_list.index('r')
-        num[p] = 0
-        p = [idx for idx, i in enumerate(pattern_list) if i == 'g']
-        num[p] = 1
-        p = pattern_list.index('b')
-        num[p] = 2
-
         size_rgb = rgb.shape
-        mask = np.zeros((size_rgb[0], size_rgb[1], 3))
-
-        # Generate mask
-        mask[0::2, 0::2, int(num[0])] = 1
-        mask[0::2, 1::2, int(num[1])] = 1
-        mask[1::2, 0::2, int(num[2])] = 1
-        mask[1::2, 1::2, int(num[3])] = 1
+        mask = bayer_masks(size_rgb[0], size_rgb[1], pattern, self.dtype)[0]
 
         # Generate mosaic
-        mosaic = rgb * mask
+        mosaic = rgb.astype(self.dtype, copy=False) * mask
 
         return mosaic, mask
 
+    def mosaic_cfa(self, rgb, pattern):
+        """
+        generate a single plane (HxW) Bayer CFA of type self.dtype from a rgb image
+        pattern can be: 'grbg', 'rggb', 'gbrg', 'bggr'
+        """
+        return mosaic_cfa(rgb, pattern, self.dtype)
+
     def flatten_to_cfa(self, mosaic_img):
         """
         Converts a 3D mosaic image (output of mosaic function) into a 2D Bayer CFA.
@@ -63,101 +125,224 @@ class CDMImager:
 
         return cfa
 
+    def method_script_path(self, method_name):
+        """
+        Returns the absolute path of the run script of a demosaicking method inside the Demosaicker directory.
+        """
+        if method_name in RI_WEB_ALGORITHMS:
+            method_folder = os.path.join(self.demosaicker_folder, "RI_web")
+            method_script = "run_RI_web.py"
+        else:
+            method_folder = os.path.join(self.demosaicker_folder, method_name)
+            method_script = f"run_{method_name}.py"
+        return os.path.abspath(os.path.join(method_folder, method_script))
+
     def load_demosaic_method(self, method_name):
         """
-        Dynamically loads the demosaicking method script from the respective folder inside the Demosaicker directory.
-        Returns the `demosaic_function` from the script.
+        Resolves the demosaicking method script from the respective folder inside the Demosaicker directory
+        and returns the `demosaic_function` from the script.
+        Each script is imported once per process, later calls return the cached function.
         """
-        method_folder = os.path.join(self.demosaicker_folder, method_name)
-        method_script = f"run_{method_name}.py"
-        script_path = os.path.join(method_folder, method_script)
+        script_path = self.method_script_path(method_name)
 
-        if not os.path.exists(script_path):
-            raise FileNotFoundError(f"Demosaicking method script not found: {script_path}")
+        if script_path not in _demosaic_modules:
+            if not os.path.exists(script_path):
+                raise FileNotFoundError(f"Demosaicking method script not found: {script_path}")
 
-        # Add the method's folder to sys.path so that it can find its dependencies
-        sys.path.insert(0, method_folder)
+            demosaic_module = import_method_script(script_path)
 
-        # Load the script dynamically
-        spec = importlib.util.spec_from_file_location(f"run_{method_name}", script_path)
-        demosaic_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(demosaic_module)
+            # Check if the loaded module has the necessary `demosaic_function`
+            if not hasattr(demosaic_module, 'demosaic_function'):
+                raise AttributeError(f"No `demosaic_function` found in {script_path}")
 
-        # Check if the loaded module has the necessary `demosaic_function`
-        if not hasattr(demosaic_module, 'demosaic_function'):
-            raise AttributeError(f"No `demosaic_function` found in {script_path}")
-        
-        return demosaic_module.demosaic_function
+            _demosaic_modules[script_path] = demosaic_module
+
+        demosaic_function = _demosaic_modules[script_path].demosaic_function
+        if method_name in RI_WEB_ALGORITHMS:
+            demosaic_function = partial(demosaic_function, Algorithm=method_name)
+            if self.workspace:
+                # each thread reuses the scratch buffers of its previous images of the same size
+                demosaic_function = partial(demosaic_function, workspace=True)
 
-    def psnr(self, gt_img, demosaicked_img):
+        return demosaic_function
+
+    def demosaic_halo(self, method_name):
         """
-        Calculate PSNR (r, g, b, all) between ground truth and demosaicked images.
+        Returns the halo (in pixels) the method needs around each tile, declared by HALO in its run script
+        (a dict keyed by algorithm for the RI_web package).
         """
-        print(gt_img.dtype, demosaicked_img.dtype)
-        psnr_r = cv2.PSNR(gt_img[:, :, 0], demosaicked_img[:, :, 0])
-        psnr_g = cv2.PSNR(gt_img[:, :, 1], demosaicked_img[:, :, 1])
-        psnr_b = cv2.PSNR(gt_img[:, :, 2], demosaicked_img[:, :, 2])
-        psnr_all = (psnr_r + psnr_g + psnr_b) / 3
-        
-        return psnr_r, psnr_g, psnr_b, psnr_all
+        self.load_demosaic_method(method_name)
+        script_path = self.method_script_path(method_name)
+
+        halo = getattr(_demosaic_modules[script_path], 'HALO', None)
+        if halo is None:
+            raise AttributeError(f"No `HALO` found in {script_path}, the method cannot be tiled")
+        if isinstance(halo, dict):
+            halo = halo[method_name]
 
-    def calculate_ssim(self, gt_img, demosaicked_img):
+        return halo
+
+    def print_tile_timings(self, img_name, tile_size, timings):
         """
-        Calculate SSIM between ground truth and demosaicked images.
+        Prints the demosaicking time of each tile of an image, to tune the tile size.
+        timings is the list of (row, col, seconds) filled by demosaic_tiled.
         """
-        ssim_value, _ = ssim(gt_img, demosaicked_img, multichannel=True, full=True)
-        return ssim_value
+        seconds = [t for _, _, t in timings]
+        print(f"{img_name}: {len(timings)} tiles of {tile_size}px with {self.threads} thread(s), "
+              f"total {sum(seconds):.3f}s, mean {np.mean(seconds):.3f}s, max {max(seconds):.3f}s")
+        for row, col, t in timings:
+            print(f"  tile ({row}, {col}): {t:.3f}s")
 
-    def process_single_image(self, img_path, demosaic_method='GBTf'):
+    def load_image(self, img_path):
         """
-        Processes a single image: applies mosaic, dynamically loads and runs the specified demosaicking method,
-        evaluates PSNR and SSIM.
+        Reads an image (from the GT cache with self.gt_cache) and mosaics it directly into a single plane CFA.
+        Returns (img_name, img, cfa_img), or None if the image cannot be read.
         """
         img_name = os.path.basename(img_path)
-        img = cv2.imread(img_path)
-        
+        if self.gt_cache:
+            # the GT is cached as decoded (uint8), plus in float32 for a float32 mosaic; a float64 mosaic
+            # is converted on load, its cache would be 8 times larger than the decoded image
+            cache_dtype = np.float32 if np.dtype(self.dtype) == np.float32 else np.uint8
+            img = cached_image(img_path, self.cache_folder, cache_dtype)
+        else:
+            img = cv2.imread(img_path)
+
         if img is None:
             print(f"Failed to load image: {img_name}")
-            return
-        
-        # Mosaic the image
-        mosaic_img,mask = self.mosaic_bayer(img,'grbg')
-        
-        # Convert to CFA
-        cfa_img = self.flatten_to_cfa(mosaic_img)
+            return None
+
+        return img_name, img, self.mosaic_cfa(img, self.bayer_type)
 
-        # Load and apply the demosaicking method
+    def demosaic_image(self, img_name, cfa_img, demosaic_method):
+        """
+        Demosaics a single plane CFA with the specified method, by tiles if a tile size or threads are set.
+        """
         demosaic_function = self.load_demosaic_method(demosaic_method)
-        demosaicked_img = demosaic_function((mosaic_img,mask, self.bayer_type))  # Call the dynamically loaded demosaic function
-        
-        # Save the demosaicked image
-        result_path = os.path.join(self.result_folder, img_name)
-        cv2.imwrite(result_path, demosaicked_img)
-        print(f"Processed and saved: {result_path}")
-        
-        # Evaluate PSNR and SSIM
-        psnr_r, psnr_g, psnr_b, psnr_all = self.psnr(img, demosaicked_img)
-        ssim_value = self.calculate_ssim(img, demosaicked_img)
-        
+        if self.tile_size is None and self.threads == 1:
+            return demosaic_function((cfa_img, self.bayer_type), dtype=self.dtype)  # Call the dynamically loaded demosaic function
+
+        halo = self.demosaic_halo(demosaic_method)
+        tile_size = max(TILE_SIZE, 4 * halo) if self.tile_size is None else self.tile_size
+        timings = [] if self.tile_timings else None
+        demosaicked_img = demosaic_tiled(demosaic_function, cfa_img, self.bayer_type, tile_size, halo,
+                                         threads=self.threads, timings=timings, dtype=self.dtype)
+        if self.tile_timings:
+            self.print_tile_timings(img_name, tile_size, timings)
+        return demosaicked_img
+
+    def save_image(self, img_name, demosaicked_img):
+        """
+        Saves a demosaicked image in the result folder, in self.output_format (nothing is saved if None).
+        During process_images, the image is handed to the background writer, which reports it once written.
+        """
+        if self.output_format is None:
+            return
+
+        path = result_path(self.result_folder, img_name, self.output_format)
+        if self._writer is not None:
+            # reported once written, a failed write is raised when the writer is closed
+            self._writer.write(path, demosaicked_img, lambda path: print(f"Processed and saved: {path}"))
+        else:
+            write_image(path, demosaicked_img, self.output_format, self.png_compression)
+            print(f"Processed and saved: {path}")
+
+    def evaluate(self, img, demosaicked_img):
+        """
+        Evaluates PSNR and SSIM in one call, the squared differences are shared by the channels.
+        Returns psnr_r, psnr_g, psnr_b, psnr_all (the mean of the channel PSNRs) and ssim.
+        """
+        (psnr_r, psnr_g, psnr_b), _, ssim_value = image_metrics(img, demosaicked_img)
+        psnr_all = (psnr_r + psnr_g + psnr_b) / 3
+
         return psnr_r, psnr_g, psnr_b, psnr_all, ssim_value
 
-    def process_images(self, demosaic_method='GBTF'):
+    def process_single_image(self, img_path, demosaic_method='GBTf'):
+        """
+        Processes a single image: applies mosaic, dynamically loads and runs the specified demosaicking method,
+        evaluates PSNR and SSIM.
+        """
+        loaded = self.load_image(img_path)
+        if loaded is None:
+            return None
+        img_name, img, cfa_img = loaded
+
+        demosaicked_img = self.demosaic_image(img_name, cfa_img, demosaic_method)
+        self.save_image(img_name, demosaicked_img)
+
+        return self.evaluate(img, demosaicked_img)
+
+    def process_images_pipelined(self, img_paths, demosaic_method, queue_size=QUEUE_SIZE):
+        """
+        Generator processing the images like process_single_image, with the reading and mosaicking,
+        the demosaicking, the saving and the evaluation of successive images running concurrently
+        in a thread each (see pipeline.run_pipeline): yields the results in the order of img_paths.
+        At most about 5 * (queue_size + 1) images are in memory.
+        """
+        def skip_failed(step):
+            # images that failed to load go through the pipeline as None
+            return lambda item: None if item is None else step(*item)
+
+        def demosaic(img_name, img, cfa_img):
+            return img_name, img, self.demosaic_image(img_name, cfa_img, demosaic_method)
+
+        def save(img_name, img, demosaicked_img):
+            self.save_image(img_name, demosaicked_img)
+            return img, demosaicked_img
+
+        stages = [self.load_image, skip_failed(demosaic), skip_failed(save), skip_failed(self.evaluate)]
+        return run_pipeline(img_paths, stages, queue_size)
+
+    def process_images(self, demosaic_method='GBTF', workers=1, pipelined=False):
         """
         Processes all images in the dataset folder using the specified demosaicking method.
         Calls process_single_image for each image and logs the results in a CSV file.
+        With workers > 1 the images are processed in a pool of `workers` processes;
+        with pipelined, the steps of successive images overlap in threads (see process_images_pipelined).
+        Either way, the CSV rows are still written in sorted image-name order.
         """
-        gt_images = os.listdir(self.input_folder)
+        if pipelined and workers > 1:
+            raise ValueError("pipelined runs in a single process, it cannot be combined with workers > 1")
+
+        gt_images = sorted(os.listdir(self.input_folder))
+        img_paths = [os.path.join(self.input_folder, img_name) for img_name in gt_images]
         csv_file_path = os.path.join(self.result_folder, "results.csv")
+        process = partial(self.process_single_image, demosaic_method=demosaic_method)
         
         with open(csv_file_path, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(["Image", "PSNR_R", "PSNR_G", "PSNR_B", "PSNR_All", "SSIM"])
             
-            for img_name in gt_images:
-                img_path = os.path.join(self.input_folder, img_name)
-                psnr_r, psnr_g, psnr_b, psnr_all, ssim_value = self.process_single_image(img_path, demosaic_method=demosaic_method)
-                
-                # Write results to CSV
-                writer.writerow([img_name, psnr_r, psnr_g, psnr_b, psnr_all, ssim_value])
+            if workers > 1:
+                # one OpenCV thread per worker process, otherwise the pool oversubscribes the cores
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=cv2.setNumThreads, initargs=(1,))
+                results = executor.map(process, img_paths)
+            else:
+                executor = None
+                # the images are encoded and written in the background, the worker processes above write
+                # synchronously (they get a copy of self without the writer)
+                if self.output_format is not None:
+                    self._writer = ResultWriter(self.output_format, self.png_compression, self.writer_threads)
+                if pipelined:
+                    results = self.process_images_pipelined(img_paths, demosaic_method)
+                else:
+                    results = map(process, img_paths)
+
+            try:
+                # map yields in submission order, so the CSV does not depend on which worker finishes first
+                for img_name, result in zip(gt_images, results):
+                    if result is None:
+                        continue
+                    psnr_r, psnr_g, psnr_b, psnr_all, ssim_value = result
+                    # Write results to CSV
+                    writer.writerow([img_name, psnr_r, psnr_g, psnr_b, psnr_all, ssim_value])
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+                elif pipelined:
+                    results.close()
+                # the run is complete once the pending images are written
+                if self._writer is not None:
+                    result_writer, self._writer = self._writer, None
+                    result_writer.close()
 
         print(f"Results saved to {csv_file_path}")
@@ -1,9 +1,9 @@
 import numpy as np
-from utils import filter2D
+from utils import filter2D, mask_phase, phase_plane
 
 
 
-def haresidual(rawq, mask, maskGr, maskGb, mosaic):
+def haresidual(rawq, mask, maskGr, maskGb):
     """
     This functions implements Algorithm 3 
     Hamilton-Adams residual used in the GBTF algorithm
@@ -18,21 +18,25 @@ def haresidual(rawq, mask, maskGr, maskGb, mosaic):
     maskB = mask[:, :, 2]
 
     # tentative image
-    Grh = rawh * maskR
-    Gbh = rawh * maskB
-    Rh = rawh * maskGr
-    Bh = rawh * maskGb
-    Grv = rawv * maskR
-    Gbv = rawv * maskB
-    Rv = rawv * maskGb
-    Bv = rawv * maskGr
-
+    #   Grh = rawh * maskR,  Gbh = rawh * maskB,  Rh = rawh * maskGr,  Bh = rawh * maskGb
+    #   Grv = rawv * maskR,  Gbv = rawv * maskB,  Rv = rawv * maskGb,  Bv = rawv * maskGr
     # vertical and horizontal color difference (2nd step of GBTF - line 12)
+    #   difh = (Grh - mosaic[:, :, 0]) + (Gbh - mosaic[:, :, 2]) + (- Rh - Bh + mosaic[:, :, 1])
     # {Gr,Gb,R,B}h  are \tilde Q in the paper, restricted to the different mosaic phases.
     # mosaic[:,:,i] are  Q in the paper the combination below.
     # Note that the phases of {Gr,Gb,R,B}h/v are not evident from the names, for instance Rh is on maskGr
-    difh = (Grh - mosaic[:, :, 0]) + (Gbh - mosaic[:, :, 2]) + (- Rh - Bh + mosaic[:, :, 1])
-    difv = (Grv - mosaic[:, :, 0]) + (Gbv - mosaic[:, :, 2]) + (- Rv - Bv + mosaic[:, :, 1])
+    # A single term is not null on each phase: the difference is computed on the H/2 x W/2 phase planes,
+    #   difh = rawh - rawq  on the R and B pixels,  difh = rawq - rawh  on the G pixels
+    difh = np.empty_like(rawh)
+    difv = np.empty_like(rawv)
+    for M, green in ((maskR, True), (maskB, True), (maskGr, False), (maskGb, False)):
+        phase = mask_phase(M)
+        Q = phase_plane(rawq, phase)
+        for dif, raw in ((difh, rawh), (difv, rawv)):
+            if green:
+                np.subtract(phase_plane(raw, phase), Q, out=phase_plane(dif, phase))
+            else:
+                np.subtract(Q, phase_plane(raw, phase), out=phase_plane(dif, phase))
 #    difh = mosaic[:, :, 1] + Grh + Gbh - mosaic[:, :, 0] - mosaic[:, :, 2] - Rh - Bh
 #    difv = mosaic[:, :, 1] + Grv + Gbv - mosaic[:, :, 0] - mosaic[:, :, 2] - Rv - Bv
 
@@ -41,7 +45,9 @@ def haresidual(rawq, mask, maskGr, maskGb, mosaic):
     Kh = np.array([[1, 0, -1]])
     Kv = Kh.T
     AvK = np.array([[1, 1, 1]])
-    difh2 = filter2D ( abs(filter2D(difh, Kh)), AvK.T )
-    difv2 = filter2D ( abs(filter2D(difv, Kv)), AvK   )
+    gradient = filter2D(difh, Kh)
+    difh2 = filter2D(np.abs(gradient, out=gradient), AvK.T)
+    filter2D(difv, Kv, dst=gradient)
+    difv2 = filter2D(np.abs(gradient, out=gradient), AvK)
 
     return difh, difv, difh2, difv2
@@ -1,15 +1,15 @@
 import numpy as np
-from utils import filter2D
+from utils import filter2D, get_mosaic_masks, mask_phase, phase_plane
 
 
 
-def blue_interpolation(green, mosaic, mask, pattern, dif):
+def blue_interpolation(green, rawq, mask, pattern, dif):
     """ 
     blue interpolation implementing Residual Interpolation demosaicking
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
         green: image containing the interpolated green channel
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         h,v: support of the guided filter
@@ -28,10 +28,20 @@ def blue_interpolation(green, mosaic, mask, pattern, dif):
                     [0, 0, -1, 0, -1, 0, 0]]) / 32
     Aknl = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]]) / 4
 
-    blue = mosaic[:, :, 2] + mask[:, :, 0] * (green - filter2D(dif, Prb))
-    tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl)\
-              + mask[:, :, 1] * filter2D(blue, Aknl)
-    blue = blue + tempimg
+    #   blue = mosaic[:, :, 2] + mask[:, :, 0] * (green - filter2D(dif, Prb))
+    blue = mask[:, :, 0] * (green - filter2D(dif, Prb))
+    B = mask_phase(mask[:, :, 2])
+    np.add(phase_plane(blue, B), phase_plane(rawq, B), out=phase_plane(blue, B))
+    #   tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl) + mask[:, :, 1] * filter2D(blue, Aknl)
+    #   blue = blue + tempimg
+    # on the phase planes of Gr and Gb, tempimg is null on the other pixels
+    Kgreen = filter2D(green, Aknl)
+    Kblue = filter2D(blue, Aknl)
+    maskGr, maskGb, _, _ = get_mosaic_masks(rawq, pattern)
+    for G in (mask_phase(maskGr), mask_phase(maskGb)):
+        tempimg = phase_plane(rawq, G) - phase_plane(Kgreen, G)
+        tempimg += phase_plane(Kblue, G)
+        np.add(phase_plane(blue, G), tempimg, out=phase_plane(blue, G))
 
     # blue interpolation
     blue = np.clip(blue, 0, 255).astype(np.uint8)
@@ -26,38 +26,71 @@ def Means4Weights(difh2, difv2):
     """
     computes the weights used for the directional propagation (S,N,W,E) 
     for different demosaicing Algorithms (GBTF, RI, MLRI, WMLRI) 
+    The weights are the one pixel shifts (replicated border), by the filters Kw, Ke, Kn, Ks, of
+    W = 1 / (w * w + 1e-32) with w the Gaussian means of difh2 (Ww, We) or difv2 (Wn, Ws):
+    W is computed once on w extended by one column (row) on each side and the weights are shifted views of it.
     """    
     K = np.multiply(getGaussianKernel(5, 2), (getGaussianKernel(5, 2)).T)
-    Kw = np.array([[1, 0, 0]])
-    Ke = np.array([[0, 0, 1]])
+    height, width = difh2.shape
+
+    # Ww = filter2D(wh, [[1, 0, 0]]),  We = filter2D(wh, [[0, 0, 1]]),  likewise Wn, Ws from wv with the transposed filters
+    wh = np.empty((height, width + 2), dtype=difh2.dtype)
+    filter2D(difh2, K, dst=wh[:, 1:-1])
+    wh[:, 0] = wh[:, 1]
+    wh[:, -1] = wh[:, -2]
+    wv = np.empty((height + 2, width), dtype=difv2.dtype)
+    filter2D(difv2, K, dst=wv[1:-1])
+    wv[0] = wv[1]
+    wv[-1] = wv[-2]
+
+    # W = 1 / (W * W + 1e-32), in place
+    for W in (wh, wv):
+        np.multiply(W, W, out=W)
+        W += 1e-32
+        np.divide(1, W, out=W)
+
+    Ww, We = wh[:, :-2], wh[:, 2:]
+    Wn, Ws = wv[:-2], wv[2:]
+    return Wn, Ws, We, Ww
 
-    wh = filter2D(difh2, K)
-    wv = filter2D(difv2, K)
 
-    Ks = Ke.T
-    Kn = Kw.T
 
-    Ww = filter2D(wh, Kw)
-    We = filter2D(wh, Ke)
-    Wn = filter2D(wv, Kn)
-    Ws = filter2D(wv, Ks)
 
-    Ww = 1 / (Ww * Ww + 1e-32)
-    We = 1 / (We * We + 1e-32)
-    Ws = 1 / (Ws * Ws + 1e-32)
-    Wn = 1 / (Wn * Wn + 1e-32)
- 
-    return Wn, Ws, We, Ww
+def directional_difference(difh, difv, difh2, difv2):
+    """
+    final color difference estimate (last part of the 3rd step of GBTF, line 19 of Algorithm 5):
+    the directional color differences smoothed by the kernels of DirectsSmooth4Kernel, blended with
+    the weights of Means4Weights
+        dif = (Wn * difn + Ws * difs + Ww * difw + We * dife) / (Ww + We + Wn + Ws)
+    the four directional differences are filtered in turn in the same buffer, added to dif in place
+    """
+    Kn, Ks, Ke, Kw = DirectsSmooth4Kernel()
+    Wn, Ws, We, Ww = Means4Weights(difh2, difv2)
 
+    Wt = np.add(Ww, We)
+    Wt += Wn
+    Wt += Ws
 
+    dif = filter2D(difv, Kn)
+    dif *= Wn
+    directional = np.empty_like(dif)
+    for difd, K, W in ((difv, Ks, Ws), (difh, Kw, Ww), (difh, Ke, We)):
+        filter2D(difd, K, dst=directional)
+        directional *= W
+        dif += directional
+    dif /= Wt
 
+    return dif
 
-def green_interpolation(mosaic, mask, pattern):
+
+
+
+def green_interpolation(rawq, mask, pattern):
     """ 
     green interpolation implementing Residual Interpolation demosaicking 
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         sigma: directional weight smoothing (ignored by GBTF)
@@ -67,36 +100,23 @@ def green_interpolation(mosaic, mask, pattern):
         dif: green residual image
     """
 
-    # raw CFA data
-    rawq = np.sum(mosaic, axis=2)
-
     ### Calculate Horizontal and Vertical Color Differences ###
     # mask
     maskGr, maskGb, _, _ = get_mosaic_masks(rawq,pattern)
 
 
-    difh, difv, difh2, difv2 = haresidual(rawq, mask, maskGr, maskGb, mosaic)
+    difh, difv, difh2, difv2 = haresidual(rawq, mask, maskGr, maskGb)
 
     ## final color differece estimate (last part of the 3rd step)
-    # directional weight. These lines implement line 19 of Algorithm 5
-    Kn, Ks, Ke, Kw = DirectsSmooth4Kernel()
-    Wn, Ws, We, Ww = Means4Weights(difh2, difv2)
-
-    # combine directional color differences
-    difn = filter2D(difv, Kn)
-    difs = filter2D(difv, Ks)
-    dife = filter2D(difh, Ke)
-    difw = filter2D(difh, Kw)
-
-    Wt = Ww + We + Wn + Ws
-    dif = (Wn * difn + Ws * difs + Ww * difw + We * dife) / Wt
+    dif = directional_difference(difh, difv, difh2, difv2)
 
     # Calculate Green by adding bayer raw data (4th step)
     green = dif + rawq
 
-    green = green * (1-mask[:, :, 1]) + rawq * mask[:, :, 1]
+    green *= 1 - mask[:, :, 1]
+    green += rawq * mask[:, :, 1]
 
     # clip to 0-255
-    green = np.clip(green, 0, 255).astype(np.uint8)
+    green = np.clip(green, 0, 255, out=green).astype(np.uint8)
 
     return green, dif
@@ -0,0 +1,255 @@
+import numpy as np
+from utils import getGaussianKernel, separableKernel, mask_phase
+
+try:
+    import numba
+except ImportError:  # the 'numba' backend falls back to the NumPy/OpenCV implementation
+    numba = None
+
+# True when the chain can be compiled (numba is installed)
+NUMBA_AVAILABLE = numba is not None
+
+# width of the replicated border of the images of the chain: the largest radius of its filters (the directional ones)
+PAD = 4
+
+
+def jit(parallel=False):
+    """
+    decorator compiling a function with numba (cached on disk, parallel loops over the rows with prange),
+    the function is returned unchanged without numba.
+    The cache refers to the functions by the name of this module, which must stay in sys.modules:
+    the run script imports it with run_<method>.load_numba_backend
+    """
+    def decorator(func):
+        if numba is None:
+            return func
+        return numba.njit(parallel=parallel, cache=True)(func)
+    return decorator
+
+
+prange = numba.prange if numba is not None else range
+
+
+@jit()
+def _replicate(im, height, width):
+    """
+    fills the border of PAD pixels around the height x width interior of im by replicating its edges,
+    like the BORDER_REPLICATE extension of cv2.filter2D
+    """
+    for y in range(PAD, PAD + height):
+        for x in range(PAD):
+            im[y, x] = im[y, PAD]
+            im[y, PAD + width + x] = im[y, PAD + width - 1]
+    for y in range(PAD):
+        im[y] = im[PAD]
+        im[PAD + height + y] = im[PAD + height - 1]
+
+
+# Each pass below reads padded images and writes the interior of padded ones, the loops over the pixels
+# are free of border tests. The sums accumulate the non null taps in the row major order of cv2.filter2D.
+
+@jit(parallel=True)
+def _color_differences(Q, sign, f, difh, difv, height, width):
+    """
+    HaResidual: HA interpolation with f and color differences, difh = sign * (rawh - rawq) with sign 1 on R and B
+    and -1 on G (i.e. rawq - rawh), likewise difv
+    """
+    for i in prange(height):
+        y = i + PAD
+        s0, s1 = sign[i % 2, 0], sign[i % 2, 1]
+        for j in range(width):
+            x = j + PAD
+            s = s0 + (s1 - s0) * (j % 2)
+            rawh = f[0] * Q[y, x - 2] + f[1] * Q[y, x - 1] + f[2] * Q[y, x] + f[3] * Q[y, x + 1] + f[4] * Q[y, x + 2]
+            rawv = f[0] * Q[y - 2, x] + f[1] * Q[y - 1, x] + f[2] * Q[y, x] + f[3] * Q[y + 1, x] + f[4] * Q[y + 2, x]
+            difh[y, x] = s * (rawh - Q[y, x])
+            difv[y, x] = s * (rawv - Q[y, x])
+
+
+@jit(parallel=True)
+def _gradients(difh, difv, difh2, difv2, height, width):
+    """
+    HaResidual: color difference gradients, difh2 = filter2D(abs(filter2D(difh, [[1, 0, -1]])), [[1, 1, 1]].T)
+    and difv2 likewise with the transposed filters
+    """
+    for i in prange(height):
+        y = i + PAD
+        for j in range(width):
+            x = j + PAD
+            difh2[y, x] = (abs(difh[y - 1, x - 1] - difh[y - 1, x + 1]) + abs(difh[y, x - 1] - difh[y, x + 1])
+                           + abs(difh[y + 1, x - 1] - difh[y + 1, x + 1]))
+            difv2[y, x] = (abs(difv[y - 1, x - 1] - difv[y + 1, x - 1]) + abs(difv[y - 1, x] - difv[y + 1, x])
+                           + abs(difv[y - 1, x + 1] - difv[y + 1, x + 1]))
+
+
+@jit(parallel=True)
+def _smooth_rows(difh2, difv2, g, th, tv, height, width):
+    """
+    Means4Weights: row pass of the separable Gaussian means (the row kernel g of cv2.sepFilter2D)
+    """
+    for i in prange(height):
+        y = i + PAD
+        for j in range(width):
+            x = j + PAD
+            th[y, x] = (g[0] * difh2[y, x - 2] + g[1] * difh2[y, x - 1] + g[2] * difh2[y, x]
+                        + g[3] * difh2[y, x + 1] + g[4] * difh2[y, x + 2])
+            tv[y, x] = (g[0] * difv2[y, x - 2] + g[1] * difv2[y, x - 1] + g[2] * difv2[y, x]
+                        + g[3] * difv2[y, x + 1] + g[4] * difv2[y, x + 2])
+
+
+@jit(parallel=True)
+def _weights(th, tv, g, eps, Rh, Rv, height, width):
+    """
+    Means4Weights: column pass of the separable Gaussian means w (the column kernel g), and W = 1 / (w * w + eps)
+    """
+    for i in prange(height):
+        y = i + PAD
+        for j in range(width):
+            x = j + PAD
+            w = g[0] * th[y - 2, x] + g[1] * th[y - 1, x] + g[2] * th[y, x] + g[3] * th[y + 1, x] + g[4] * th[y + 2, x]
+            Rh[y, x] = 1 / (w * w + eps)
+            w = g[0] * tv[y - 2, x] + g[1] * tv[y - 1, x] + g[2] * tv[y, x] + g[3] * tv[y + 1, x] + g[4] * tv[y + 2, x]
+            Rv[y, x] = 1 / (w * w + eps)
+
+
+@jit(parallel=True)
+def _green(Q, maskG, difh, difv, Rh, Rv, e, dif, green, height, width):
+    """
+    green_interpolation: the directional color differences (the taps e of Ke and Ks, reversed for Kw and Kn)
+    blended with the weights Ww, We, Wn, Ws (the one pixel shifts of Rh and Rv),
+    and green = np.clip((dif + rawq) * (1 - maskG) + rawq * maskG, 0, 255) as uint8
+    """
+    for i in prange(height):
+        y = i + PAD
+        m0, m1 = maskG[i % 2, 0], maskG[i % 2, 1]
+        for j in range(width):
+            x = j + PAD
+            m = m0 + (m1 - m0) * (j % 2)
+            Ww, We, Wn, Ws = Rh[y, x - 1], Rh[y, x + 1], Rv[y - 1, x], Rv[y + 1, x]
+            difn = (e[4] * difv[y - 4, x] + e[3] * difv[y - 3, x] + e[2] * difv[y - 2, x] + e[1] * difv[y - 1, x]
+                    + e[0] * difv[y, x])
+            difs = (e[0] * difv[y, x] + e[1] * difv[y + 1, x] + e[2] * difv[y + 2, x] + e[3] * difv[y + 3, x]
+                    + e[4] * difv[y + 4, x])
+            dife = (e[0] * difh[y, x] + e[1] * difh[y, x + 1] + e[2] * difh[y, x + 2] + e[3] * difh[y, x + 3]
+                    + e[4] * difh[y, x + 4])
+            difw = (e[4] * difh[y, x - 4] + e[3] * difh[y, x - 3] + e[2] * difh[y, x - 2] + e[1] * difh[y, x - 1]
+                    + e[0] * difh[y, x])
+            d = (Wn * difn + Ws * difs + Ww * difw + We * dife) / (Ww + We + Wn + Ws)
+            dif[y, x] = d
+            green[y, x] = np.uint8(min(max((d + Q[y, x]) * (1 - m) + Q[y, x] * m, 0), 255))
+
+
+@jit(parallel=True)
+def _red_blue(Q, maskR, maskB, dif, green, a, c, red, blue, height, width):
+    """
+    red/blue_interpolation (line 4 of Algorithm 4): red = mosaic R + maskB * (green - filter2D(dif, Prb)),
+    blue = mosaic B + maskR * (green - filter2D(dif, Prb)), with the taps a = -1/32 and c = 10/32 of Prb
+    """
+    for i in prange(height):
+        y = i + PAD
+        r0, r1 = maskR[i % 2, 0], maskR[i % 2, 1]
+        b0, b1 = maskB[i % 2, 0], maskB[i % 2, 1]
+        for j in range(width):
+            x = j + PAD
+            mR = r0 + (r1 - r0) * (j % 2)
+            mB = b0 + (b1 - b0) * (j % 2)
+            P = (a * dif[y - 3, x - 1] + a * dif[y - 3, x + 1]
+                 + a * dif[y - 1, x - 3] + c * dif[y - 1, x - 1] + c * dif[y - 1, x + 1] + a * dif[y - 1, x + 3]
+                 + a * dif[y + 1, x - 3] + c * dif[y + 1, x - 1] + c * dif[y + 1, x + 1] + a * dif[y + 1, x + 3]
+                 + a * dif[y + 3, x - 1] + a * dif[y + 3, x + 1])
+            residual = green[y, x] - P
+            red[y, x] = Q[y, x] * mR + mB * residual
+            blue[y, x] = Q[y, x] * mB + mR * residual
+
+
+@jit(parallel=True)
+def _rgb(Q, maskG, green, red, blue, k, rgb, height, width):
+    """
+    red/blue_interpolation: red += mosaic G - maskG * filter2D(green, Aknl) + maskG * filter2D(red, Aknl)
+    (k = 1/4 are the taps of Aknl, the filter of the uint8 green is rounded like cv2.filter2D), likewise blue,
+    and the clipped uint8 rgb image
+    """
+    for i in prange(height):
+        y = i + PAD
+        m0, m1 = maskG[i % 2, 0], maskG[i % 2, 1]
+        for j in range(width):
+            x = j + PAD
+            m = m0 + (m1 - m0) * (j % 2)
+            Ag = np.rint(np.float32(0.25) * green[y - 1, x] + np.float32(0.25) * green[y, x - 1]
+                         + np.float32(0.25) * green[y, x + 1] + np.float32(0.25) * green[y + 1, x])
+            G = Q[y, x] * m - m * Ag
+            Ar = k * red[y - 1, x] + k * red[y, x - 1] + k * red[y, x + 1] + k * red[y + 1, x]
+            Ab = k * blue[y - 1, x] + k * blue[y, x - 1] + k * blue[y, x + 1] + k * blue[y + 1, x]
+            rgb[i, j, 0] = np.uint8(min(max(red[y, x] + (G + m * Ar), 0), 255))
+            rgb[i, j, 1] = green[y, x]
+            rgb[i, j, 2] = np.uint8(min(max(blue[y, x] + (G + m * Ab), 0), 255))
+
+
+def demosaic_gbtf(rawq, mask):
+    """
+    GBTF demosaicking of the raw CFA data (rawq, float64 or float32) with the 3 channel mask, compiled with numba:
+    the chain of stencils of haresidual, green_interpolation, red_interpolation and blue_interpolation
+    runs in 6 passes over the CFA, each a single loop computing its filters in registers (no temporary
+    image per filter), parallel over the rows, on images extended by a replicated border of PAD pixels.
+    The result matches the NumPy/OpenCV implementation up to the rounding of the sums, which changes
+    the uint8 value of a few pixels by 1.
+    returns: the uint8 HxWx3 rgb image
+    """
+    dtype = rawq.dtype
+    height, width = rawq.shape
+
+    # masks of the 2x2 Bayer cell
+    maskR, maskB = np.zeros((2, 2), dtype=dtype), np.zeros((2, 2), dtype=dtype)
+    maskR[mask_phase(mask[:, :, 0])] = 1
+    maskB[mask_phase(mask[:, :, 2])] = 1
+    maskG = 1 - maskR - maskB
+    sign = 1 - 2 * maskG
+
+    # taps of the filters, in the type of the images
+    f = np.array([-1/4, 1/2, 1/2, 1/2, -1/4], dtype=dtype)
+    column, row = separableKernel(np.multiply(getGaussianKernel(5, 2), (getGaussianKernel(5, 2)).T))[0]
+    row, column = row.astype(dtype), column.astype(dtype)
+    e = (np.array([26, 24, 21, 17, 12]) / 100).astype(dtype)
+    a, c = dtype.type(-1/32), dtype.type(10/32)
+
+    def padded(dtype=dtype):
+        return np.empty((height + 2 * PAD, width + 2 * PAD), dtype=dtype)
+
+    Q = padded()
+    Q[PAD:-PAD, PAD:-PAD] = rawq
+    _replicate(Q, height, width)
+
+    difh, difv = padded(), padded()
+    _color_differences(Q, sign, f, difh, difv, height, width)
+    _replicate(difh, height, width)
+    _replicate(difv, height, width)
+
+    difh2, difv2 = padded(), padded()
+    _gradients(difh, difv, difh2, difv2, height, width)
+    _replicate(difh2, height, width)
+    _replicate(difv2, height, width)
+
+    th, tv = padded(), padded()
+    _smooth_rows(difh2, difv2, row, th, tv, height, width)
+    _replicate(th, height, width)
+    _replicate(tv, height, width)
+    # the buffers of the gradients receive the weights
+    Rh, Rv = difh2, difv2
+    _weights(th, tv, column, dtype.type(1e-32), Rh, Rv, height, width)
+    _replicate(Rh, height, width)
+    _replicate(Rv, height, width)
+
+    dif, green = th, padded(np.uint8)
+    _green(Q, maskG, difh, difv, Rh, Rv, e, dif, green, height, width)
+    _replicate(dif, height, width)
+    _replicate(green, height, width)
+
+    red, blue = difh, difv
+    _red_blue(Q, maskR, maskB, dif, green, a, c, red, blue, height, width)
+    _replicate(red, height, width)
+    _replicate(blue, height, width)
+
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    _rgb(Q, maskG, green, red, blue, dtype.type(1/4), rgb, height, width)
+
+    return rgb
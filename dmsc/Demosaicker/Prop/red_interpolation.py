@@ -1,16 +1,16 @@
 import numpy as np
-from utils import filter2D
+from utils import filter2D, get_mosaic_masks, mask_phase, phase_plane
 
 
 
 
-def red_interpolation(green, mosaic, mask, pattern, dif):
+def red_interpolation(green, rawq, mask, pattern, dif):
     """ 
     red interpolation implementing Residual Interpolation demosaicking
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
         green: image containing the interpolated green channel
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         h,v: support of the guided filter
@@ -31,11 +31,22 @@ def red_interpolation(green, mosaic, mask, pattern, dif):
     Aknl = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]]) / 4
 
     # this line corresponds to line 4 of Algorithm 4
-    red = mosaic[:, :, 0] + mask[:, :, 2] * (green - filter2D(dif, Prb))
+    #   red = mosaic[:, :, 0] + mask[:, :, 2] * (green - filter2D(dif, Prb))
+    # the mosaic is the raw data on the phases of its channel, it is added on the phase plane of R
+    red = mask[:, :, 2] * (green - filter2D(dif, Prb))
+    R = mask_phase(mask[:, :, 0])
+    np.add(phase_plane(red, R), phase_plane(rawq, R), out=phase_plane(red, R))
     # this line computes:  G - [\hat G - \hat R] \otimes K_A 
-    tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl)\
-              + mask[:, :, 1] * filter2D(red, Aknl)
-    red = red + tempimg
+    #   tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl) + mask[:, :, 1] * filter2D(red, Aknl)
+    #   red = red + tempimg
+    # tempimg is null outside the G pixels: it is computed on the phase planes of Gr and Gb
+    Kgreen = filter2D(green, Aknl)
+    Kred = filter2D(red, Aknl)
+    maskGr, maskGb, _, _ = get_mosaic_masks(rawq, pattern)
+    for G in (mask_phase(maskGr), mask_phase(maskGb)):
+        tempimg = phase_plane(rawq, G) - phase_plane(Kgreen, G)
+        tempimg += phase_plane(Kred, G)
+        np.add(phase_plane(red, G), tempimg, out=phase_plane(red, G))
 
     # R interpolation
     red = np.clip(red, 0, 255).astype(np.uint8)
@@ -1,25 +1,67 @@
 import numpy as np
+from utils import bayer_masks, mosaic_cfa
 #import green_interpolation
 from green_interpolation import green_interpolation
 from red_interpolation import red_interpolation
 from blue_interpolation import blue_interpolation
+import importlib.util
+import sys
 import os
 
-def demosaic_function(mosaic_data):
+# pixels of CFA needed around a tile to demosaic it exactly (see tiling.demosaic_tiled):
+# the support of the chained green, red and blue filters, rounded up to an even number
+HALO = 10
+
+
+def load_numba_backend():
+    """
+    Imports numba_backend.py of this folder, once, under a name of its own (<folder>_numba_backend) kept in sys.modules.
+    The numba cache on disk refers to the compiled functions by their module name, and CDMImager.import_method_script
+    removes this folder from sys.path and its modules from sys.modules once the method is imported:
+    a stable name keeps the cache loadable by the later processes, whichever way the method is imported.
+    Imported on the first use of the 'numba' backend, numba (and its compilation) stays out of the 'opencv' one.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    name = os.path.basename(folder) + '_numba_backend'
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(folder, 'numba_backend.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
+
+def demosaic_function(mosaic_data, dtype=np.float64, backend='opencv'):
     """
     Main function for the Residual Interpolation demosaicking
     algorithms 'GBTF', 'RI', 'MLRI', 'WMLRI'
     sigma is ignored by GBTF
+    mosaic_data is either (mosaic, mask, pattern) or (cfa, pattern) with a single plane HxW CFA
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
+    backend: 'opencv' (NumPy and OpenCV filters) or 'numba' (the chain compiled with numba, see
+    numba_backend.demosaic_gbtf), which falls back to 'opencv' when numba is not installed
     """
+    if backend not in ('opencv', 'numba'):
+        raise ValueError(f"Unknown backend: {backend}")
 
-    # mosaic and mask (just to generate the mask)
-    mosaic, mask, pattern = mosaic_data
-    
-    # imask
-    imask = (mask == 0)
+    # the algorithms work on the raw CFA data (rawq) and the masks of the pattern,
+    # a 3 channel mosaic is flattened to its CFA (its mask follows the pattern)
+    mosaic, pattern = mosaic_data[0], mosaic_data[-1]
+    if mosaic.ndim == 2:
+        rawq = mosaic.astype(dtype, copy=False)
+    else:
+        rawq = mosaic_cfa(mosaic, pattern, dtype)
+    mask = bayer_masks(rawq.shape[0], rawq.shape[1], pattern, dtype)[0]
+
+    numba_backend = load_numba_backend() if backend == 'numba' else None
+    if numba_backend is not None and numba_backend.NUMBA_AVAILABLE:
+        return numba_backend.demosaic_gbtf(rawq, mask)
 
     # green interpolation
-    green, dif = green_interpolation(mosaic, mask, pattern)
+    green, dif = green_interpolation(rawq, mask, pattern)
 
     # parameters for guided upsampling
     h = 5
@@ -27,12 +69,12 @@ def demosaic_function(mosaic_data):
     eps = 0
 
     # Red and Blue demosaicking
-    red = red_interpolation(green, mosaic, mask, pattern, dif)
-    blue = blue_interpolation(green, mosaic, mask, pattern, dif)
+    red = red_interpolation(green, rawq, mask, pattern, dif)
+    blue = blue_interpolation(green, rawq, mask, pattern, dif)
 
 
     # result image
-    rgb_size = mosaic.shape
+    rgb_size = rawq.shape
     rgb_dem = np.zeros((rgb_size[0], rgb_size[1], 3),dtype=np.uint8)
     rgb_dem[:, :, 0] = red
     rgb_dem[:, :, 1] = green
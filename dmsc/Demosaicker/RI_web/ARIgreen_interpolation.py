@@ -1,26 +1,44 @@
+import cv2
 import numpy as np
+import dmsc_root  # makes tiling importable
+from tiling import even, tile_slices
 from ARIguidedfilter import guidedfilter
 from ARIguidedfilter_MLRI import guidedfilter_MLRI
-from filtertools import filter2D, getGaussianKernel
-from mosaic_bayer import get_mosaic_masks
+from filtertools import filter2D, filter2DStack, getGaussianKernel, ArgminAccumulator, Workspace
+from mosaic_bayer import get_mosaic_masks, mask_phase, phase_plane
 
 
 
 # This functions implements Algorithm 7 and 8
-def ARIgreen_interpolation(mosaic, mask, pattern, eps):
+def ARIgreen_interpolation(rawq, mask, pattern, eps, min_improved=None, iterations=None,
+                           active_tile_size=None, workspace=None):
     """
     green interpolation for the ARI (Adaptive Residual Interpolation) demosaicking algorithm
     Arguments: 
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         eps: regularization parameter (recommended: 1e-10)
+        min_improved: if given, each of the four directional interpolations (RI and MLRI, horizontal and vertical)
+            stops iterating once an iteration improves less than this fraction of the pixels (e.g. 0.05),
+            instead of running all the iterations. A pixel is improved when its iteration criterion decreases
+            and its interpolated G value changes by more than half a grey level
+        iterations: if a dict, receives for each directional interpolation ('RI_h', 'RI_v', 'MLRI_h', 'MLRI_v')
+            the list of the numbers of pixels improved by its iterations (its length is the number of iterations)
+        active_tile_size: if given, active-set mode: the frame is split in tiles of active_tile_size x active_tile_size
+            pixels (e.g. 128, rounded up to an even size) and a directional interpolation stops recomputing the tiles
+            where its last iteration improved no pixel and no neighbour tile within the support of the next iteration
+            did, they keep their guides and G values (large flat regions converge early).
+            This is an approximation: an inactive tile skips the later iterations, whose windows are larger, and
+            the changes of less than half a grey level of its neighbours, so the result depends on the tile size
+        workspace: optional Workspace holding the intermediate images of the iterations, reused by the next calls
+            (not used by the tiles of the active-set mode, whose size changes)
     Returns: 
         green: the interpolated green channel 
     """
 
-    # raw CFA data
-    rawq = np.sum(mosaic, axis=2)
+    if active_tile_size is not None:
+        active_tile_size = even(active_tile_size)
 
     # mask 
     maskGr, maskGb, maskR, maskB = get_mosaic_masks(rawq,pattern)
@@ -41,18 +59,6 @@ def ARIgreen_interpolation(mosaic, mask, pattern, eps):
     rawh = filter2D(rawq, Kh)
     rawv = filter2D(rawq, Kv)
 
-    # horizontal direction  (Algo 7 line 8)
-    Guidegrh = mosaic[:, :, 1] * maskGr + rawh * maskR 
-    Guidegbh = mosaic[:, :, 1] * maskGb + rawh * maskB 
-    Guiderh = mosaic[:, :, 0] + rawh * maskGr
-    Guidebh = mosaic[:, :, 2] + rawh * maskGb
-
-    # vertical direction
-    Guidegrv = mosaic[:, :, 1] * maskGb + rawv * maskR 
-    Guidegbv = mosaic[:, :, 1] * maskGr + rawv * maskB 
-    Guiderv = mosaic[:, :, 0] + rawv * maskGb
-    Guidebv = mosaic[:, :, 2] + rawv * maskGr
-
     # initial guided filter window size for RI
     h = 2
     v = 1
@@ -64,291 +70,267 @@ def ARIgreen_interpolation(mosaic, mask, pattern, eps):
     # maximum iteration number
     itnum = 11
 
-    # initialization of horizontal and vertical iteration criteria (Algo 7 line 11)
-    RI_w2h = np.ones(maskGr.shape) * 1e32
-    RI_w2v = np.ones(maskGr.shape) * 1e32
-
-    MLRI_w2h = np.ones(maskGr.shape) * 1e32
-    MLRI_w2v = np.ones(maskGr.shape) * 1e32
-
-    # initial guide image for RI  (Algo 7 line 8)
-    RI_Guidegrh = Guidegrh
-    RI_Guidegbh = Guidegbh
-    RI_Guiderh = Guiderh
-    RI_Guidebh = Guidebh
-    RI_Guidegrv = Guidegrv
-    RI_Guidegbv = Guidegbv
-    RI_Guiderv = Guiderv
-    RI_Guidebv = Guidebv
-
-    # initial guide image for MLRI
-    MLRI_Guidegrh = Guidegrh
-    MLRI_Guidegbh = Guidegbh
-    MLRI_Guiderh = Guiderh
-    MLRI_Guidebh = Guidebh
-    MLRI_Guidegrv = Guidegrv
-    MLRI_Guidegbv = Guidegbv
-    MLRI_Guiderv = Guiderv
-    MLRI_Guidebv = Guidebv
-
-    # initialization of interpolated G values  (Algo 7 line 10)
-    RI_Gh = Guidegrh + Guidegbh
-    RI_Gv = Guidegrv + Guidegbv
-    MLRI_Gh = Guidegrh + Guidegbh
-    MLRI_Gv = Guidegrv + Guidegbv
+    # the four directional interpolations work on stacks of (Gr, Gb, R, B) images, where Gr (Gb) are the
+    # green pixels on the red (blue) rows in the horizontal direction, and columns in the vertical one.
+    # Their mosaic planes (G * mGr, G * mGb, R, B) are the raw data on the phases of the residual masks
+    directions = {}
+    for direction, raw, mGr, mGb, Mr, Mb, K, F, Flap in (
+            ('h', rawh, maskGr, maskGb, Mrh, Mbh,
+             np.array([[1 / 2, 1, 1 / 2]]), np.array([[-1, 0, 1]]), -np.array([[-1, 0, 2, 0, -1]])),
+            ('v', rawv, maskGb, maskGr, Mrv, Mbv,
+             np.array([[1 / 2, 1, 1 / 2]]).T, np.array([[-1, 0, 1]]).T, -np.array([[-1, 0, 2, 0, -1]]).T)):
+        residual_masks = np.stack((mGr, mGb, maskR, maskB))
+        estimate_masks = np.stack((maskR, maskB, mGr, mGb))
+        # known values of the guide images
+        known = rawq * residual_masks
+        directions[direction] = dict(
+            # initial guide images (Algo 7 line 8), e.g. G * mGr + raw * maskR
+            Guide=known + raw * estimate_masks, known=known,
+            # masks of the residuals, of the tentative estimates and of the iteration criteria
+            residual_masks=residual_masks, estimate_masks=estimate_masks,
+            criteria_masks=np.stack((Mr, Mb, Mr, Mb)), Mr=Mr, Mb=Mb,
+            # masks of the guided filters, and of the Laplacian kernel maps of MLRI
+            gf_masks=(Mr, Mb, Mr, Mb), lap_masks=(mGr, mGb, maskR, maskB),
+            # residual interpolation, gradient of the iteration criteria and MLRI Laplacian filters
+            K=K, F=F, Flap=Flap)
+
+    # state of the RI and MLRI horizontal and vertical interpolations: guide images, interpolated G values
+    # (Algo 7 line 10) and minimum iteration criteria (Algo 7 line 11), selected in place by an ArgminAccumulator
+    states = {}
+    for Algorithm in ('RI', 'MLRI'):
+        for direction, d in directions.items():
+            G = d['Guide'][0] + d['Guide'][1]
+            w2 = np.ones(maskGr.shape, dtype=rawq.dtype) * 1e32
+            states[Algorithm + '_' + direction] = dict(
+                Algorithm=Algorithm, direction=direction, Guide=d['Guide'], G=G, w2=w2,
+                selection=ArgminAccumulator(w2, G), improved=[], estimate_masks=d['estimate_masks'])
+            if active_tile_size is not None:
+                # tiles still improving in active-set mode, all of them at first
+                tiles = (-(-maskGr.shape[0] // active_tile_size), -(-maskGr.shape[1] // active_tile_size))
+                states[Algorithm + '_' + direction]['tiles'] = np.ones(tiles, dtype=bool)
+    # the vertical MLRI interpolation masks its R estimate like its B one (with maskGr), kept as it was
+    states['MLRI_v']['estimate_masks'] = np.stack((maskR, maskB, maskGr, maskGr))
+
+    # smoothing filter of the iteration criteria (Algo 8 line 8-9)
+    sigma = 2
+    Fs = getGaussianKernel(5, sigma) * getGaussianKernel(5, sigma).T
 
     # Iterative horizontal and vertical interpolation
+    height, width = maskGr.shape
+    track_improved = min_improved is not None or active_tile_size is not None or iterations is not None
+    if active_tile_size is not None:
+        # slices of the tiles, and of the tiles extended by the halo of each iteration, computed once
+        frames = [frame for frame, _, _ in tile_slices(height, width, active_tile_size, 0)]
+        extended_tiles = {}
+    active = list(states)
     for ittime in range(itnum):
-        # generate horizontal and vertical tentative estimate (Algo 7 line 17)
-        RI_tentativeGrh = guidedfilter(RI_Guiderh, RI_Guidegrh, Mrh, h, v, eps, direction='HV')
-        RI_tentativeGbh = guidedfilter(RI_Guidebh, RI_Guidegbh, Mbh, h, v, eps, direction='HV')
-        RI_tentativeRh = guidedfilter(RI_Guidegrh, RI_Guiderh, Mrh, h, v, eps, direction='HV')
-        RI_tentativeBh = guidedfilter(RI_Guidegbh, RI_Guidebh, Mbh, h, v, eps, direction='HV')
-        RI_tentativeGrv = guidedfilter(RI_Guiderv, RI_Guidegrv, Mrv, v, h, eps, direction='HV')
-        RI_tentativeGbv = guidedfilter(RI_Guidebv, RI_Guidegbv, Mbv, v, h, eps, direction='HV')
-        RI_tentativeRv = guidedfilter(RI_Guidegrv, RI_Guiderv, Mrv, v, h, eps, direction='HV')
-        RI_tentativeBv = guidedfilter(RI_Guidegbv, RI_Guidebv, Mbv, v, h, eps, direction='HV')
-
-        # generate horizontal tentative estimate by MLRI (Algo 7 line 17)
-        Fh = -np.array([[-1, 0, 2, 0, -1]])
-        MLRI_tentativeRh = guidedfilter_MLRI(MLRI_Guidegrh, MLRI_Guiderh, Mrh, maskR , h2, v2, eps, direction='HV', F=Fh)
-        MLRI_tentativeBh = guidedfilter_MLRI(MLRI_Guidegbh, MLRI_Guidebh, Mbh, maskB , h2, v2, eps, direction='HV', F=Fh)
-        MLRI_tentativeGrh = guidedfilter_MLRI(MLRI_Guiderh, MLRI_Guidegrh, Mrh, maskGr, h2, v2, eps, direction='HV', F=Fh)
-        MLRI_tentativeGbh = guidedfilter_MLRI(MLRI_Guidebh, MLRI_Guidegbh, Mbh, maskGb, h2, v2, eps, direction='HV', F=Fh)
-
-        # generate vertical tentative estimate by MLRI (Algo 7 line 17)
-        Fv = Fh.T
-        MLRI_tentativeRv = guidedfilter_MLRI(MLRI_Guidegrv, MLRI_Guiderv, Mrv, maskR , v2, h2, eps, direction='HV', F=Fv)
-        MLRI_tentativeBv = guidedfilter_MLRI(MLRI_Guidegbv, MLRI_Guidebv, Mbv, maskB , v2, h2, eps, direction='HV', F=Fv)
-        MLRI_tentativeGrv = guidedfilter_MLRI(MLRI_Guiderv, MLRI_Guidegrv, Mrv, maskGb, v2, h2, eps, direction='HV', F=Fv)
-        MLRI_tentativeGbv = guidedfilter_MLRI(MLRI_Guidebv, MLRI_Guidegbv, Mbv, maskGr, v2, h2, eps, direction='HV', F=Fv)
-
-        # calculate residuals of RI and MLRI (Algo 7 line 18)
-        RI_residualGrh = (mosaic[:, :, 1] - RI_tentativeGrh) * maskGr
-        RI_residualGbh = (mosaic[:, :, 1] - RI_tentativeGbh) * maskGb
-        RI_residualRh = (mosaic[:, :, 0] - RI_tentativeRh) * maskR 
-        RI_residualBh = (mosaic[:, :, 2] - RI_tentativeBh) * maskB 
-        RI_residualGrv = (mosaic[:, :, 1] - RI_tentativeGrv) * maskGb
-        RI_residualGbv = (mosaic[:, :, 1] - RI_tentativeGbv) * maskGr
-        RI_residualRv = (mosaic[:, :, 0] - RI_tentativeRv) * maskR 
-        RI_residualBv = (mosaic[:, :, 2] - RI_tentativeBv) * maskB 
-        MLRI_residualGrh = (mosaic[:, :, 1] - MLRI_tentativeGrh) * maskGr
-        MLRI_residualGbh = (mosaic[:, :, 1] - MLRI_tentativeGbh) * maskGb
-        MLRI_residualRh = (mosaic[:, :, 0] - MLRI_tentativeRh) * maskR 
-        MLRI_residualBh = (mosaic[:, :, 2] - MLRI_tentativeBh) * maskB 
-        MLRI_residualGrv = (mosaic[:, :, 1] - MLRI_tentativeGrv) * maskGb
-        MLRI_residualGbv = (mosaic[:, :, 1] - MLRI_tentativeGbv) * maskGr
-        MLRI_residualRv = (mosaic[:, :, 0] - MLRI_tentativeRv) * maskR 
-        MLRI_residualBv = (mosaic[:, :, 2] - MLRI_tentativeBv) * maskB 
-
-        # horizontal and vertical linear interpolation of residuals (Algo 7 line 19)
-        Kh = np.array([[1 / 2, 1, 1 / 2]])
-        RI_residualGrh = filter2D(RI_residualGrh, Kh )
-        RI_residualGbh = filter2D(RI_residualGbh, Kh )
-        RI_residualRh = filter2D(RI_residualRh, Kh )
-        RI_residualBh = filter2D(RI_residualBh, Kh )
-        MLRI_residualGrh = filter2D(MLRI_residualGrh, Kh )
-        MLRI_residualGbh = filter2D(MLRI_residualGbh, Kh )
-        MLRI_residualRh = filter2D(MLRI_residualRh, Kh )
-        MLRI_residualBh = filter2D(MLRI_residualBh, Kh )
-
-        Kv = Kh.T
-        RI_residualGrv = filter2D(RI_residualGrv, Kv )
-        RI_residualGbv = filter2D(RI_residualGbv, Kv )
-        RI_residualRv = filter2D(RI_residualRv, Kv )
-        RI_residualBv = filter2D(RI_residualBv, Kv )
-        MLRI_residualGrv = filter2D(MLRI_residualGrv, Kv )
-        MLRI_residualGbv = filter2D(MLRI_residualGbv, Kv )
-        MLRI_residualRv = filter2D(MLRI_residualRv, Kv )
-        MLRI_residualBv = filter2D(MLRI_residualBv, Kv )
-
-        # add tentative estimate (Algo 7 line 20)
-        RI_Grh = (RI_tentativeGrh + RI_residualGrh) * maskR 
-        RI_Gbh = (RI_tentativeGbh + RI_residualGbh) * maskB 
-        RI_Rh = (RI_tentativeRh + RI_residualRh) * maskGr
-        RI_Bh = (RI_tentativeBh + RI_residualBh) * maskGb
-        RI_Grv = (RI_tentativeGrv + RI_residualGrv) * maskR 
-        RI_Gbv = (RI_tentativeGbv + RI_residualGbv) * maskB 
-        RI_Rv = (RI_tentativeRv + RI_residualRv) * maskGb
-        RI_Bv = (RI_tentativeBv + RI_residualBv) * maskGr
-        MLRI_Grh = (MLRI_tentativeGrh + MLRI_residualGrh) * maskR 
-        MLRI_Gbh = (MLRI_tentativeGbh + MLRI_residualGbh) * maskB 
-        MLRI_Rh = (MLRI_tentativeRh + MLRI_residualRh) * maskGr
-        MLRI_Bh = (MLRI_tentativeBh + MLRI_residualBh) * maskGb
-        MLRI_Grv = (MLRI_tentativeGrv + MLRI_residualGrv) * maskR 
-        MLRI_Gbv = (MLRI_tentativeGbv + MLRI_residualGbv) * maskB 
-        MLRI_Rv = (MLRI_tentativeRv + MLRI_residualRv) * maskGr
-        MLRI_Bv = (MLRI_tentativeBv + MLRI_residualBv) * maskGr
-
-        # Step(ii): adaptive selection of iteration at each pixel
-        # calculate iteration criteria  (Algo 7 line 4)
-        RI_criGrh = (RI_Guidegrh - RI_tentativeGrh) * Mrh
-        RI_criGbh = (RI_Guidegbh - RI_tentativeGbh) * Mbh
-        RI_criRh = (RI_Guiderh - RI_tentativeRh) * Mrh
-        RI_criBh = (RI_Guidebh - RI_tentativeBh) * Mbh
-        RI_criGrv = (RI_Guidegrv - RI_tentativeGrv) * Mrv
-        RI_criGbv = (RI_Guidegbv - RI_tentativeGbv) * Mbv
-        RI_criRv = (RI_Guiderv - RI_tentativeRv) * Mrv
-        RI_criBv = (RI_Guidebv - RI_tentativeBv) * Mbv
-        MLRI_criGrh = (MLRI_Guidegrh - MLRI_tentativeGrh) * Mrh
-        MLRI_criGbh = (MLRI_Guidegbh - MLRI_tentativeGbh) * Mbh
-        MLRI_criRh = (MLRI_Guiderh - MLRI_tentativeRh) * Mrh
-        MLRI_criBh = (MLRI_Guidebh - MLRI_tentativeBh) * Mbh
-        MLRI_criGrv = (MLRI_Guidegrv - MLRI_tentativeGrv) * Mrv
-        MLRI_criGbv = (MLRI_Guidegbv - MLRI_tentativeGbv) * Mbv
-        MLRI_criRv = (MLRI_Guiderv - MLRI_tentativeRv) * Mrv
-        MLRI_criBv = (MLRI_Guidebv - MLRI_tentativeBv) * Mbv
-
-        # calculate gradient of iteration criteria (Algo 8 line 5)
-        Fh = np.array([[-1, 0, 1]])
-        RI_difcriGrh = abs(filter2D(RI_criGrh, Fh ))
-        RI_difcriGbh = abs(filter2D(RI_criGbh, Fh ))
-        RI_difcriRh = abs(filter2D(RI_criRh, Fh ))
-        RI_difcriBh = abs(filter2D(RI_criBh, Fh ))
-        MLRI_difcriGrh = abs(filter2D(MLRI_criGrh, Fh ))
-        MLRI_difcriGbh = abs(filter2D(MLRI_criGbh, Fh ))
-        MLRI_difcriRh = abs(filter2D(MLRI_criRh, Fh ))
-        MLRI_difcriBh = abs(filter2D(MLRI_criBh, Fh ))
-
-        Fv = Fh.T
-        RI_difcriGrv = abs(filter2D(RI_criGrv, Fv ))
-        RI_difcriGbv = abs(filter2D(RI_criGbv, Fv ))
-        RI_difcriRv = abs(filter2D(RI_criRv, Fv ))
-        RI_difcriBv = abs(filter2D(RI_criBv, Fv ))
-        MLRI_difcriGrv = abs(filter2D(MLRI_criGrv, Fv ))
-        MLRI_difcriGbv = abs(filter2D(MLRI_criGbv, Fv ))
-        MLRI_difcriRv = abs(filter2D(MLRI_criRv, Fv ))
-        MLRI_difcriBv = abs(filter2D(MLRI_criBv, Fv ))
-
-        # absolute value of iteration criteria
-        RI_criGrh = abs(RI_criGrh)
-        RI_criGbh = abs(RI_criGbh)
-        RI_criRh = abs(RI_criRh)
-        RI_criBh = abs(RI_criBh)
-        RI_criGrv = abs(RI_criGrv)
-        RI_criGbv = abs(RI_criGbv)
-        RI_criRv = abs(RI_criRv)
-        RI_criBv = abs(RI_criBv)
-        MLRI_criGrh = abs(MLRI_criGrh)
-        MLRI_criGbh = abs(MLRI_criGbh)
-        MLRI_criRh = abs(MLRI_criRh)
-        MLRI_criBh = abs(MLRI_criBh)
-        MLRI_criGrv = abs(MLRI_criGrv)
-        MLRI_criGbv = abs(MLRI_criGbv)
-        MLRI_criRv = abs(MLRI_criRv)
-        MLRI_criBv = abs(MLRI_criBv)
-
-        # add Gr and R (Gb and B) criteria residuals (Algo 8 line 6)
-        RI_criGRh = (RI_criGrh + RI_criRh) * Mrh
-        RI_criGBh = (RI_criGbh + RI_criBh) * Mbh
-        RI_criGRv = (RI_criGrv + RI_criRv) * Mrv
-        RI_criGBv = (RI_criGbv + RI_criBv) * Mbv
-        MLRI_criGRh = (MLRI_criGrh + MLRI_criRh) * Mrh
-        MLRI_criGBh = (MLRI_criGbh + MLRI_criBh) * Mbh
-        MLRI_criGRv = (MLRI_criGrv + MLRI_criRv) * Mrv
-        MLRI_criGBv = (MLRI_criGbv + MLRI_criBv) * Mbv
-
-        # add Gr and R (Gb and B) gradient of criteria residuals
-        RI_difcriGRh = (RI_difcriGrh + RI_difcriRh) * Mrh
-        RI_difcriGBh = (RI_difcriGbh + RI_difcriBh) * Mbh
-        RI_difcriGRv = (RI_difcriGrv + RI_difcriRv) * Mrv
-        RI_difcriGBv = (RI_difcriGbv + RI_difcriBv) * Mbv
-        MLRI_difcriGRh = (MLRI_difcriGrh + MLRI_difcriRh) * Mrh
-        MLRI_difcriGBh = (MLRI_difcriGbh + MLRI_difcriBh) * Mbh
-        MLRI_difcriGRv = (MLRI_difcriGrv + MLRI_difcriRv) * Mrv
-        MLRI_difcriGBv = (MLRI_difcriGbv + MLRI_difcriBv) * Mbv
-
-        # directional map of iteration criteria (Algo 8 line 7)
-        RI_crih = RI_criGRh + RI_criGBh
-        RI_criv = RI_criGRv + RI_criGBv
-        MLRI_crih = MLRI_criGRh + MLRI_criGBh
-        MLRI_criv = MLRI_criGRv + MLRI_criGBv
-
-        # directional gradient map of iteration criteria
-        RI_difcrih = RI_difcriGRh + RI_difcriGBh
-        RI_difcriv = RI_difcriGRv + RI_difcriGBv
-        MLRI_difcrih = MLRI_difcriGRh + MLRI_difcriGBh
-        MLRI_difcriv = MLRI_difcriGRv + MLRI_difcriGBv
-
-        # smoothing of iteration criteria (Algo 8 line 8-9)
-        sigma = 2
-        Fh = getGaussianKernel(5, sigma) * getGaussianKernel(5, sigma).T
-        RI_crih = filter2D(RI_crih, Fh )
-        MLRI_crih = filter2D(MLRI_crih, Fh )
-        RI_difcrih = filter2D(RI_difcrih, Fh )
-        MLRI_difcrih = filter2D(MLRI_difcrih, Fh )
-
-        Fv = Fh 
-        RI_criv = filter2D(RI_criv, Fv )
-        MLRI_criv = filter2D(MLRI_criv, Fv )
-        RI_difcriv = filter2D(RI_difcriv, Fv )
-        MLRI_difcriv = filter2D(MLRI_difcriv, Fv )
-
-        # calcualte iteration criteria  (Algo 8 line 10)
-        RI_wh = (RI_crih ** 2) * (RI_difcrih)
-        RI_wv = (RI_criv ** 2) * (RI_difcriv)
-        MLRI_wh = (MLRI_crih ** 2) * (MLRI_difcrih)
-        MLRI_wv = (MLRI_criv ** 2) * (MLRI_difcriv)
-
-        # find smaller criteria pixels (criteria used in Algo 7 line 24)
-        RI_pih = np.where(RI_wh < RI_w2h)
-        RI_piv = np.where(RI_wv < RI_w2v)
-        MLRI_pih = np.where(MLRI_wh < MLRI_w2h)
-        MLRI_piv = np.where(MLRI_wv < MLRI_w2v)
-
-        # guide updating  (Algo 7 line 22)
-        RI_Guidegrh = mosaic[:, :, 1] * maskGr + RI_Grh
-        RI_Guidegbh = mosaic[:, :, 1] * maskGb + RI_Gbh
-        RI_Guidegh = RI_Guidegrh + RI_Guidegbh
-        RI_Guiderh = mosaic[:, :, 0] + RI_Rh
-        RI_Guidebh = mosaic[:, :, 2] + RI_Bh
-        RI_Guidegrv = mosaic[:, :, 1] * maskGb + RI_Grv
-        RI_Guidegbv = mosaic[:, :, 1] * maskGr + RI_Gbv
-        RI_Guidegv = RI_Guidegrv + RI_Guidegbv
-        RI_Guiderv = mosaic[:, :, 0] + RI_Rv
-        RI_Guidebv = mosaic[:, :, 2] + RI_Bv
-        MLRI_Guidegrh = mosaic[:, :, 1] * maskGr + MLRI_Grh
-        MLRI_Guidegbh = mosaic[:, :, 1] * maskGb + MLRI_Gbh
-        MLRI_Guidegh = MLRI_Guidegrh + MLRI_Guidegbh
-        MLRI_Guiderh = mosaic[:, :, 0] + MLRI_Rh
-        MLRI_Guidebh = mosaic[:, :, 2] + MLRI_Bh
-        MLRI_Guidegrv = mosaic[:, :, 1] * maskGb + MLRI_Grv
-        MLRI_Guidegbv = mosaic[:, :, 1] * maskGr + MLRI_Gbv
-        MLRI_Guidegv = MLRI_Guidegrv + MLRI_Guidegbv
-        MLRI_Guiderv = mosaic[:, :, 0] + MLRI_Rv
-        MLRI_Guidebv = mosaic[:, :, 2] + MLRI_Bv
-
-        # select smallest iteration criteria at each pixel (Algo 7 line 24)
-        RI_Gh[RI_pih[0], RI_pih[1]] = RI_Guidegh[RI_pih[0], RI_pih[1]]
-        MLRI_Gh[MLRI_pih[0], MLRI_pih[1]] = MLRI_Guidegh[MLRI_pih[0], MLRI_pih[1]]
-        RI_Gv[RI_piv[0], RI_piv[1]] = RI_Guidegv[RI_piv[0], RI_piv[1]]
-        MLRI_Gv[MLRI_piv[0], MLRI_piv[1]] = MLRI_Guidegv[MLRI_piv[0], MLRI_piv[1]]
-
-        # update minimum iteration criteria (Algo 7 line 25)
-        RI_w2h[RI_pih[0], RI_pih[1]] = RI_wh[RI_pih[0], RI_pih[1]]
-        RI_w2v[RI_piv[0], RI_piv[1]] = RI_wv[RI_piv[0], RI_piv[1]]
-        MLRI_w2h[MLRI_pih[0], MLRI_pih[1]] = MLRI_wh[MLRI_pih[0], MLRI_pih[1]]
-        MLRI_w2v[MLRI_piv[0], MLRI_piv[1]] = MLRI_wv[MLRI_piv[0], MLRI_piv[1]]
-
-        # guided filter window size update (Algo 7 line 26)
-        h = h + 1
-        v = v + 1
-        h2 = h2 + 1
-        v2 = v2 + 1
+        for name in active:
+            state = states[name]
+            d = directions[state['direction']]
+
+            # guided filter window size, updated at each iteration (Algo 7 line 26)
+            if state['Algorithm'] == 'RI':
+                gh, gv = h + ittime, v + ittime
+            else:
+                gh, gv = h2 + ittime, v2 + ittime
+            if state['direction'] == 'v':
+                gh, gv = gv, gh
+
+            if active_tile_size is None or state['tiles'].all():
+                Guide, w = ARIdirectional_iteration(state['Algorithm'], state['Guide'], d, state['estimate_masks'],
+                                                    rawq, gh, gv, eps, Fs, workspace)
+
+                # find smaller criteria pixels (criteria used in Algo 7 line 24)
+                state['selection'].select(w)
+
+                # guide updating  (Algo 7 line 22)
+                Guideg = Guide[0] + Guide[1]
+                state['Guide'] = Guide
+
+                # pixels whose interpolated G value changes by more than half a grey level,
+                # only counted when they stop the iterations or are reported
+                if track_improved:
+                    changed, improved = state['selection'].changed(Guideg, 0.5)
+                    state['improved'].append(improved)
+                if active_tile_size is not None:
+                    for tile, frame in enumerate(frames):
+                        state['tiles'].flat[tile] = changed[frame].any()
+
+                # select smallest iteration criteria at each pixel (Algo 7 line 24)
+                # and update minimum iteration criteria (Algo 7 line 25)
+                state['selection'].accept(w, Guideg)
+
+            else:
+                # active-set mode: only the tiles still improving are recomputed, from the guides of the previous
+                # iteration extended by the support of an iteration, the other tiles keep their values
+                halo = 2 * max(gh, gv) + 6
+                if halo not in extended_tiles:
+                    extended_tiles[halo] = list(tile_slices(height, width, active_tile_size, halo))
+                Guide = state['Guide'].copy()
+                improved = 0
+                for tile, (frame, extended, core) in enumerate(extended_tiles[halo]):
+                    if not state['tiles'].flat[tile]:
+                        continue
+                    Guide_t, w_t = ARIdirectional_iteration(state['Algorithm'], state['Guide'][:, extended[0], extended[1]],
+                                                            crop_direction(d, extended),
+                                                            state['estimate_masks'][:, extended[0], extended[1]],
+                                                            rawq[extended], gh, gv, eps, Fs)
+                    Guide_t, w_t = Guide_t[:, core[0], core[1]], w_t[core]
+
+                    state['selection'].select(w_t, frame)
+                    Guide[:, frame[0], frame[1]] = Guide_t
+                    Guideg = Guide_t[0] + Guide_t[1]
+                    _, changed = state['selection'].changed(Guideg, 0.5, frame)
+                    improved += changed
+                    state['tiles'].flat[tile] = changed > 0
+                    state['selection'].accept(w_t, Guideg, frame)
+
+                state['Guide'] = Guide
+                state['improved'].append(improved)
+
+            if active_tile_size is not None:
+                # the changed tiles modify the guides inside the halo of the next iteration (2 pixels larger)
+                # of their neighbours, which are recomputed too
+                reach = -(-(2 * max(gh, gv) + 8) // active_tile_size)
+                state['tiles'] = reactivate_neighbours(state['tiles'], reach)
+
+        # the interpolations improving too few pixels stop iterating
+        if min_improved is not None:
+            active = [name for name in active if states[name]['improved'][-1] >= min_improved * maskGr.size]
+            if not active:
+                break
+
+    if iterations is not None:
+        for name, state in states.items():
+            iterations[name] = state['improved']
 
     #  Step(iii): adaptive combining 
     #  combining weight
-    RI_w2h = 1 / (RI_w2h + 1e-10)
-    RI_w2v = 1 / (RI_w2v + 1e-10)
-    MLRI_w2h = 1 / (MLRI_w2h + 1e-10)
-    MLRI_w2v = 1 / (MLRI_w2v + 1e-10)
+    RI_w2h = 1 / (states['RI_h']['w2'] + 1e-10)
+    RI_w2v = 1 / (states['RI_v']['w2'] + 1e-10)
+    MLRI_w2h = 1 / (states['MLRI_h']['w2'] + 1e-10)
+    MLRI_w2v = 1 / (states['MLRI_v']['w2'] + 1e-10)
     w = RI_w2h + RI_w2v + MLRI_w2h + MLRI_w2v
 
+    RI_Gh, RI_Gv = states['RI_h']['G'], states['RI_v']['G']
+    MLRI_Gh, MLRI_Gv = states['MLRI_h']['G'], states['MLRI_v']['G']
+
     # combining (Algo 7 line 30)
     green = (RI_w2h * RI_Gh + RI_w2v * RI_Gv + MLRI_w2h * MLRI_Gh + MLRI_w2v * MLRI_Gv) / (w + 1e-32)
 
-    # final output
-    green = green * (1-mask)[:, :, 1] + mosaic[:, :, 1]
+    # final output, green = green * (1 - mask[:, :, 1]) + mosaic[:, :, 1] with the raw data on the G phase planes
+    green = green * (1 - mask[:, :, 1])
+    for M in (maskGr, maskGb):
+        phase = mask_phase(M)
+        phase_plane(green, phase)[...] += phase_plane(rawq, phase)
     green = np.clip(green, 0, 255)
 
     return green
+
+
+def ARIdirectional_iteration(Algorithm, Guide, d, estimate_masks, rawq, h, v, eps, Fs, workspace=None):
+    """
+    one iteration of a directional interpolation of ARIgreen_interpolation (Algo 7 line 17-22, Algo 8 line 4-10)
+    Arguments:
+        Algorithm: 'RI' or 'MLRI'
+        Guide: stack of the (Gr, Gb, R, B) guide images
+        d: masks and filters of the direction (see ARIgreen_interpolation)
+        estimate_masks: masks of the (Gr, Gb, R, B) tentative estimates
+        rawq: raw CFA data, the (Gr, Gb, R, B) mosaic planes on the phases of the residual masks
+        (h,v) size of the guided filters
+        eps: regularization parameter
+        Fs: smoothing filter of the iteration criteria
+        workspace: optional Workspace holding the intermediate images, reused by the next calls
+    Returns:
+        Guide: the updated guide images
+        w: the iteration criteria (a buffer of the workspace)
+    """
+    # the four guided filters below share their buffers
+    if workspace is None:
+        workspace = Workspace()
+    ws = workspace.scope('ARIdirectional_iteration')
+
+    # generate the (Gr, Gb, R, B) tentative estimates by RI or MLRI (Algo 7 line 17),
+    # guided by the (R, B, Gr, Gb) guide images
+    tentative = ws.empty_like('tentative', Guide)
+    for n, guide in enumerate((2, 3, 0, 1)):
+        if Algorithm == 'RI':
+            guidedfilter(Guide[guide], Guide[n], d['gf_masks'][n], h, v, eps, 'HV', workspace, dst=tentative[n])
+        else:
+            guidedfilter_MLRI(Guide[guide], Guide[n], d['gf_masks'][n], d['lap_masks'][n], h, v, eps, 'HV',
+                              d['Flap'], workspace, dst=tentative[n])
+
+    # calculate residuals (Algo 7 line 18) 
+    residual = ws.ufunc('residual', np.subtract, rawq, tentative)
+    residual *= d['residual_masks']
+
+    # horizontal or vertical linear interpolation of residuals (Algo 7 line 19)
+    residual = filter2DStack(residual, d['K'], dst=ws.empty_like('interpolated', residual))
+
+    # add tentative estimate (Algo 7 line 20)
+    estimate = ws.ufunc('estimate', np.add, tentative, residual)
+    estimate *= estimate_masks
+
+    # Step(ii): adaptive selection of iteration at each pixel
+    # calculate iteration criteria  (Algo 7 line 4)
+    cri = ws.ufunc('cri', np.subtract, Guide, tentative)
+    cri *= d['criteria_masks']
+
+    # calculate gradient of iteration criteria (Algo 8 line 5)
+    difcri = filter2DStack(cri, d['F'], dst=ws.empty_like('difcri', cri))
+    np.abs(difcri, out=difcri)
+
+    # absolute value of iteration criteria
+    np.abs(cri, out=cri)
+
+    # add Gr and R (Gb and B) criteria residuals (Algo 8 line 6) and directional map
+    # of iteration criteria (Algo 8 line 7)
+    #   crid = (cri[0] + cri[2]) * d['Mr'] + (cri[1] + cri[3]) * d['Mb']
+    def directional(name, cri):
+        crid = ws.ufunc(name, np.add, cri[0], cri[2])
+        crid *= d['Mr']
+        term = ws.ufunc('term', np.add, cri[1], cri[3])
+        term *= d['Mb']
+        crid += term
+        return crid
+
+    crid = directional('crid', cri)
+
+    # same for the gradient of criteria residuals
+    difcrid = directional('difcrid', difcri)
+
+    # smoothing of iteration criteria (Algo 8 line 8-9)
+    crid = filter2D(crid, Fs, dst=ws.empty_like('crids', crid))
+    difcrid = filter2D(difcrid, Fs, dst=ws.empty_like('difcrids', difcrid))
+
+    # calcualte iteration criteria  (Algo 8 line 10)
+    w = np.square(crid, out=crid)
+    w *= difcrid
+
+    # guide updating  (Algo 7 line 22)
+    Guide = d['known'] + estimate
+
+    return Guide, w
+
+
+def crop_direction(d, region):
+    """
+    returns the masks and filters of a direction of ARIgreen_interpolation cropped to region (rows, cols slices)
+    """
+    def crop(im):
+        return im[region] if im.ndim == 2 else im[:, region[0], region[1]]
+
+    cropped = dict(d)
+    for key in ('known', 'residual_masks', 'criteria_masks', 'Mr', 'Mb'):
+        cropped[key] = crop(d[key])
+    for key in ('gf_masks', 'lap_masks'):
+        cropped[key] = tuple(crop(M) for M in d[key])
+    return cropped
+
+
+def reactivate_neighbours(tiles, reach):
+    """
+    active-set mode of ARIgreen_interpolation: returns the tiles (boolean map) within reach tiles of an active one
+    """
+    kernel = np.ones((2 * reach + 1, 2 * reach + 1), dtype=np.uint8)
+    return cv2.dilate(tiles.astype(np.uint8), kernel).astype(bool)
@@ -1,9 +1,9 @@
 import numpy as np
-from filtertools import filter2D, boxFilter 
+from filtertools import diagBoxFilter, Moments, Workspace
 
 
 
-def guidedfilter(I, p, M, h, v, eps, direction):
+def guidedfilter(I, p, M, h, v, eps, direction, workspace=None, dst=None):
     """
     implements the Guided Filter (GF) used by the ARI demosaicing algorithm
     Arguments: 
@@ -13,85 +13,90 @@ def guidedfilter(I, p, M, h, v, eps, direction):
         (h,v) size of the filter
         eps: regularization
         direction: HV (horizontal-vertical) or diag (diagonal, used for Red and Blue)
+        workspace: optional Workspace holding the intermediate images of 'HV', reused by the next calls
+        dst: optional array of the shape of p receiving q
     Returns: 
         q: filtered version of p
     """
-    M = M.astype('float32')
-
     # horizontal and vertical MLGF guided filtering 
     if direction == 'HV':
+        ws = (Workspace() if workspace is None else workspace).scope('guidedfilter')
+        M = float32_mask(M, ws)
+
         # The number of the sammpled pixels in each local patch
         boxsz = (2*h+1, 2*v+1)   # in matlab boxfilter uses h,v as radius, opencv needs the diameter
-        N = boxFilter(M, boxsz ) 
-        N[N == 0] = 1
-
-        mean_I = boxFilter(I * M, boxsz ) / N
-        mean_p = boxFilter(p, boxsz ) / N
-        mean_Ip = boxFilter(I * p, boxsz ) / N
+        # each windowed moment is computed and box filtered once
+        IIM = ws.ufunc('IIM', np.multiply, I, I)
+        IIM *= M
+        ppM = ws.ufunc('ppM', np.multiply, p, p)
+        ppM *= M
+        pIM = ws.ufunc('pIM', np.multiply, p, I)
+        pIM *= M
+        S = Moments(boxsz, ws.scope('S'), N=M, IM=ws.ufunc('IM', np.multiply, I, M), p=p,
+                    Ip=ws.ufunc('Ip', np.multiply, I, p), IIM=IIM, ppM=ppM, pM=ws.ufunc('pM', np.multiply, p, M),
+                    pIM=pIM)
+        N = S.N 
+        N[ws.ufunc('th', np.equal, N, 0)] = 1
+
+        mean_I = ws.ufunc('mean_I', np.divide, S.IM, N)
+        mean_p = ws.ufunc('mean_p', np.divide, S.p, N)
+        mean_Ip = ws.ufunc('mean_Ip', np.divide, S.Ip, N)
 
         # The covariance of (I, p) in each local patch
-        cov_Ip = mean_Ip - mean_I * mean_p
-        mean_II = boxFilter(I * I * M, boxsz ) / N
-        var_I = mean_II - mean_I * mean_I
+        cov_Ip = ws.ufunc('cov_Ip', np.multiply, mean_I, mean_p)
+        np.subtract(mean_Ip, cov_Ip, out=cov_Ip)
+        mean_II = ws.ufunc('mean_II', np.divide, S.IIM, N)
+        var_I = ws.ufunc('var_I', np.multiply, mean_I, mean_I)
+        np.subtract(mean_II, var_I, out=var_I)
 
         # linear coefficients
-        a = cov_Ip / (var_I + eps)
-        b = mean_p - a * mean_I
+        a = ws.ufunc('a', np.add, var_I, eps)
+        np.divide(cov_Ip, a, out=a)
+        b = ws.ufunc('b', np.multiply, a, mean_I)
+        np.subtract(mean_p, b, out=b)
 
         # weighted average
-        dif = boxFilter(I * I * M, boxsz ) * a * a \
-              + b * b * N + boxFilter(p * p * M, boxsz ) \
-              + 2 * a * b * boxFilter(I * M, boxsz ) \
-              - 2 * b * boxFilter(p * M, boxsz ) \
-              - 2 * a * boxFilter(p * I * M, boxsz )
-        dif = dif / N
-        dif[dif < 0] = 0
-        dif = np.sqrt(dif)
-        dif = np.nan_to_num(dif)
-        dif[dif < 0.001] = 0.001
-        dif = 1 / dif
-        wdif = boxFilter(dif, boxsz )
-
-        mean_a = boxFilter(a * dif, boxsz ) / (wdif + 1e-4)
-        mean_b = boxFilter(b * dif, boxsz ) / (wdif + 1e-4)
+        dif = windowed_residual(ws, S, a, b, N)
+        dif[ws.ufunc('th', np.less, dif, 0)] = 0
+        np.sqrt(dif, out=dif)
+        np.nan_to_num(dif, copy=False)
+        dif[ws.ufunc('th', np.less, dif, 0.001)] = 0.001
+        np.divide(1, dif, out=dif)
+        W = Moments(boxsz, ws.scope('W'), dif=dif, a=ws.ufunc('adif', np.multiply, a, dif),
+                    b=ws.ufunc('bdif', np.multiply, b, dif))
+        wdif = W.dif
+        wdif += 1e-4
+
+        mean_a = np.divide(W.a, wdif, out=W.a)
+        mean_b = np.divide(W.b, wdif, out=W.b)
 
     # diagonal and anti-diagonal MLGF guided filtering 
     else:
-        # define the diagonal "boxFilter" window
-        r = h + v
-        diagBox = np.ones((2 * r + 1, 2 * r + 1))
-        w = 2 * r + 1
-
-        for i in range(1, v+1):
-            for t in range(1, 2 * i):
-                diagBox[t-1, 2*i-t-1] = 0
-                diagBox[w+1-t-1, w+1-2*i+t-1] = 0
-
-        for i in range(1, h+1):
-            for t in range(1, 2*i):
-                diagBox[t-1, w+1-2*i+t-1] = 0
-                diagBox[w+1-t-1, 2*i-t-1] = 0 
-
-        tmp = np.zeros((2*r+1, 2*r+1))
-        tmp[0::2, 0::2] = 1
-        tmp[1::2, 1::2] = 1
-        diagBox = diagBox * tmp
+        M = M.astype('float32')
+
+        # diagonal window of radii (h, v) on the quincunx lattice (see diagBoxFilter),
+        # each windowed moment is computed once
+        IM = diagBoxFilter(I * M, h, v)
+        pM = diagBoxFilter(p * M, h, v)
+        IIM = diagBoxFilter(I * I * M, h, v)
+        ppM = diagBoxFilter(p * p * M, h, v)
+        pIM = diagBoxFilter(p * I * M, h, v)
 
         # number of sampled pixels in each local patch
-        N = filter2D(M, diagBox)
+        N = diagBoxFilter(M, h, v)
         N[(-1e-8 < N) == (N < 1e-8)] = 0
         N[N == 0] = 1
     
-        mean_I = filter2D(I * M, diagBox) / N
+        mean_I = IM / N
         mean_I[(-1e-8 < mean_I) == (mean_I < 1e-8)] = 0.0
-        mean_p = filter2D(p * M, diagBox) / N
+        mean_p = pM / N
         mean_p[(-1e-8 < mean_p) == (mean_p < 1e-8)] = 0.0
-        mean_Ip = filter2D(I * p * M, diagBox) / N
+        mean_Ip = pIM / N
         mean_Ip[(-1e-8 < mean_Ip) == (mean_Ip < 1e-8)] = 0.0
 
         cov_Ip = mean_Ip - mean_I * mean_p
         cov_Ip[(-1e-8 < cov_Ip) == (cov_Ip < 1e-8)] = 0.0
-        mean_II = filter2D(I * I * M, diagBox) / N
+        mean_II = IIM / N
         mean_II[(-1e-8 < mean_II) == (mean_II < 1e-8)] = 0.0
         var_I = mean_II - mean_I * mean_I
         var_I[(-1e-8 < var_I) == (var_I < 1e-8)] = 0.0
@@ -103,11 +108,11 @@ def guidedfilter(I, p, M, h, v, eps, direction):
         b[(-1e-8 < b) == (b < 1e-8)] = 0.0
 
         # weighted average
-        dif = filter2D(I * I * M,diagBox) * a * a \
-              + b * b * N + filter2D(p * p * M, diagBox)\
-              + 2 * a * b * filter2D(I * M, diagBox)\
-              - 2 * b * filter2D(p * M, diagBox)\
-              - 2 * a * filter2D(p * I * M, diagBox)
+        dif = IIM * a * a \
+              + b * b * N + ppM\
+              + 2 * a * b * IM\
+              - 2 * b * pM\
+              - 2 * a * pIM
 
         dif = dif / N
         dif[dif < 1e-8] = 0.0
@@ -115,18 +120,55 @@ def guidedfilter(I, p, M, h, v, eps, direction):
         dif = np.nan_to_num(dif)
         dif[dif < 0.001] = 0.001
         dif = 1.0 / dif
-        wdif = filter2D(dif, diagBox)
+        wdif = diagBoxFilter(dif, h, v)
 
-        adif = filter2D(a * dif, diagBox)
+        adif = diagBoxFilter(a * dif, h, v)
         adif[(-1e-8 < adif) == (adif < 1e-8)] = 0
         mean_a = adif / (wdif + 1e-4)
 
-        bdif = filter2D(b * dif, diagBox)
+        bdif = diagBoxFilter(b * dif, h, v)
         bdif[(-1e-8 < bdif) == (bdif < 1e-8)] = 0
         mean_b = bdif / (wdif + 1e-4)
 
 
     # output
-    q = mean_a * I + mean_b
+    q = np.multiply(mean_a, I, out=dst)
+    q += mean_b
 
     return q
+
+
+def float32_mask(M, ws):
+    """
+    returns the mask M as a float32 image, in the buffer 'M' of the workspace ws
+    """
+    M_float32 = ws.empty('M', M.shape, np.float32)
+    M_float32[...] = M
+    return M_float32
+
+
+def windowed_residual(ws, S, a, b, N):
+    """
+    mean squared residual of the linear model (a, b) of a guided filter over each window, computed in
+    the buffer 'dif' of the workspace ws from the box sums S of its moments (IIM, ppM, IM, pM, pIM)
+    and the number of pixels of the windows N
+    """
+    #   dif = (S.IIM * a * a + b * b * N + S.ppM + 2 * a * b * S.IM - 2 * b * S.pM - 2 * a * S.pIM) / N
+    dif = ws.ufunc('dif', np.multiply, S.IIM, a)
+    dif *= a
+    term = ws.ufunc('term', np.multiply, b, b)
+    term *= N
+    dif += term
+    dif += S.ppM
+    np.multiply(a, 2, out=term)
+    term *= b
+    term *= S.IM
+    dif += term
+    np.multiply(b, 2, out=term)
+    term *= S.pM
+    dif -= term
+    np.multiply(a, 2, out=term)
+    term *= S.pIM
+    dif -= term
+    dif /= N
+    return dif
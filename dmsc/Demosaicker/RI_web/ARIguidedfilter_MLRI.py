@@ -1,9 +1,10 @@
 import numpy as np
-from filtertools import filter2D, boxFilter 
+from filtertools import filter2D, diagBoxFilter, Moments, Workspace
+from ARIguidedfilter import float32_mask, windowed_residual
 
 
 
-def guidedfilter_MLRI(I, p, M, M_lap, h, v, eps, direction, F):
+def guidedfilter_MLRI(I, p, M, M_lap, h, v, eps, direction, F, workspace=None, dst=None):
     """
     implements the Minimized-Laplacian Guided Filter (MLGF) used by the ARI demosaicing algorithm
     Arguments: 
@@ -15,104 +16,111 @@ def guidedfilter_MLRI(I, p, M, M_lap, h, v, eps, direction, F):
         eps: regularization
         direction: HV (horizontal-vertical) or diag (diagonal, used for Red and Blue)
         F: laplacian kernel
+        workspace: optional Workspace holding the intermediate images of 'HV', reused by the next calls
+        dst: optional array of the shape of p receiving q
     Returns: 
         q: filtered version of p
     """
-    M = M.astype('float32')
-    M_lap = M_lap.astype('float32')
-
-
     # horizontal and vertical MLGF guided filtering 
     if direction == 'HV':
+        # the RI and MLRI filters are never computed at the same time, they share their buffers
+        ws = (Workspace() if workspace is None else workspace).scope('guidedfilter')
+        M = float32_mask(M, ws.scope('M'))
+        M_lap = float32_mask(M_lap, ws.scope('M_lap'))
+
         # the number of the sammpled pixels in each local patch
         boxsz = (2*h+1, 2*v+1)  
-        N_lap =  boxFilter(M_lap,  boxsz )
-        N_lap[(-1e-8 < N_lap) == (N_lap < 1e-8)] = 0.0
-        N_lap[N_lap == 0] = 1
-
-        difIF = filter2D(I, F) 
-        difpF = filter2D(p, F)
-        mean_Ip =  boxFilter(difIF * difpF * M_lap,  boxsz ) / N_lap
-        mean_II =  boxFilter(difIF * difIF * M_lap,  boxsz ) / N_lap
+        # each windowed moment is computed and box filtered once
+        difIF = filter2D(I, F, dst=ws.empty_like('difIF', I))
+        difpF = filter2D(p, F, dst=ws.empty_like('difpF', p))
+        IpF = ws.ufunc('IpF', np.multiply, difIF, difpF)
+        IpF *= M_lap
+        IIF = ws.ufunc('IIF', np.multiply, difIF, difIF)
+        IIF *= M_lap
+        IIM = ws.ufunc('IIM', np.multiply, I, I)
+        IIM *= M
+        ppM = ws.ufunc('ppM', np.multiply, p, p)
+        ppM *= M
+        pIM = ws.ufunc('pIM', np.multiply, p, I)
+        pIM *= M
+        S = Moments(boxsz, ws.scope('S'), N_lap=M_lap, IpF=IpF, IIF=IIF,
+                    N=M, IM=ws.ufunc('IM', np.multiply, I, M), pM=ws.ufunc('pM', np.multiply, p, M),
+                    IIM=IIM, ppM=ppM, pIM=pIM)
+        N_lap =  S.N_lap
+        #   N_lap[(-1e-8 < N_lap) == (N_lap < 1e-8)] = 0.0
+        small = ws.ufunc('small', np.less, -1e-8, N_lap)
+        np.equal(small, ws.ufunc('th', np.less, N_lap, 1e-8), out=small)
+        N_lap[small] = 0.0
+        N_lap[ws.ufunc('th', np.equal, N_lap, 0)] = 1
+
+        mean_Ip = ws.ufunc('mean_Ip', np.divide, S.IpF, N_lap)
+        mean_II = ws.ufunc('mean_II', np.divide, S.IIF, N_lap)
 
         # linear coefficients
-        N =  boxFilter(M,  boxsz )
-        N[N == 0] = 1
-        mean_I =  boxFilter(I * M,  boxsz ) / N
-        mean_p =  boxFilter(p * M,  boxsz ) / N
+        N =  S.N
+        N[ws.ufunc('th', np.equal, N, 0)] = 1
+        mean_I = ws.ufunc('mean_I', np.divide, S.IM, N)
+        mean_p = ws.ufunc('mean_p', np.divide, S.pM, N)
 
-        a = mean_Ip / (mean_II + eps)
-        b = mean_p - a * mean_I
+        a = ws.ufunc('a', np.add, mean_II, eps)
+        np.divide(mean_Ip, a, out=a)
+        b = ws.ufunc('b', np.multiply, a, mean_I)
+        np.subtract(mean_p, b, out=b)
 
         # weighted average
-        dif =  boxFilter(I * I * M,  boxsz ) * a * a \
-              + b * b * N +  boxFilter(p * p * M,  boxsz )\
-              + 2 * a * b *  boxFilter(I * M,  boxsz )\
-              - 2 * b *  boxFilter(p * M,  boxsz )\
-              - 2 * a *  boxFilter(p * I * M,  boxsz )
-
-        dif = dif / N
-        dif[dif < 0] = 0
-        dif = dif ** 0.5
-        dif = np.nan_to_num(dif)
-        dif[dif < 1e-3] = 1e-3
-        dif = 1 / dif
-        wdif =  boxFilter(dif,  boxsz )
-        mean_a =  boxFilter(a * dif,  boxsz ) / (wdif + 1e-4)
-        mean_b =  boxFilter(b * dif,  boxsz ) / (wdif + 1e-4)
+        dif = windowed_residual(ws, S, a, b, N)
+        dif[ws.ufunc('th', np.less, dif, 0)] = 0
+        np.sqrt(dif, out=dif)
+        np.nan_to_num(dif, copy=False)
+        dif[ws.ufunc('th', np.less, dif, 1e-3)] = 1e-3
+        np.divide(1, dif, out=dif)
+        W =  Moments(boxsz, ws.scope('W'), dif=dif, a=ws.ufunc('adif', np.multiply, a, dif),
+                     b=ws.ufunc('bdif', np.multiply, b, dif))
+        wdif =  W.dif
+        wdif += 1e-4
+        mean_a =  np.divide(W.a, wdif, out=W.a)
+        mean_b =  np.divide(W.b, wdif, out=W.b)
 
     # diagonal and anti-diagonal MLGF guided filtering 
     else:
-        # define the diagonal "boxFilter" window
-        r = h + v
-        diagBox = np.ones((2 * r + 1, 2 * r + 1))
-        w = 2 * r + 1
-
-        for i in range(1, v + 1):
-            for t in range(1, 2 * i):
-                diagBox[t - 1, 2 * i - t - 1] = 0
-                diagBox[w + 1 - t - 1, w + 1 - 2 * i + t - 1] = 0
-
-        for i in range(1, h + 1):
-            for t in range(1, 2 * i):
-                diagBox[t - 1, w + 1 - 2 * i + t - 1] = 0
-                diagBox[w + 1 - t - 1, 2 * i - t - 1] = 0
-
-        tmp = np.zeros((2 * r + 1, 2 * r + 1))
-        tmp[0::2, 0::2] = 1
-        tmp[1::2, 1::2] = 1
-        diagBox = diagBox * tmp
+        M = M.astype('float32')
+        M_lap = M_lap.astype('float32')
+
+        # diagonal window of radii (h, v) on the quincunx lattice (see diagBoxFilter),
+        # each windowed moment is computed once
+        IM = diagBoxFilter(I * M, h, v)
+        pM = diagBoxFilter(p * M, h, v)
 
         # number of sampled pixels in each local patch
-        N_lap = filter2D(M_lap, diagBox )
+        N_lap = diagBoxFilter(M_lap, h, v)
         N_lap[N_lap == 0] = 1
 
         difIF = filter2D(I, F) 
         difpF = filter2D(p, F)
-        mean_Ip = filter2D(difIF * difpF * M_lap, diagBox ) / N_lap
+        mean_Ip = diagBoxFilter(difIF * difpF * M_lap, h, v) / N_lap
         mean_Ip[(-1e-8 < mean_Ip) == (mean_Ip < 1e-8)] = 0.0
-        mean_II = filter2D(difIF * difIF * M_lap, diagBox ) / N_lap
+        mean_II = diagBoxFilter(difIF * difIF * M_lap, h, v) / N_lap
         mean_II[(-1e-8 < mean_II) == (mean_II < 1e-8)] = 0.0
 
         # linear coefficients
         a = mean_Ip / (mean_II + eps)
         a[(-1e-8 < a) == (a < 1e-8)] = 0.0
-        N = filter2D(M, diagBox )
+        N = diagBoxFilter(M, h, v)
         N[N == 0] = 1
 
-        mean_I = filter2D(I * M, diagBox ) / N
+        mean_I = IM / N
         mean_I[(-1e-8 < mean_I) == (mean_I < 1e-8)] = 0.0
-        mean_p = filter2D(p * M, diagBox ) / N
+        mean_p = pM / N
         mean_p[(-1e-8 < mean_p) == (mean_p < 1e-8)] = 0.0
         b = mean_p - a * mean_I
         b[(-1e-8 < b) == (b < 1e-8)] = 0.0
 
         # weighted average
-        dif = filter2D(I * I * M, diagBox ) * a * a \
-              + b * b * N + filter2D(p * p * M, diagBox )\
-              + 2 * a * b * filter2D(I * M, diagBox ) \
-              - 2 * b * filter2D(p * M, diagBox )\
-              - 2 * a * filter2D(p * I * M, diagBox )
+        dif = diagBoxFilter(I * I * M, h, v) * a * a \
+              + b * b * N + diagBoxFilter(p * p * M, h, v)\
+              + 2 * a * b * IM\
+              - 2 * b * pM\
+              - 2 * a * diagBoxFilter(p * I * M, h, v)
 
         dif = dif / N
         dif[dif < 1e-8] = 0.0
@@ -120,18 +128,18 @@ def guidedfilter_MLRI(I, p, M, M_lap, h, v, eps, direction, F):
         dif = np.nan_to_num(dif)
         dif[dif < 1e-3] = 1e-3
         dif = 1.0 / dif
-        wdif = filter2D(dif, diagBox )
+        wdif = diagBoxFilter(dif, h, v)
 
-        adif = filter2D(a * dif, diagBox )
+        adif = diagBoxFilter(a * dif, h, v)
         adif[(-1e-8 < adif) == (adif < 1e-8)] = 0.0
         mean_a = adif / (wdif + 1e-4)
 
-        bdif = filter2D(b * dif, diagBox )
+        bdif = diagBoxFilter(b * dif, h, v)
         bdif[(-1e-8 < bdif) == (bdif < 1e-8)] = 0.0
         mean_b = bdif / (wdif + 1e-4)
 
     # final output
-    q = mean_a * I + mean_b
+    q = np.multiply(mean_a, I, out=dst)
+    q += mean_b
 
     return q
-
@@ -2,13 +2,13 @@ import numpy as np
 import cv2
 from ARIguidedfilter import guidedfilter
 from ARIguidedfilter_MLRI import guidedfilter_MLRI
-from filtertools import filter2D, getGaussianKernel
+from filtertools import filter2D, getGaussianKernel, ArgminAccumulator
 
 
 
 
 # This functions implements Algorithm 10
-def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
+def ARIred_blue_interpolation_second(green, red, blue, mask, eps, workspace=None):
     """
     red and blue interpolation for the ARI (Adaptive Residual Interpolation) demosaicking algorithm
     Arguments: 
@@ -17,6 +17,7 @@ def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
         blue: image containing the interpolated blue channel from the first stepl
         mask: 3 channel image indicating where the mosaic is set
         eps: regularization parameter (recommended: 1e-10)
+        workspace: optional Workspace holding the intermediate images of the guided filters, reused by the next calls
     Returns: 
         red,blue: the refined red and blue channel interpolations        
     """
@@ -51,14 +52,24 @@ def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
     itnum = 2
 
     # initialization of iteration criteria
-    RI_w2R1 = np.ones(mask[:, :, 0].shape) * 1e32
-    RI_w2R2 = np.ones(mask[:, :, 0].shape) * 1e32
-    MLRI_w2R1 = np.ones(mask[:, :, 0].shape) * 1e32
-    MLRI_w2R2 = np.ones(mask[:, :, 0].shape) * 1e32
-    RI_w2B1 = np.ones(mask[:, :, 0].shape) * 1e32
-    RI_w2B2 = np.ones(mask[:, :, 0].shape) * 1e32
-    MLRI_w2B1 = np.ones(mask[:, :, 0].shape) * 1e32
-    MLRI_w2B2 = np.ones(mask[:, :, 0].shape) * 1e32
+    RI_w2R1 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    RI_w2R2 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    MLRI_w2R1 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    MLRI_w2R2 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    RI_w2B1 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    RI_w2B2 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    MLRI_w2B1 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+    MLRI_w2B2 = np.ones(mask[:, :, 0].shape, dtype=mask.dtype) * 1e32
+
+    # running minimum of the iteration criteria, updated in place
+    RI_selR1 = ArgminAccumulator(RI_w2R1)
+    RI_selR2 = ArgminAccumulator(RI_w2R2)
+    MLRI_selR1 = ArgminAccumulator(MLRI_w2R1)
+    MLRI_selR2 = ArgminAccumulator(MLRI_w2R2)
+    RI_selB1 = ArgminAccumulator(RI_w2B1)
+    RI_selB2 = ArgminAccumulator(RI_w2B2)
+    MLRI_selB1 = ArgminAccumulator(MLRI_w2B1)
+    MLRI_selB2 = ArgminAccumulator(MLRI_w2B2)
 
     #  initial guide image for RI/MLRI
     RI_Guideg1 = Guideg1
@@ -87,21 +98,21 @@ def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
     # Iterative horizontal and vertical interpolation
     for ittime in range(itnum):
         # generate horizontal and vertical tentative estimate by RI
-        M = np.ones(mask[:, :, 0].shape)
-        RI_tentativeR1 = guidedfilter(RI_Guideg1, RI_Guider1, M, h, v, eps, direction='HV')
-        RI_tentativeB1 = guidedfilter(RI_Guideg1, RI_Guideb1, M, h, v, eps, direction='HV')
-        RI_tentativeR2 = guidedfilter(RI_Guideg2, RI_Guider2, M, v, h, eps, direction='HV')
-        RI_tentativeB2 = guidedfilter(RI_Guideg2, RI_Guideb2, M, v, h, eps, direction='HV')
+        M = np.ones(mask[:, :, 0].shape, dtype=mask.dtype)
+        RI_tentativeR1 = guidedfilter(RI_Guideg1, RI_Guider1, M, h, v, eps, direction='HV', workspace=workspace)
+        RI_tentativeB1 = guidedfilter(RI_Guideg1, RI_Guideb1, M, h, v, eps, direction='HV', workspace=workspace)
+        RI_tentativeR2 = guidedfilter(RI_Guideg2, RI_Guider2, M, v, h, eps, direction='HV', workspace=workspace)
+        RI_tentativeB2 = guidedfilter(RI_Guideg2, RI_Guideb2, M, v, h, eps, direction='HV', workspace=workspace)
 
         # generate horizontal tentative estimate by MLRI
         F1 = np.array([[-1, 0, 2, 0, -1]])
-        MLRI_tentativeR1 = guidedfilter_MLRI(MLRI_Guideg1, MLRI_Guider1, M, imaskG, h2, v2, eps, direction='HV', F=F1)
-        MLRI_tentativeB1 = guidedfilter_MLRI(MLRI_Guideg1, MLRI_Guideb1, M, imaskG, h2, v2, eps, direction='HV', F=F1)
+        MLRI_tentativeR1 = guidedfilter_MLRI(MLRI_Guideg1, MLRI_Guider1, M, imaskG, h2, v2, eps, direction='HV', F=F1, workspace=workspace)
+        MLRI_tentativeB1 = guidedfilter_MLRI(MLRI_Guideg1, MLRI_Guideb1, M, imaskG, h2, v2, eps, direction='HV', F=F1, workspace=workspace)
 
         # generate vertical tentative estimate by MLRI
         F2 = F1.T
-        MLRI_tentativeR2 = guidedfilter_MLRI(MLRI_Guideg2, MLRI_Guider2, M, imaskG, v2, h2, eps, direction='HV', F=F2)
-        MLRI_tentativeB2 = guidedfilter_MLRI(MLRI_Guideg2, MLRI_Guideb2, M, imaskG, v2, h2, eps, direction='HV', F=F2)
+        MLRI_tentativeR2 = guidedfilter_MLRI(MLRI_Guideg2, MLRI_Guider2, M, imaskG, v2, h2, eps, direction='HV', F=F2, workspace=workspace)
+        MLRI_tentativeB2 = guidedfilter_MLRI(MLRI_Guideg2, MLRI_Guideb2, M, imaskG, v2, h2, eps, direction='HV', F=F2, workspace=workspace)
 
         # calculate residuals of RI and MLRI
         RI_residualR1 = (red  - RI_tentativeR1) * imaskG
@@ -223,14 +234,14 @@ def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
         MLRI_wB2 = (MLRI_criB2 ** 2) * MLRI_difcriB2
 
         # find smaller criteria pixels
-        RI_piR1 = np.where(RI_wR1 < RI_w2R1)
-        RI_piR2 = np.where(RI_wR2 < RI_w2R2)
-        MLRI_piR1 = np.where(MLRI_wR1 < MLRI_w2R1)
-        MLRI_piR2 = np.where(MLRI_wR2 < MLRI_w2R2)
-        RI_piB1 = np.where(RI_wB1 < RI_w2B1)
-        RI_piB2 = np.where(RI_wB2 < RI_w2B2)
-        MLRI_piB1 = np.where(MLRI_wB1 < MLRI_w2B1)
-        MLRI_piB2 = np.where(MLRI_wB2 < MLRI_w2B2)
+        RI_piR1 = RI_selR1.select(RI_wR1)
+        RI_piR2 = RI_selR2.select(RI_wR2)
+        MLRI_piR1 = MLRI_selR1.select(MLRI_wR1)
+        MLRI_piR2 = MLRI_selR2.select(MLRI_wR2)
+        RI_piB1 = RI_selB1.select(RI_wB1)
+        RI_piB2 = RI_selB2.select(RI_wB2)
+        MLRI_piB1 = MLRI_selB1.select(MLRI_wB1)
+        MLRI_piB2 = MLRI_selB2.select(MLRI_wB2)
 
         # guide updating
         RI_Guider1 = red + RI_R1
@@ -243,24 +254,24 @@ def ARIred_blue_interpolation_second(green, red, blue, mask, eps):
         MLRI_Guideb2 = blue + MLRI_B2
 
         # select smallest iteration criteria at each pixel
-        RI_R1[RI_piR1[0], RI_piR1[1]] = RI_Guider1[RI_piR1[0], RI_piR1[1]]
-        MLRI_R1[MLRI_piR1[0], MLRI_piR1[1]] = MLRI_Guider1[MLRI_piR1[0], MLRI_piR1[1]]
-        RI_R2[RI_piR2[0], RI_piR2[1]] = RI_Guider2[RI_piR2[0], RI_piR2[1]]
-        MLRI_R2[MLRI_piR2[0], MLRI_piR2[1]] = MLRI_Guider2[MLRI_piR2[0], MLRI_piR2[1]]
-        RI_B1[RI_piB1[0], RI_piB1[1]] = RI_Guideb1[RI_piB1[0], RI_piB1[1]]
-        MLRI_B1[MLRI_piB1[0], MLRI_piB1[1]] = MLRI_Guideb1[MLRI_piB1[0], MLRI_piB1[1]]
-        RI_B2[RI_piB2[0], RI_piB2[1]] = RI_Guideb2[RI_piB2[0], RI_piB2[1]]
-        MLRI_B2[MLRI_piB2[0], MLRI_piB2[1]] = MLRI_Guideb2[MLRI_piB2[0], MLRI_piB2[1]]
+        np.copyto(RI_R1, RI_Guider1, where=RI_piR1)
+        np.copyto(MLRI_R1, MLRI_Guider1, where=MLRI_piR1)
+        np.copyto(RI_R2, RI_Guider2, where=RI_piR2)
+        np.copyto(MLRI_R2, MLRI_Guider2, where=MLRI_piR2)
+        np.copyto(RI_B1, RI_Guideb1, where=RI_piB1)
+        np.copyto(MLRI_B1, MLRI_Guideb1, where=MLRI_piB1)
+        np.copyto(RI_B2, RI_Guideb2, where=RI_piB2)
+        np.copyto(MLRI_B2, MLRI_Guideb2, where=MLRI_piB2)
 
         # update minimum iteration criteria
-        RI_w2R1[RI_piR1[0], RI_piR1[1]] = RI_wR1[RI_piR1[0], RI_piR1[1]]
-        RI_w2R2[RI_piR2[0], RI_piR2[1]] = RI_wR2[RI_piR2[0], RI_piR2[1]]
-        RI_w2B1[RI_piB1[0], RI_piB1[1]] = RI_wB1[RI_piB1[0], RI_piB1[1]]
-        RI_w2B2[RI_piB2[0], RI_piB2[1]] = RI_wB2[RI_piB2[0], RI_piB2[1]]
-        MLRI_w2R1[MLRI_piR1[0], MLRI_piR1[1]] = MLRI_wR1[MLRI_piR1[0], MLRI_piR1[1]]
-        MLRI_w2R2[MLRI_piR2[0], MLRI_piR2[1]] = MLRI_wR2[MLRI_piR2[0], MLRI_piR2[1]]
-        MLRI_w2B1[MLRI_piB1[0], MLRI_piB1[1]] = MLRI_wB1[MLRI_piB1[0], MLRI_piB1[1]]
-        MLRI_w2B2[MLRI_piB2[0], MLRI_piB2[1]] = MLRI_wB2[MLRI_piB2[0], MLRI_piB2[1]]
+        RI_selR1.accept(RI_wR1)
+        RI_selR2.accept(RI_wR2)
+        RI_selB1.accept(RI_wB1)
+        RI_selB2.accept(RI_wB2)
+        MLRI_selR1.accept(MLRI_wR1)
+        MLRI_selR2.accept(MLRI_wR2)
+        MLRI_selB1.accept(MLRI_wB1)
+        MLRI_selB2.accept(MLRI_wB2)
 
         # guided filter window size update
         h = h + 1
@@ -1,17 +1,22 @@
 import numpy as np
 from RIguidedfilter3gf import guidedfilter3gf
-from filtertools import filter2D
+from filtertools import filter2D, Workspace
+from mosaic_bayer import mask_phase, phase_plane, phase_neighbours_mean
 
 
 
 
 
-def GuidefilterResidual(rawq, mask, maskGr, maskGb, mosaic, Algorithm):
+def GuidefilterResidual(rawq, mask, maskGr, maskGb, Algorithm, workspace=None):
     """
     Guided filter processing used for the green channel interpolation by residual 
     interpolation algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     (Algorithm 5)
+    workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     """
+    if workspace is None:
+        workspace = Workspace()
+    ws = workspace.scope('GuidefilterResidual')
 
     maskR = mask[:, :, 0]
     maskB = mask[:, :, 2]
@@ -32,16 +37,27 @@ def GuidefilterResidual(rawq, mask, maskGr, maskGb, mosaic, Algorithm):
     #Guidebv = mosaic[:, :, 2] + filter2D(mosaic[:, :, 2], Kv)  
     Kh = np.array([[1/2, 0, 1/2]])
     Kv = Kh.T
-    rawh = filter2D(rawq, Kh)
-    rawv = filter2D(rawq, Kv)
+    rawh = filter2D(rawq, Kh, dst=ws.empty_like('rawh', rawq))
+    rawv = filter2D(rawq, Kv, dst=ws.empty_like('rawv', rawq))
 
-    Guidegh = mosaic[:, :, 1] + rawh * mask[:, :, 0] + rawh * mask[:, :, 2]
-    Guiderh = mosaic[:, :, 0] + rawh * maskGr
-    Guidebh = mosaic[:, :, 2] + rawh * maskGb
+    # Guide = mosaic + raw * masks, e.g. Guidegh = mosaic[:, :, 1] + rawh * mask[:, :, 0] + rawh * mask[:, :, 2]
+    # the mosaic channel is the raw data on the phases of its masks, it is added on their phase planes
+    def guide(name, raw, channel_masks, *masks):
+        Guide = ws.ufunc(name, np.multiply, raw, masks[0])
+        for M in masks[1:]:
+            Guide += np.multiply(raw, M, out=ws.empty_like('term', Guide))
+        for M in channel_masks:
+            phase = mask_phase(M)
+            phase_plane(Guide, phase)[...] += phase_plane(rawq, phase)
+        return Guide
 
-    Guidegv = mosaic[:, :, 1] + rawv * mask[:, :, 0] + rawv * mask[:, :, 2]
-    Guiderv = mosaic[:, :, 0] + rawv * maskGb
-    Guidebv = mosaic[:, :, 2] + rawv * maskGr
+    Guidegh = guide('Guidegh', rawh, (maskGr, maskGb), mask[:, :, 0], mask[:, :, 2])
+    Guiderh = guide('Guiderh', rawh, (maskR,), maskGr)
+    Guidebh = guide('Guidebh', rawh, (maskB,), maskGb)
+
+    Guidegv = guide('Guidegv', rawv, (maskGr, maskGb), mask[:, :, 0], mask[:, :, 2])
+    Guiderv = guide('Guiderv', rawv, (maskR,), maskGb)
+    Guidebv = guide('Guidebv', rawv, (maskB,), maskGr)
 
 
 
@@ -62,76 +78,69 @@ def GuidefilterResidual(rawq, mask, maskGr, maskGb, mosaic, Algorithm):
     F = np.array([[-1, 0, 2, 0, -1]])
     FT = F.T
 
-    # apply the guided filtering algorithm to each directional inteprolation
-    tentativeRh  = guidedfilter3gf(Guidegh, mosaic[:, :, 0]         , maskR , h, v, eps, Algorithm, F)
-    tentativeGrh = guidedfilter3gf(Guiderh, mosaic[:, :, 1] * maskGr, maskGr, h, v, eps, Algorithm, F)
-    tentativeGbh = guidedfilter3gf(Guidebh, mosaic[:, :, 1] * maskGb, maskGb, h, v, eps, Algorithm, F)
-    tentativeBh  = guidedfilter3gf(Guidegh, mosaic[:, :, 2]         , maskB , h, v, eps, Algorithm, F)
-
-    tentativeRv  = guidedfilter3gf(Guidegv, mosaic[:, :, 0]         , maskR , v, h, eps, Algorithm, FT)
-    tentativeGrv = guidedfilter3gf(Guiderv, mosaic[:, :, 1] * maskGb, maskGb, v, h, eps, Algorithm, FT)
-    tentativeGbv = guidedfilter3gf(Guidebv, mosaic[:, :, 1] * maskGr, maskGr, v, h, eps, Algorithm, FT)
-    tentativeBv  = guidedfilter3gf(Guidegv, mosaic[:, :, 2]         , maskB , v, h, eps, Algorithm, FT)
-
-    tentativeGrh = np.clip(tentativeGrh, 0, 255)
-    tentativeGrv = np.clip(tentativeGrv, 0, 255)
-    tentativeGbh = np.clip(tentativeGbh, 0, 255)
-    tentativeGbv = np.clip(tentativeGbv, 0, 255)
-    tentativeRh = np.clip(tentativeRh, 0, 255)
-    tentativeRv = np.clip(tentativeRv, 0, 255)
-    tentativeBh = np.clip(tentativeBh, 0, 255)
-    tentativeBv = np.clip(tentativeBv, 0, 255)
-
-    # residual
-    residualGrh = (mosaic[:, :, 1] - tentativeGrh) * maskGr
-    residualGbh = (mosaic[:, :, 1] - tentativeGbh) * maskGb
-    residualRh = (mosaic[:, :, 0] - tentativeRh) * maskR
-    residualBh = (mosaic[:, :, 2] - tentativeBh) * maskB
-    residualGrv = (mosaic[:, :, 1] - tentativeGrv) * maskGb
-    residualGbv = (mosaic[:, :, 1] - tentativeGbv) * maskGr
-    residualRv = (mosaic[:, :, 0] - tentativeRv) * maskR
-    residualBv = (mosaic[:, :, 2] - tentativeBv) * maskB
-
-    # residual interpolation
-    residualGrh = filter2D(residualGrh, Kh)
-    residualGbh = filter2D(residualGbh, Kh)
-    residualRh = filter2D(residualRh, Kh)
-    residualBh = filter2D(residualBh, Kh)
-
-    residualGrv = filter2D(residualGrv, Kv)
-    residualGbv = filter2D(residualGbv, Kv)
-    residualRv = filter2D(residualRv, Kv)
-    residualBv = filter2D(residualBv, Kv)
-
-    # add tentative image
-    Grh = (tentativeGrh + residualGrh) * maskR
-    Gbh = (tentativeGbh + residualGbh) * maskB
-    Rh = (tentativeRh + residualRh) * maskGr
-    Bh = (tentativeBh + residualBh) * maskGb
-    Grv = (tentativeGrv + residualGrv) * maskR
-    Gbv = (tentativeGbv + residualGbv) * maskB
-    Rv = (tentativeRv + residualRv) * maskGb
-    Bv = (tentativeBv + residualBv) * maskGr
-
-    Grh = np.clip(Grh, 0, 255)
-    Grv = np.clip(Grv, 0, 255)
-    Gbh = np.clip(Gbh, 0, 255)
-    Gbv = np.clip(Gbv, 0, 255)
-    Rh = np.clip(Rh, 0, 255)
-    Rv = np.clip(Rv, 0, 255)
-    Bh = np.clip(Bh, 0, 255)
-    Bv = np.clip(Bv, 0, 255)
-
-    # vertical and horizontal color difference
-    difh = mosaic[:, :, 1] + Grh + Gbh - mosaic[:, :, 0] - mosaic[:, :, 2] - Rh - Bh
-    difv = mosaic[:, :, 1] + Grv + Gbv - mosaic[:, :, 0] - mosaic[:, :, 2] - Rv - Bv
+    # color differences, written phase by phase by the estimates below
+    difh = ws.empty_like('difh', rawq)
+    difv = ws.empty_like('difv', rawq)
+
+    # apply the guided filtering algorithm to each directional inteprolation, then on the H/2 x W/2 phase planes:
+    #   residual = mosaic[:, :, channel] - tentative  on the phase of the residual mask M, where the mosaic is rawq
+    #   residual interpolation (filter2D with Kh or Kv) at the target phase, the neighbour pixels of the same rows (h)
+    #   or columns (v)
+    #   add tentative image: estimate = np.clip(tentative + residual, 0, 255)  on the target phase
+    #   color difference: dif = estimate - mosaic  on the R and B pixels (green estimates), mosaic - estimate on the G pixels
+    # the residual and the estimate being null outside their phases, only their planes are computed.
+    # A one dimensional window (h, 0) only mixes the pixels of a row: the guided filter is computed on the H/2 x W
+    # region of the rows of the phase of M (the RI windows), and likewise (0, v) on the H x W/2 region of its columns.
+    # The filtered image p is the mosaic channel of M (the raw data on its phase), as in the original
+    #   tentative = guidedfilter(Guide, mosaic[:, :, channel] * M, M, ...)
+    def estimate(dif, Guide, M, h, v, F, target, green):
+        phase = mask_phase(M)
+        rows = slice(phase[0], None, 2) if v == 0 else slice(None)
+        cols = slice(phase[1], None, 2) if h == 0 else slice(None)
+        region = (rows, cols)
+        p = ws.ufunc('p', np.multiply, rawq[region], M[region])
+        tentative = guidedfilter3gf(Guide[region], p, M[region], h, v, eps, Algorithm, F, workspace,
+                                    dst=ws.empty_like('tentative', p))
+
+        # the phase planes of the region
+        def plane(im, phase):
+            return im[slice(None) if v == 0 else slice(phase[0], None, 2),
+                      slice(None) if h == 0 else slice(phase[1], None, 2)]
+
+        residual = np.clip(plane(tentative, phase), 0, 255, out=plane(tentative, phase))
+        residual = ws.ufunc('residual', np.subtract, phase_plane(rawq, phase), residual)
+        tentative = np.clip(plane(tentative, target), 0, 255, out=plane(tentative, target))
+        tentative += phase_neighbours_mean(residual, phase, target, ws.empty_like('interpolated', tentative))
+        np.clip(tentative, 0, 255, out=tentative)
+
+        Q = phase_plane(rawq, target)
+        if green:
+            np.subtract(tentative, Q, out=phase_plane(dif, target))
+        else:
+            np.subtract(Q, tentative, out=phase_plane(dif, target))
+
+    R, Gr, Gb, B = (mask_phase(M) for M in (maskR, maskGr, maskGb, maskB))
+
+    # difh = mosaic[:, :, 1] + Grh + Gbh - mosaic[:, :, 0] - mosaic[:, :, 2] - Rh - Bh
+    estimate(difh, Guiderh, maskGr, h, v, F, R, True)     # Grh
+    estimate(difh, Guidebh, maskGb, h, v, F, B, True)     # Gbh
+    estimate(difh, Guidegh, maskR, h, v, F, Gr, False)    # Rh
+    estimate(difh, Guidegh, maskB, h, v, F, Gb, False)    # Bh
+
+    # difv = mosaic[:, :, 1] + Grv + Gbv - mosaic[:, :, 0] - mosaic[:, :, 2] - Rv - Bv
+    estimate(difv, Guiderv, maskGb, v, h, FT, R, True)    # Grv
+    estimate(difv, Guidebv, maskGr, v, h, FT, B, True)    # Gbv
+    estimate(difv, Guidegv, maskR, v, h, FT, Gb, False)   # Rv
+    estimate(difv, Guidegv, maskB, v, h, FT, Gr, False)   # Bv
 
 
     ###  Combine Vertical and Horizontal Color Differences ###
     # color difference gradient
     Kh = np.array([[1, 0, -1]])
     Kv = Kh.T
-    difh2 = abs(filter2D(difh, Kh))
-    difv2 = abs(filter2D(difv, Kv))
+    difh2 = filter2D(difh, Kh, dst=ws.empty_like('difh2', difh))
+    difv2 = filter2D(difv, Kv, dst=ws.empty_like('difv2', difv))
+    np.abs(difh2, out=difh2)
+    np.abs(difv2, out=difv2)
 
     return difh, difv, difh2, difv2
@@ -1,38 +1,46 @@
 import numpy as np
-from filtertools import filter2D
+from filtertools import filter2D, Workspace
+from mosaic_bayer import mask_phase, phase_plane
 
 
 
-def haresidual(rawq, mask, maskGr, maskGb, mosaic):
+def haresidual(rawq, mask, maskGr, maskGb, workspace=None):
     """
     This functions implements Algorithm 3 
     Hamilton-Adams residual used in the GBTF algorithm
+    workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     """
+    ws = (Workspace() if workspace is None else workspace).scope('haresidual')
+
     # (1st step of GBTF: HA interpolation - line 11)
     # The filter f is:  1/2 K_H - 1/4 Delta_H 
     f = np.array([[-1/4, 1/2, 1/2, 1/2, -1/4]])
-    rawh = filter2D(rawq, f)
-    rawv = filter2D(rawq, f.T)
+    rawh = filter2D(rawq, f, dst=ws.empty_like('rawh', rawq))
+    rawv = filter2D(rawq, f.T, dst=ws.empty_like('rawv', rawq))
 
     maskR = mask[:, :, 0]
     maskB = mask[:, :, 2]
 
-    # tentative image
-    Grh = rawh * maskR
-    Gbh = rawh * maskB
-    Rh = rawh * maskGr
-    Bh = rawh * maskGb
-    Grv = rawv * maskR
-    Gbv = rawv * maskB
-    Rv = rawv * maskGb
-    Bv = rawv * maskGr
-
-    # vertical and horizontal color difference (2nd step of GBTF - line 12)
+    # vertical and horizontal color difference (2nd step of GBTF - line 12), from the tentative image
+    #   difh = (Grh - mosaic[:, :, 0]) + (Gbh - mosaic[:, :, 2]) + (- Rh - Bh + mosaic[:, :, 1])
+    # with Grh = rawh * maskR, Gbh = rawh * maskB, Rh = rawh * maskGr, Bh = rawh * maskGb
+    # and  Grv = rawv * maskR, Gbv = rawv * maskB, Rv = rawv * maskGb, Bv = rawv * maskGr
     # {Gr,Gb,R,B}h  are \tilde Q in the paper, restricted to the different mosaic phases.
     # mosaic[:,:,i] are  Q in the paper the combination below.
     # Note that the phases of {Gr,Gb,R,B}h/v are not evident from the names, for instance Rh is on maskGr
-    difh = (Grh - mosaic[:, :, 0]) + (Gbh - mosaic[:, :, 2]) + (- Rh - Bh + mosaic[:, :, 1])
-    difv = (Grv - mosaic[:, :, 0]) + (Gbv - mosaic[:, :, 2]) + (- Rv - Bv + mosaic[:, :, 1])
+    # A single term is not null on each phase: the difference is computed on the H/2 x W/2 phase planes,
+    #   difh = rawh - rawq  on the R and B pixels,  difh = rawq - rawh  on the G pixels
+    difh = ws.empty_like('difh', rawq)
+    difv = ws.empty_like('difv', rawq)
+    for M, green in ((maskR, True), (maskB, True), (maskGr, False), (maskGb, False)):
+        phase = mask_phase(M)
+        Q = phase_plane(rawq, phase)
+        for dif, raw in ((difh, rawh), (difv, rawv)):
+            tentative = phase_plane(raw, phase)
+            if green:
+                np.subtract(tentative, Q, out=phase_plane(dif, phase))
+            else:
+                np.subtract(Q, tentative, out=phase_plane(dif, phase))
 #    difh = mosaic[:, :, 1] + Grh + Gbh - mosaic[:, :, 0] - mosaic[:, :, 2] - Rh - Bh
 #    difv = mosaic[:, :, 1] + Grv + Gbv - mosaic[:, :, 0] - mosaic[:, :, 2] - Rv - Bv
 
@@ -41,7 +49,8 @@ def haresidual(rawq, mask, maskGr, maskGb, mosaic):
     Kh = np.array([[1, 0, -1]])
     Kv = Kh.T
     AvK = np.array([[1, 1, 1]])
-    difh2 = filter2D ( abs(filter2D(difh, Kh)), AvK.T )
-    difv2 = filter2D ( abs(filter2D(difv, Kv)), AvK   )
+    gradient = ws.empty_like('gradient', difh)
+    difh2 = filter2D(np.abs(filter2D(difh, Kh, dst=gradient), out=gradient), AvK.T, dst=ws.empty_like('difh2', difh))
+    difv2 = filter2D(np.abs(filter2D(difv, Kv, dst=gradient), out=gradient), AvK, dst=ws.empty_like('difv2', difv))
 
     return difh, difv, difh2, difv2
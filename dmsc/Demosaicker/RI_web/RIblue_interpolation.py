@@ -1,25 +1,31 @@
 import numpy as np
 from RIguidedfilter3gf import guidedfilter3gf
-from filtertools import filter2D
+from filtertools import filter2D, Workspace
+from mosaic_bayer import get_mosaic_masks, mask_phase, phase_plane
 
 
 
-def blue_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
+def blue_interpolation(green, rawq, mask, pattern, h, v, eps, dif, Algorithm, workspace=None):
     """ 
     blue interpolation implementing Residual Interpolation demosaicking
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
         green: image containing the interpolated green channel
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         h,v: support of the guided filter
         eps: guided filter regularization (use 0) 
         dif: green residual image (from RIXgreen_interpolation)
         Algorithm: one of 'GBTF', 'RI', 'MLRI', 'WMLRI'
+        workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     Returns: 
         blue: the interpolated blue channel 
     """
+    if workspace is None:
+        workspace = Workspace()
+    ws = workspace.scope('blue_interpolation')
+
     if Algorithm == 'GBTF':
         # This functions implements Algorithm 4
         Prb = np.array([[0, 0, -1, 0, -1, 0, 0], 
@@ -31,10 +37,23 @@ def blue_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
                         [0, 0, -1, 0, -1, 0, 0]]) / 32
         Aknl = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]]) / 4
 
-        blue = mosaic[:, :, 2] + mask[:, :, 0] * (green - filter2D(dif, Prb))
-        tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl)\
-                  + mask[:, :, 1] * filter2D(blue, Aknl)
-        blue = blue + tempimg
+        blue = filter2D(dif, Prb, dst=ws.empty_like('blue', dif))
+        np.subtract(green, blue, out=blue)
+        blue *= mask[:, :, 0]
+        # the mosaic is the raw data on the phases of its channel, it is added on the phase plane of B
+        B = mask_phase(mask[:, :, 2])
+        phase_plane(blue, B)[...] += phase_plane(rawq, B)
+        #   tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl) + mask[:, :, 1] * filter2D(blue, Aknl)
+        #   blue = blue + tempimg
+        # tempimg is null outside the G pixels: it is computed in place on the phase planes of Gr and Gb
+        tempimg = filter2D(green, Aknl, dst=ws.empty_like('tempimg', green))
+        Kblue = filter2D(blue, Aknl, dst=ws.empty_like('Kblue', blue))
+        maskGr, maskGb, _, _ = get_mosaic_masks(rawq, pattern)
+        for G in (mask_phase(maskGr), mask_phase(maskGb)):
+            Gtempimg = phase_plane(tempimg, G)
+            np.subtract(phase_plane(rawq, G), Gtempimg, out=Gtempimg)
+            Gtempimg += phase_plane(Kblue, G)
+            phase_plane(blue, G)[...] += Gtempimg
 
     else:
         # This functions implements Algorithm 6
@@ -45,14 +64,18 @@ def blue_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
                       [0, 0, -1, 0, 0]])
         H = np.array([[1/4, 1/2, 1/4], [1/2, 1, 1/2], [1/4, 1/2, 1/4]])
 
-        tentativeB = guidedfilter3gf(green, mosaic[:, :, 2], mask[:, :, 2], h, v, eps, Algorithm, F)
-        tentativeB = np.clip(tentativeB, 0, 255)
-        residualB = mask[:, :, 2] * (mosaic[:, :, 2] - tentativeB)
-        residualB = filter2D(residualB, H)
-        blue = residualB + tentativeB
+        # the blue channel of the mosaic, mosaic[:, :, 2]
+        p = ws.ufunc('p', np.multiply, rawq, mask[:, :, 2])
+        tentativeB = guidedfilter3gf(green, p, mask[:, :, 2], h, v, eps, Algorithm, F, workspace,
+                                     dst=ws.empty_like('tentative', green))
+        np.clip(tentativeB, 0, 255, out=tentativeB)
+        residualB = ws.ufunc('residual', np.subtract, p, tentativeB)
+        residualB *= mask[:, :, 2]
+        blue = filter2D(residualB, H, dst=ws.empty_like('blue', residualB))
+        blue += tentativeB
 
     # blue interpolation
-    blue = np.clip(blue, 0, 255)
+    np.clip(blue, 0, 255, out=blue)
 
     return blue
 
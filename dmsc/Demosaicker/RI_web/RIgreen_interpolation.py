@@ -1,7 +1,7 @@
 import numpy as np
 from RIHaResidual import haresidual  # used by GBTF
 from RIGuidefilterResidual import GuidefilterResidual  # used by RI, MLRI, and WMLRI
-from filtertools import filter2D, getGaussianKernel
+from filtertools import filter2D, getGaussianKernel, Workspace
 from mosaic_bayer import get_mosaic_masks
 
 
@@ -43,11 +43,13 @@ def DirectsSmooth4Kernel(Algorithm, sigma):
 
 
 #  Directional weights
-def Means4Weights(Algorithm, difh2, difv2):
+def Means4Weights(Algorithm, difh2, difv2, workspace=None):
     """
     computes the weights used for the directional propagation (S,N,W,E) 
     for different demosaicing Algorithms (GBTF, RI, MLRI, WMLRI) 
+    workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     """    
+    ws = (Workspace() if workspace is None else workspace).scope('Means4Weights')
     if Algorithm == 'GBTF':
         K = np.multiply(getGaussianKernel(5, 2), (getGaussianKernel(5, 2)).T)
         Kw = np.array([[1, 0, 0]])
@@ -68,44 +70,47 @@ def Means4Weights(Algorithm, difh2, difv2):
         Kw = np.array([[1, 0, 0]])
         Ke = np.array([[0, 0, 1]])
 
-    wh = filter2D(difh2, K)
-    wv = filter2D(difv2, K)
+    wh = filter2D(difh2, K, dst=ws.empty_like('wh', difh2))
+    wv = filter2D(difv2, K, dst=ws.empty_like('wv', difv2))
 
     Ks = Ke.T
     Kn = Kw.T
 
-    Ww = filter2D(wh, Kw)
-    We = filter2D(wh, Ke)
-    Wn = filter2D(wv, Kn)
-    Ws = filter2D(wv, Ks)
+    Ww = filter2D(wh, Kw, dst=ws.empty_like('Ww', wh))
+    We = filter2D(wh, Ke, dst=ws.empty_like('We', wh))
+    Wn = filter2D(wv, Kn, dst=ws.empty_like('Wn', wv))
+    Ws = filter2D(wv, Ks, dst=ws.empty_like('Ws', wv))
 
-    Ww = 1 / (Ww * Ww + 1e-32)
-    We = 1 / (We * We + 1e-32)
-    Ws = 1 / (Ws * Ws + 1e-32)
-    Wn = 1 / (Wn * Wn + 1e-32)
+    # W = 1 / (W * W + 1e-32), in place
+    for W in (Ww, We, Ws, Wn):
+        np.multiply(W, W, out=W)
+        W += 1e-32
+        np.divide(1, W, out=W)
  
     return Wn, Ws, We, Ww
 
 
 
 
-def green_interpolation(mosaic, mask, pattern, sigma, Algorithm):
+def green_interpolation(rawq, mask, pattern, sigma, Algorithm, workspace=None):
     """ 
     green interpolation implementing Residual Interpolation demosaicking 
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         sigma: directional weight smoothing (ignored by GBTF)
         Algorithm: one of 'GBTF', 'RI', 'MLRI', 'WMLRI'
+        workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     Returns: 
         green: the interpolated green channel 
         dif: green residual image
     """
 
-    # raw CFA data
-    rawq = np.sum(mosaic, axis=2)
+    if workspace is None:
+        workspace = Workspace()
+    ws = workspace.scope('green_interpolation')
 
     ### Calculate Horizontal and Vertical Color Differences ###
     # mask
@@ -115,31 +120,40 @@ def green_interpolation(mosaic, mask, pattern, sigma, Algorithm):
     # Algorithm = 'RI'
     if Algorithm == 'GBTF':
         # This functions implements Algorithm 3
-        difh, difv, difh2, difv2 = haresidual(rawq, mask, maskGr, maskGb, mosaic)
+        difh, difv, difh2, difv2 = haresidual(rawq, mask, maskGr, maskGb, workspace)
     else:
         # This functions implements Algorithm 5
-        difh, difv, difh2, difv2 = GuidefilterResidual(rawq, mask, maskGr, maskGb, mosaic, Algorithm)
+        difh, difv, difh2, difv2 = GuidefilterResidual(rawq, mask, maskGr, maskGb, Algorithm, workspace)
 
     ## final color differece estimate (last part of the 3rd step)
     # directional weight. These lines implement line 19 of Algorithm 5
     Kn, Ks, Ke, Kw = DirectsSmooth4Kernel(Algorithm, sigma)
-    Wn, Ws, We, Ww = Means4Weights(Algorithm, difh2, difv2)
-
-    # combine directional color differences
-    difn = filter2D(difv, Kn)
-    difs = filter2D(difv, Ks)
-    dife = filter2D(difh, Ke)
-    difw = filter2D(difh, Kw)
-
-    Wt = Ww + We + Wn + Ws
-    dif = (Wn * difn + Ws * difs + Ww * difw + We * dife) / Wt
+    Wn, Ws, We, Ww = Means4Weights(Algorithm, difh2, difv2, workspace)
+
+    # combine directional color differences, weighted in place
+    difn = filter2D(difv, Kn, dst=ws.empty_like('difn', difv))
+    difs = filter2D(difv, Ks, dst=ws.empty_like('difs', difv))
+    dife = filter2D(difh, Ke, dst=ws.empty_like('dife', difh))
+    difw = filter2D(difh, Kw, dst=ws.empty_like('difw', difh))
+
+    #   dif = (Wn * difn + Ws * difs + Ww * difw + We * dife) / (Ww + We + Wn + Ws)
+    Wt = ws.ufunc('Wt', np.add, Ww, We)
+    Wt += Wn
+    Wt += Ws
+    dif = ws.ufunc('dif', np.multiply, Wn, difn)
+    dif += np.multiply(Ws, difs, out=difs)
+    dif += np.multiply(Ww, difw, out=difw)
+    dif += np.multiply(We, dife, out=dife)
+    dif /= Wt
 
     # Calculate Green by adding bayer raw data (4th step)
-    green = dif + rawq
+    green = ws.ufunc('green', np.add, dif, rawq)
 
-    green = green * (1-mask[:, :, 1]) + rawq * mask[:, :, 1]
+    #   green = green * (1-mask[:, :, 1]) + rawq * mask[:, :, 1]
+    green *= np.subtract(1, mask[:, :, 1], out=Wt)
+    green += np.multiply(rawq, mask[:, :, 1], out=Wt)
 
     # clip to 0-255
-    green = np.clip(green, 0, 255)
+    np.clip(green, 0, 255, out=green)
 
     return green, dif
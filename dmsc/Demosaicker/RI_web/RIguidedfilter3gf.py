@@ -10,12 +10,12 @@
 #####################################################################################
 
 import numpy as np
-from filtertools import filter2D, boxFilter
+from filtertools import filter2D, Moments, Workspace
 
 
 
 
-def guidedfilter3gf(I, p, M, h, v, eps, Algorithm, F):
+def guidedfilter3gf(I, p, M, h, v, eps, Algorithm, F, workspace=None, dst=None):
     """
     implements 3 variants of the Guided Filter (GF) including Minimized-Laplacian Guided Filter (MLGF) 
     which are used by the RI, MLRI, and WMLRI demosaicing algorithms
@@ -27,6 +27,8 @@ def guidedfilter3gf(I, p, M, h, v, eps, Algorithm, F):
         eps: regularization
         Algorithm: RI,MLRI,WMLRI
         F: laplacian kernel
+        workspace: optional Workspace holding the intermediate images, reused by the next calls
+        dst: optional array of the shape and type of q receiving it
     Returns: 
         q: filtered version of p 
     """   
@@ -36,62 +38,113 @@ def guidedfilter3gf(I, p, M, h, v, eps, Algorithm, F):
     # Image size
     I_size = I.shape
 
-    # The number of the sammpled pixels in each local patch
+    # the intermediate images are written in the buffers of the workspace (fresh ones without workspace)
+    ws = (Workspace() if workspace is None else workspace).scope('guidedfilter3gf')
+
     # In MATLAB, h and v are radii, but in opencv, diameter is required
     boxsz = (2*h+1, 2*v+1)
-    N = boxFilter(M, boxsz)
+
+    # each windowed moment is computed and box filtered once, WMLRI reuses those of RI and MLRI
+    IM = ws.ufunc('IM', np.multiply, I, M)
+    if Algorithm == 'MLRI' or Algorithm =='WMLRI':
+        difIF = filter2D(IM, F, dst=ws.empty_like('difIF', IM))
+        difpF = filter2D(p, F, dst=ws.empty_like('difpF', p))
+        IpF = ws.ufunc('IpF', np.multiply, difIF, difpF)
+        IpF *= M
+        IIF = ws.ufunc('IIF', np.multiply, difIF, difIF)
+        IIF *= M
+        moments = dict(IpF=IpF, IIF=IIF)
+    else:  # Algorithm='RI'
+        Ip = ws.ufunc('Ip', np.multiply, I, p)
+        Ip *= M
+        moments = dict(Ip=Ip)
+    if Algorithm == 'RI' or Algorithm =='WMLRI':
+        II = ws.ufunc('II', np.multiply, I, I)
+        II *= M
+        moments.update(II=II)
+    if Algorithm =='WMLRI':
+        pp = ws.ufunc('pp', np.multiply, p, p)
+        pp *= M
+        pI = ws.ufunc('pI', np.multiply, p, I)
+        pI *= M
+        moments.update(pp=pp, pI=pI)
+    S = Moments(boxsz, ws.scope('S'), N=M, I=IM, p=ws.ufunc('pM', np.multiply, p, M), **moments)
+
+    # The number of the sammpled pixels in each local patch
+    N = S.N
     # this avoids 0/0 in rectangles where the mask is null, and the result should be 0.
-    N[N == 0] = 1
+    N[ws.ufunc('N0', np.equal, N, 0)] = 1
 
     # these are weighted box means because N is computed from M
-    mean_I = boxFilter(I * M, boxsz) / N  
-    mean_p = boxFilter(p * M, boxsz) / N
+    mean_I = ws.ufunc('mean_I', np.divide, S.I, N)
+    mean_p = ws.ufunc('mean_p', np.divide, S.p, N)
 
     # Algorithm='MLRI'
     if Algorithm == 'MLRI' or Algorithm =='WMLRI':
-        difIF = filter2D(I*M, F) 
-        difpF = filter2D(p, F)
-        mean_Ip = boxFilter(difIF * difpF * M, boxsz) / N
-        mean_II = boxFilter(difIF * difIF * M, boxsz) / N
-        mean_II[mean_II < th] = th   
-        a = mean_Ip / (mean_II + eps)
+        mean_Ip = ws.ufunc('mean_Ip', np.divide, S.IpF, N)
+        mean_II = ws.ufunc('mean_II', np.divide, S.IIF, N)
+        mean_II[ws.ufunc('th', np.less, mean_II, th)] = th
+        a = ws.ufunc('a', np.add, mean_II, eps)
+        np.divide(mean_Ip, a, out=a)
     else:  # Algorithm='RI'
-        mean_Ip = boxFilter(I * p * M, boxsz) / N
+        mean_Ip = ws.ufunc('mean_Ip', np.divide, S.Ip, N)
         # The covariance of (I, p) in each local patch
-        mean_II = boxFilter(I * I * M, boxsz) / N
-        cov_Ip = mean_Ip - mean_I * mean_p
-        var_I = mean_II - mean_I * mean_I
-        var_I[var_I < th] = th
+        mean_II = ws.ufunc('mean_II', np.divide, S.II, N)
+        cov_Ip = ws.ufunc('cov_Ip', np.multiply, mean_I, mean_p)
+        np.subtract(mean_Ip, cov_Ip, out=cov_Ip)
+        var_I = ws.ufunc('var_I', np.multiply, mean_I, mean_I)
+        np.subtract(mean_II, var_I, out=var_I)
+        var_I[ws.ufunc('th', np.less, var_I, th)] = th
 
         # linear coefficients
-        a = cov_Ip / (var_I + eps)
+        a = ws.ufunc('a', np.add, var_I, eps)
+        np.divide(cov_Ip, a, out=a)
 
-    b = mean_p - a * mean_I
+    b = ws.ufunc('b', np.multiply, a, mean_I)
+    np.subtract(mean_p, b, out=b)
 
     if Algorithm =='WMLRI':
         # computes the denominator of line 16 in Algorithm 11
-        dif = boxFilter(I * I * M, boxsz) * a * a \
-              + b * b * N + boxFilter(p * p * M, boxsz) \
-              + 2 * a * b * boxFilter(I * M, boxsz)\
-              - 2 * b * boxFilter(p * M, boxsz) \
-              - 2 * a * boxFilter(p * I * M, boxsz)
-        dif = dif / N
-        dif[dif < 0] = 0
-        dif[dif < 0.001] = 0.001
-        dif = 1 / dif
-        wdif = boxFilter(dif, boxsz)
-        wdif[wdif < 0.001] = 0.001
-        mean_a = boxFilter(a * dif, boxsz) / wdif
-        mean_b = boxFilter(b * dif, boxsz) / wdif
+        #   S.II * a * a + b * b * N + S.pp + 2 * a * b * S.I - 2 * b * S.p - 2 * a * S.pI
+        dif = ws.ufunc('dif', np.multiply, S.II, a)
+        dif *= a
+        term = ws.ufunc('term', np.multiply, b, b)
+        term *= N
+        dif += term
+        dif += S.pp
+        np.multiply(a, 2, out=term)
+        term *= b
+        term *= S.I
+        dif += term
+        np.multiply(b, 2, out=term)
+        term *= S.p
+        dif -= term
+        np.multiply(a, 2, out=term)
+        term *= S.pI
+        dif -= term
+        dif /= N
+        dif[ws.ufunc('th', np.less, dif, 0)] = 0
+        dif[ws.ufunc('th', np.less, dif, 0.001)] = 0.001
+        np.divide(1, dif, out=dif)
+        W = Moments(boxsz, ws.scope('W'), dif=dif, a=ws.ufunc('adif', np.multiply, a, dif),
+                    b=ws.ufunc('bdif', np.multiply, b, dif))
+        wdif = W.dif
+        wdif[ws.ufunc('th', np.less, wdif, 0.001)] = 0.001
+        mean_a = np.divide(W.a, wdif, out=W.a)
+        mean_b = np.divide(W.b, wdif, out=W.b)
 
     else:
         # The size of each local patch; N=(2h+1)*(2v+1) except for boundary pixels.
-        N2 = boxFilter(np.ones((I_size[0], I_size[1])), boxsz)
+        ones = ws.empty('ones', (I_size[0], I_size[1]), I.dtype)
+        ones.fill(1)
+        W = Moments(boxsz, ws.scope('W'), N=ones, a=a, b=b)
+        N2 = W.N
 
-        mean_a = boxFilter(a, boxsz) / N2
-        mean_b = boxFilter(b, boxsz) / N2
+        mean_a = np.divide(W.a, N2, out=W.a)
+        mean_b = np.divide(W.b, N2, out=W.b)
 
     # output
-    q = mean_a * I + mean_b
+    q = np.multiply(mean_a, I, out=dst)
+    q += mean_b
 
     return q
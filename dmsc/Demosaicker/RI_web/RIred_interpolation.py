@@ -1,26 +1,32 @@
 import numpy as np
 from RIguidedfilter3gf import guidedfilter3gf
-from filtertools import filter2D
+from filtertools import filter2D, Workspace
+from mosaic_bayer import get_mosaic_masks, mask_phase, phase_plane
 
 
 
 
-def red_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
+def red_interpolation(green, rawq, mask, pattern, h, v, eps, dif, Algorithm, workspace=None):
     """ 
     red interpolation implementing Residual Interpolation demosaicking
     algorithms ('GBTF', 'RI', 'MLRI', 'WMLRI')  
     Arguments: 
         green: image containing the interpolated green channel
-        mosaic: 3 channel image containing the R G B mosaic
+        rawq: raw CFA data (single plane HxW)
         mask: 3 channel image indicating where the mosaic is set
         pattern: Bayer pattern 'grbg', 'rggb', 'gbrg', 'bggr'
         h,v: support of the guided filter
         eps: guided filter regularization (use 0) 
         dif: green residual image (from RIXgreen_interpolation)
         Algorithm: one of 'GBTF', 'RI', 'MLRI', 'WMLRI'
+        workspace: optional Workspace holding the intermediate and returned images, reused by the next calls
     Returns: 
         red: the interpolated red channel 
     """
+    if workspace is None:
+        workspace = Workspace()
+    ws = workspace.scope('red_interpolation')
+
     if Algorithm == 'GBTF':
         # This functions implements Algorithm 4
         Prb = np.array([[0, 0, -1, 0, -1, 0, 0], 
@@ -33,11 +39,24 @@ def red_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
         Aknl = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]]) / 4
 
         # this line corresponds to line 4 of Algorithm 4
-        red = mosaic[:, :, 0] + mask[:, :, 2] * (green - filter2D(dif, Prb))
+        red = filter2D(dif, Prb, dst=ws.empty_like('red', dif))
+        np.subtract(green, red, out=red)
+        red *= mask[:, :, 2]
+        # the mosaic is the raw data on the phases of its channel, it is added on the phase plane of R
+        R = mask_phase(mask[:, :, 0])
+        phase_plane(red, R)[...] += phase_plane(rawq, R)
         # this line computes:  G - [\hat G - \hat R] \otimes K_A 
-        tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl)\
-                  + mask[:, :, 1] * filter2D(red, Aknl)
-        red = red + tempimg
+        #   tempimg = mosaic[:, :, 1] - mask[:, :, 1] * filter2D(green, Aknl) + mask[:, :, 1] * filter2D(red, Aknl)
+        #   red = red + tempimg
+        # tempimg is null outside the G pixels: it is computed in place on the phase planes of Gr and Gb
+        tempimg = filter2D(green, Aknl, dst=ws.empty_like('tempimg', green))
+        Kred = filter2D(red, Aknl, dst=ws.empty_like('Kred', red))
+        maskGr, maskGb, _, _ = get_mosaic_masks(rawq, pattern)
+        for G in (mask_phase(maskGr), mask_phase(maskGb)):
+            Gtempimg = phase_plane(tempimg, G)
+            np.subtract(phase_plane(rawq, G), Gtempimg, out=Gtempimg)
+            Gtempimg += phase_plane(Kred, G)
+            phase_plane(red, G)[...] += Gtempimg
 
     else:
         # This functions implements Algorithm 6
@@ -48,14 +67,18 @@ def red_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm):
                       [0, 0, -1, 0, 0]])
         H = np.array([[1/4, 1/2, 1/4], [1/2, 1, 1/2], [1/4, 1/2, 1/4]])
         
-        tentativeR = guidedfilter3gf(green, mosaic[:, :, 0], mask[:, :, 0], h, v, eps, Algorithm, F)
-        tentativeR = np.clip(tentativeR, 0, 255)
-        residualR = mask[:, :, 0] * (mosaic[:, :, 0] - tentativeR)
-        residualR = filter2D(residualR, H)
-        red = residualR + tentativeR
+        # the red channel of the mosaic, mosaic[:, :, 0]
+        p = ws.ufunc('p', np.multiply, rawq, mask[:, :, 0])
+        tentativeR = guidedfilter3gf(green, p, mask[:, :, 0], h, v, eps, Algorithm, F, workspace,
+                                     dst=ws.empty_like('tentative', green))
+        np.clip(tentativeR, 0, 255, out=tentativeR)
+        residualR = ws.ufunc('residual', np.subtract, p, tentativeR)
+        residualR *= mask[:, :, 0]
+        red = filter2D(residualR, H, dst=ws.empty_like('red', residualR))
+        red += tentativeR
 
     # R interpolation
-    red = np.clip(red, 0, 255)
+    np.clip(red, 0, 255, out=red)
 
     return red
 
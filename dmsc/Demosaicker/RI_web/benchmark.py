@@ -0,0 +1,60 @@
+#-*-coding:utf-8-*-
+# Benchmark of the demosaicking algorithms ('HA', 'GBTF', 'RI', 'MLRI', 'WMLRI', 'ARI')
+# computed with float64 and float32 intermediate images.
+#
+# For each algorithm it reports the best run time of each type, the CPSNR with respect to
+# the ground truth and the PSNR of the float32 result with respect to the float64 one.
+#
+# $ python benchmark.py --input Sans_bruit_13.PNG --Algorithm HA GBTF RI --repeat 3
+
+import time
+import numpy as np
+from run import demosaick
+from impsnr import imcpsnr
+
+
+def best_time(func, repeat):
+    """
+    runs func() repeat times, returns the last result and the best run time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(args):
+    from skimage.io import imread
+    rgb = imread(args.input).astype('float32')
+
+    print('{:6s} {:>10s} {:>10s} {:>8s} {:>12s} {:>12s} {:>14s} {:>10s}'.format(
+        'algo', 'f64 (s)', 'f32 (s)', 'speedup', 'CPSNR f64', 'CPSNR f32', 'f32 vs f64', 'max diff'))
+
+    for Algorithm in args.Algorithm:
+        results = {}
+        for dtype in (np.float64, np.float32):
+            rgb_dem, elapsed = best_time(lambda: demosaick(rgb, args.pattern, args.sigma, Algorithm, dtype), args.repeat)
+            results[dtype] = (np.clip(rgb_dem, 0, 255), elapsed)
+
+        (dem64, t64), (dem32, t32) = results[np.float64], results[np.float32]
+        print('{:6s} {:10.3f} {:10.3f} {:7.2f}x {:9.4f} dB {:9.4f} dB {:11.4f} dB {:10.4f}'.format(
+            Algorithm, t64, t32, t64 / t32,
+            imcpsnr(rgb, dem64, 255, args.border), imcpsnr(rgb, dem32, 255, args.border),
+            imcpsnr(dem64, dem32, 255, args.border), np.abs(dem64 - dem32.astype(np.float64)).max()))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default='Sans_bruit_13.PNG', help="ground truth image")
+    parser.add_argument("--pattern", default='grbg', help="bayer pattern", type=str)
+    parser.add_argument("--Algorithm", default=['HA', 'GBTF', 'RI', 'MLRI', 'WMLRI', 'ARI'], nargs='+', help="Demosaicing Algorithms", type=str)
+    parser.add_argument("--sigma", default=1, help="standard deviation of the regularization gaussian used in RI, MLRI, WMLRI", type=float)
+    parser.add_argument("--repeat", default=3, help="number of runs of each algorithm, the best time is reported", type=int)
+    parser.add_argument("--border", default=10, help="border removed before computing the PSNR", type=int)
+
+    args = parser.parse_args()
+    main(args)
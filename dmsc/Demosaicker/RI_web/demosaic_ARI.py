@@ -1,30 +1,42 @@
 import numpy as np
-from mosaic_bayer import mosaic_bayer
+from mosaic_bayer import mosaic_bayer, mosaic_cfa, bayer_masks
 from ARIgreen_interpolation import ARIgreen_interpolation
 from ARIred_blue_interpolation_first import ARIred_blue_interpolation_first
 from ARIred_blue_interpolation_second import ARIred_blue_interpolation_second
 
 
-def demosaic_ARI(mosaic, pattern):
+def demosaic_ARI(mosaic, pattern, dtype=np.float64, min_improved=None, iterations=None, active_tile_size=None,
+                 workspace=None):
     """
     ARI (Adaptive Residual Interpolation) demosaicing main function
+    mosaic is a 3 channel mosaic (or rgb image) or a single plane HxW CFA
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
+    min_improved and iterations set the early exit of the green iterations and report their number,
+    active_tile_size enables their active-set mode (see ARIgreen_interpolation)
+    workspace is an optional filtertools.Workspace whose scratch buffers are reused by the calls on images
+    of the same size (e.g. a batch), instead of allocating new intermediate images for each image
     """
     # guided filter epsilon
     eps = 1e-10
 
-    # mosaic and mask (just to generate the mask)
-    mosaic, mask = mosaic_bayer(mosaic, pattern)
+    # the algorithms work on the raw CFA data (rawq) and the masks of the pattern
+    if mosaic.ndim == 2:
+        rawq = mosaic.astype(dtype, copy=False)
+    else:
+        rawq = mosaic_cfa(mosaic, pattern, dtype)
+    mask = bayer_masks(rawq.shape[0], rawq.shape[1], pattern, dtype)[0]
 
     # green interpolation
-    green = ARIgreen_interpolation(mosaic, mask, pattern, eps)
+    green = ARIgreen_interpolation(rawq, mask, pattern, eps, min_improved, iterations, active_tile_size,
+                                  workspace)
 
     # red and blue interpolation (first step: diagonal)
-    red, blue = ARIred_blue_interpolation_first(green, mosaic, mask, eps)
+    red, blue = ARIred_blue_interpolation_first(green, rawq, mask, eps)
 
     # red and blue interpolation (second step: horizontal/vertical)
-    red, blue = ARIred_blue_interpolation_second(green, red, blue, mask, eps)
+    red, blue = ARIred_blue_interpolation_second(green, red, blue, mask, eps, workspace)
 
-    rgb_dem = np.zeros(mosaic.shape)
+    rgb_dem = np.zeros(rawq.shape + (3,), dtype=rawq.dtype)
     rgb_dem[:, :, 0] = red
     rgb_dem[:, :, 1] = green
     rgb_dem[:, :, 2] = blue
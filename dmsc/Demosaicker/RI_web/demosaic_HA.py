@@ -1,12 +1,13 @@
 import numpy as np
-from mosaic_bayer import mosaic_bayer, get_mosaic_masks
+from mosaic_bayer import mosaic_bayer, mosaic_cfa, bayer_masks, get_mosaic_masks
 from filtertools import filter2D
 
 
 # This functions implements Algorithm 1
-def hagreen_interpolation(mosaic, mask):
+def hagreen_interpolation(rawq, mask):
     """
     hamilton-adams green channel processing
+    rawq is the raw CFA data (single plane HxW)
     """
     Kh = np.array([[1/2, 0, 1/2]])  
     Kv = Kh.T
@@ -19,8 +20,6 @@ def hagreen_interpolation(mosaic, mask):
     Diffh =np.array([[1, 0, -1]])
     Diffv = Diffh.T
 
-    rawq = np.sum(mosaic, axis=2) #    get the raw CFA data
-
     rawh = filter2D( rawq, Kh  ) - filter2D( rawq, Deltah/4 )
     rawv = filter2D( rawq, Kv  ) - filter2D( rawq, Deltav/4  )
     CLh = np.abs( filter2D(rawq, Diffh) ) + np.abs( filter2D(rawq, Deltah) ) 
@@ -40,12 +39,12 @@ def hagreen_interpolation(mosaic, mask):
 
 
 # This functions implements Algorithm 2 (red pixels)
-def hared_interpolation(green, mosaic, mask, pattern):
+def hared_interpolation(green, rawq, mask, pattern):
     """
     hamilton-adams red channel processing
     """
     # mask
-    maskGr, maskGb, _, maskB = get_mosaic_masks(mosaic,pattern)
+    maskGr, maskGb, maskR, maskB = get_mosaic_masks(rawq,pattern)
 
     Kh = np.array([[1, 0, 1]])
     Kv = Kh.T
@@ -62,7 +61,8 @@ def hared_interpolation(green, mosaic, mask, pattern):
     Diffp = np.array([[-1, 0, 0], [0, 0, 0], [0, 0, 1]])
     Diffn = np.array([[0, 0, -1], [0, 0, 0], [1, 0, 0]])
 
-    mosaicR = mosaic[:,:,0]
+    # red plane of the mosaic
+    mosaicR = rawq * maskR
 
     Rh  = maskGr * ( 0.5 * filter2D( mosaicR, Kh ) - 0.25 * filter2D( green, Deltah ))
     Rv  = maskGb * ( 0.5 * filter2D( mosaicR, Kv ) - 0.25 * filter2D( green, Deltav ))
@@ -84,12 +84,12 @@ def hared_interpolation(green, mosaic, mask, pattern):
 
 
 # This functions implements Algorithm 2 (blue pixels)
-def hablue_interpolation(green, mosaic, mask, pattern):
+def hablue_interpolation(green, rawq, mask, pattern):
     """
     hamilton-adams blue channel processing
     """
     # masks
-    maskGr, maskGb, maskR, _ = get_mosaic_masks(mosaic,pattern)
+    maskGr, maskGb, maskR, maskB = get_mosaic_masks(rawq,pattern)
 
     Kh = np.array([[1, 0, 1]])
     Kv = Kh.T
@@ -106,7 +106,8 @@ def hablue_interpolation(green, mosaic, mask, pattern):
     Diffp = np.array([[-1, 0, 0], [0, 0, 0], [0, 0, 1]])
     Diffn = np.array([[0, 0, -1], [0, 0, 0], [1, 0, 0]])
 
-    mosaicB = mosaic[:,:,2]
+    # blue plane of the mosaic
+    mosaicB = rawq * maskB
 
     Bh  = maskGb * ( 0.5 * filter2D( mosaicB, Kh ) - 0.25 * filter2D( green, Deltah ))
     Bv  = maskGr * ( 0.5 * filter2D( mosaicB, Kv ) - 0.25 * filter2D( green, Deltav ))
@@ -127,29 +128,34 @@ def hablue_interpolation(green, mosaic, mask, pattern):
 
 
 
-def demosaic_HA(mosaic, pattern):
+def demosaic_HA(mosaic, pattern, dtype=np.float64):
     """
     Hamilton-Adams demosaicing main function
+    mosaic is a 3 channel mosaic (or rgb image) or a single plane HxW CFA
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
     """
 
-    # mosaic and mask (just to generate the mask)
-    mosaic, mask = mosaic_bayer(mosaic, pattern)
-
+    # the algorithm works on the raw CFA data (rawq) and the masks of the pattern
+    if mosaic.ndim == 2:
+        rawq = mosaic.astype(dtype, copy=False)
+    else:
+        rawq = mosaic_cfa(mosaic, pattern, dtype)
+    mask = bayer_masks(rawq.shape[0], rawq.shape[1], pattern, dtype)[0]
 
     # green interpolation (implements Algorithm 1)
-    green = hagreen_interpolation(mosaic, mask)
+    green = hagreen_interpolation(rawq, mask)
     green = np.clip(green, 0, 255)
 
     # Red and Blue demosaicing (implements Algorithm 2)
-    red = hared_interpolation(green, mosaic, mask, pattern)
-    blue = hablue_interpolation(green, mosaic, mask, pattern)
+    red = hared_interpolation(green, rawq, mask, pattern)
+    blue = hablue_interpolation(green, rawq, mask, pattern)
     red = np.clip(red, 0, 255)
     blue = np.clip(blue, 0, 255)
 
     # result image
 
-    rgb_size = mosaic.shape
-    rgb_dem = np.zeros((rgb_size[0], rgb_size[1], 3))
+    rgb_size = rawq.shape
+    rgb_dem = np.zeros((rgb_size[0], rgb_size[1], 3), dtype=rawq.dtype)
     rgb_dem[:, :, 0] = red
     rgb_dem[:, :, 1] = green
     rgb_dem[:, :, 2] = blue
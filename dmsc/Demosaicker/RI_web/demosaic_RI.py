@@ -1,26 +1,31 @@
 import numpy as np
-from mosaic_bayer import mosaic_bayer
+from mosaic_bayer import mosaic_bayer, mosaic_cfa, bayer_masks
 from RIgreen_interpolation import green_interpolation
 from RIred_interpolation import red_interpolation
 from RIblue_interpolation import blue_interpolation
 
 
 
-def demosaic_RI(mosaic, pattern, sigma, Algorithm):
+def demosaic_RI(mosaic, pattern, sigma, Algorithm, dtype=np.float64, workspace=None):
     """
     Main function for the Residual Interpolation demosaicking
     algorithms 'GBTF', 'RI', 'MLRI', 'WMLRI'
     sigma is ignored by GBTF
+    mosaic is a 3 channel mosaic (or rgb image) or a single plane HxW CFA
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
+    workspace is an optional filtertools.Workspace whose scratch buffers are reused by the calls on images
+    of the same size (e.g. a batch), instead of allocating new intermediate images for each image
     """
 
-    # mosaic and mask (just to generate the mask)
-    mosaic, mask = mosaic_bayer(mosaic, pattern)
-    
-    # imask
-    imask = (mask == 0)
+    # the algorithms work on the raw CFA data (rawq) and the masks of the pattern
+    if mosaic.ndim == 2:
+        rawq = mosaic.astype(dtype, copy=False)
+    else:
+        rawq = mosaic_cfa(mosaic, pattern, dtype)
+    mask = bayer_masks(rawq.shape[0], rawq.shape[1], pattern, dtype)[0]
 
     # green interpolation
-    green, dif = green_interpolation(mosaic, mask, pattern, sigma, Algorithm)
+    green, dif = green_interpolation(rawq, mask, pattern, sigma, Algorithm, workspace)
 
     # parameters for guided upsampling
     h = 5
@@ -28,13 +33,13 @@ def demosaic_RI(mosaic, pattern, sigma, Algorithm):
     eps = 0
 
     # Red and Blue demosaicking
-    red = red_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm)
-    blue = blue_interpolation(green, mosaic, mask, pattern, h, v, eps, dif, Algorithm)
+    red = red_interpolation(green, rawq, mask, pattern, h, v, eps, dif, Algorithm, workspace)
+    blue = blue_interpolation(green, rawq, mask, pattern, h, v, eps, dif, Algorithm, workspace)
 
 
     # result image
-    rgb_size = mosaic.shape
-    rgb_dem = np.zeros((rgb_size[0], rgb_size[1], 3))
+    rgb_size = rawq.shape
+    rgb_dem = np.zeros((rgb_size[0], rgb_size[1], 3), dtype=rawq.dtype)
     rgb_dem[:, :, 0] = red
     rgb_dem[:, :, 1] = green
     rgb_dem[:, :, 2] = blue
@@ -0,0 +1,10 @@
+# The RI_web package shares helpers of the dmsc tree, two folders up: the tiling of tiling.py, the Bayer
+# masks and filter2D of utils.py and the image metrics of metrics.py (see README.txt).
+# Importing this module makes them importable when the package runs on its own (run.py, benchmark.py);
+# the dmsc folder is appended to sys.path, so the modules of the package keep the priority.
+import os
+import sys
+
+DMSC_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if DMSC_ROOT not in sys.path:
+    sys.path.append(DMSC_ROOT)
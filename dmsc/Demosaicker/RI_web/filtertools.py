@@ -1,20 +1,119 @@
 import cv2
+import numpy as np
+from functools import lru_cache
+import dmsc_root  # makes utils importable
+# filter2D dispatches the low-rank kernels to cv2.sepFilter2D (see utils.separableKernel)
+from utils import filter2D
 
 
-def filter2D(im, ker):
+def filter2DStack(ims, ker, dst=None):
     """
-    convolve the 2d  image (im) with the 2d kernel (ker) and return a 2d  image
-    pads the image to preserve the shape by replicating boundaries
+    convolve each 2d image of the stack ims (NxHxW) with the 2d kernel (ker), like filter2D
+    returns the NxHxW stack of the filtered images
+    dst: optional contiguous NxHxW array of the type of ims (not ims itself) receiving the result
     """
-    return cv2.filter2D(im,  -1, kernel=ker, borderType=cv2.BORDER_REPLICATE)
+    if dst is None:
+        return np.stack([filter2D(im, ker) for im in ims])
+    for im, im_dst in zip(ims, dst):
+        filter2D(im, ker, dst=im_dst)
+    return dst
 
 
-def boxFilter(im, sz):
+def boxFilter(im, sz, dst=None):
     """
     convolve the 2d  image (im) with a box filter of diameter sz (tuple)
     pads the image to preserve the shape by replicating boundaries
+    dst: optional contiguous 2d array of the shape and type of im receiving the result
+    """
+    return cv2.boxFilter(im,  -1, sz, dst=dst, normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+
+class Workspace:
     """
-    return cv2.boxFilter(im,  -1, sz, normalize=False, borderType=cv2.BORDER_CONSTANT)
+    scratch buffers reused by the successive calls of a demosaicking pipeline, e.g. over a batch of images
+    of the same size: the buffer of a (name, shape, dtype) is allocated at its first request and returned
+    again by the next ones, to be filled with dst= (OpenCV) or out= (NumPy)
+    a buffer is overwritten by the next request of the same name: each function requests its buffers
+    in its own scope, and the buffers it returns are valid until its next call (the next image)
+    """
+    def __init__(self, buffers=None, prefix=''):
+        self.buffers = {} if buffers is None else buffers
+        self.prefix = prefix
+
+    def scope(self, name):
+        """
+        returns the workspace of a function (or of a part of it) sharing the buffers of this one,
+        its buffer names are prefixed by name
+        """
+        return Workspace(self.buffers, self.prefix + name + '.')
+
+    def empty(self, name, shape, dtype):
+        """
+        returns the uninitialized buffer name of the given shape and dtype
+        """
+        key = (self.prefix + name, tuple(shape), np.dtype(dtype))
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = np.empty(shape, dtype)
+        return buf
+
+    def empty_like(self, name, im):
+        """
+        returns the uninitialized buffer name of the shape and dtype of im
+        """
+        return self.empty(name, im.shape, im.dtype)
+
+    def ufunc(self, name, func, *args):
+        """
+        computes the NumPy ufunc func(*args) into the buffer name, of the shape and dtype of its result
+        comparisons (np.less...) give boolean buffers
+        """
+        shape = np.broadcast(*args).shape
+        # the type of the result is that of func on one element of each array (and the scalars)
+        dtype = func(*(np.ones(1, a.dtype) if isinstance(a, np.ndarray) else a for a in args)).dtype
+        return func(*args, out=self.empty(name, shape, dtype))
+
+
+class Moments:
+    """
+    box sums of diameter sz (tuple) of the moments (products of images) of a guided filter
+    each moment is given once by name, box filtered once and read as an attribute of the same name
+    workspace: optional Workspace whose buffers (named after the moments) receive the sums
+    """
+    def __init__(self, sz, workspace=None, **moments):
+        for name, im in moments.items():
+            dst = None if workspace is None else workspace.empty_like(name, im)
+            setattr(self, name, boxFilter(im, sz, dst))
+
+
+@lru_cache(maxsize=None)
+def diagKernels(h, v):
+    """
+    returns the 1d kernels, along the diagonal (2h+1 taps) and the anti-diagonal (2v+1 taps),
+    whose composition is the diagonal window of radii (h, v) of diagBoxFilter
+    a radius of 0 gives None (no filtering in that direction)
+    """
+    Kd = np.eye(2 * h + 1) if h > 0 else None
+    Ka = np.fliplr(np.eye(2 * v + 1)) if v > 0 else None
+    return Kd, Ka
+
+
+def diagBoxFilter(im, h, v):
+    """
+    sums of the 2d image (im) over the diagonal window of radii (h, v) of the ARI diagonal guided filters:
+    the pixels at (a+b, a-b) from the center with |a| <= h and |b| <= v, a rectangle of the quincunx lattice
+    like filter2D with the equivalent (2r+1)x(2r+1) window (r = h+v) and replicated boundaries, up to rounding,
+    but computed as two 1d diagonal filters of 2h+1 and 2v+1 taps on the image padded once by r
+    """
+    Kd, Ka = diagKernels(h, v)
+    r = h + v
+    height, width = im.shape
+    sums = cv2.copyMakeBorder(im, r, r, r, r, cv2.BORDER_REPLICATE)
+    if Kd is not None:
+        sums = filter2D(sums, Kd)
+    if Ka is not None:
+        sums = filter2D(sums, Ka)
+    return sums[r:r + height, r:r + width]
 
 
 def getGaussianKernel(sz,sigma):
@@ -22,3 +121,58 @@ def getGaussianKernel(sz,sigma):
     returns a 1d Gaussian kernel with standard deviation sigma and support sz 
     """
     return cv2.getGaussianKernel(sz, sigma)
+
+
+class ArgminAccumulator:
+    """
+    running minimum, at each pixel, of the iteration criteria of ARI and optionally selection of the values
+    of smallest criterion: criterion (and value) are 2d arrays updated in place
+    the pixels of smaller criterion are marked in a preallocated boolean mask, no index arrays are built
+    region: optional (rows, cols) slices restricting an update to a part of the arrays
+    """
+    def __init__(self, criterion, value=None):
+        self.criterion = criterion
+        self.value = value
+        self.mask = np.empty(criterion.shape, dtype=bool)
+        # buffers of changed(), allocated at its first call
+        self.difference = None
+        self.changed_mask = None
+
+    def select(self, criterion, region=Ellipsis):
+        """
+        marks the pixels where criterion is smaller than the running minimum criterion, returns the mask
+        """
+        mask = self.mask[region]
+        np.less(criterion, self.criterion[region], out=mask)
+        return mask
+
+    def changed(self, value, tol, region=Ellipsis):
+        """
+        among the marked pixels, marks those where value differs from the selected value by more than tol
+        returns their mask and their number
+        """
+        if self.difference is None:
+            self.difference = np.empty(self.value.shape, dtype=np.result_type(self.value, value))
+            self.changed_mask = np.empty(self.value.shape, dtype=bool)
+        difference, changed = self.difference[region], self.changed_mask[region]
+        np.subtract(value, self.value[region], out=difference)
+        np.abs(difference, out=difference)
+        np.greater(difference, tol, out=changed)
+        changed &= self.mask[region]
+        return changed, np.count_nonzero(changed)
+
+    def accept(self, criterion, value=None, region=Ellipsis):
+        """
+        copies criterion, and value into the selected values, at the marked pixels
+        """
+        mask = self.mask[region]
+        np.copyto(self.criterion[region], criterion, where=mask)
+        if value is not None:
+            np.copyto(self.value[region], value, where=mask)
+
+    def update(self, criterion, value=None, region=Ellipsis):
+        """
+        selects value and criterion at the pixels where criterion is smaller than the running minimum criterion
+        """
+        self.select(criterion, region)
+        self.accept(criterion, value, region)
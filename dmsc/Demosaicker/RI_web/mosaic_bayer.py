@@ -1,66 +1,50 @@
 import numpy as np
+import dmsc_root  # makes utils importable
+# the Bayer masks and phases are shared with the other methods of the dmsc tree
+from utils import bayer_masks, get_mosaic_masks, mosaic_cfa, mask_phase, phase_plane
 
 
-def mosaic_bayer(rgb, pattern):
+
+def mosaic_bayer(rgb, pattern, dtype=np.float64):
     """
     generate a mosaic from a rgb image
     pattern can be: 'grbg', 'rggb', 'gbrg', 'bggr'
+    the mosaic and the mask have the given dtype, the mask is read-only (see bayer_masks)
     """
-    num = np.zeros(len(pattern))
-    pattern_list = list(pattern)
-    p = pattern_list.index('r')
-    num[p] = 0
-    p = [idx for idx, i in enumerate(pattern_list) if i == 'g']
-    num[p] = 1
-    p = pattern_list.index('b')
-    num[p] = 2
-
     size_rgb = rgb.shape
-    mask = np.zeros((size_rgb[0], size_rgb[1], 3))
-
-    # Generate mask
-    mask[0::2, 0::2, int(num[0])] = 1
-    mask[0::2, 1::2, int(num[1])] = 1
-    mask[1::2, 0::2, int(num[2])] = 1
-    mask[1::2, 1::2, int(num[3])] = 1
+    mask = bayer_masks(size_rgb[0], size_rgb[1], pattern, dtype)[0]
 
     # Generate mosaic
-    mosaic = rgb * mask
+    mosaic = rgb.astype(dtype, copy=False) * mask
 
     return mosaic, mask
 
 
 
-def get_mosaic_masks(mosaic, pattern):
+def phase_neighbours_mean(plane, phase, target, dst):
     """
-    generate the mosaic masks assuming a given pattern
-    returns:  maskGr, maskGb, maskR, maskB
+    interpolates the plane of the pixels on a phase of the 2x2 Bayer cell at the pixels of the target phase of the
+    same rows (horizontal neighbours) or columns (vertical neighbours), by the mean of their two neighbours on the phase.
+    It is filter2D with [1/2, 0, 1/2] (or its transpose) of the full resolution image null outside the phase,
+    read at the target phase (the neighbours beyond the image border are null).
+    dst receives the plane of the target phase.
     """
-    size_rawq = mosaic.shape
-    maskGr = np.zeros((size_rawq[0], size_rawq[1]))
-    maskGb = np.zeros((size_rawq[0], size_rawq[1]))
-    maskR  = np.zeros((size_rawq[0], size_rawq[1]))
-    maskB  = np.zeros((size_rawq[0], size_rawq[1]))
-
-    if pattern == 'grbg':
-        maskGr[0::2, 0::2] = 1
-        maskGb[1::2, 1::2] = 1
-        maskR [0::2, 1::2] = 1
-        maskB [1::2, 0::2] = 1
-    elif pattern == 'rggb':
-        maskGr[0::2, 1::2] = 1
-        maskGb[1::2, 0::2] = 1
-        maskB [1::2, 1::2] = 1
-        maskR [0::2, 0::2] = 1
-    elif pattern == 'gbrg':
-        maskGb[0::2, 0::2] = 1
-        maskGr[1::2, 1::2] = 1
-        maskR [1::2, 0::2] = 1
-        maskB [0::2, 1::2] = 1
-    elif pattern == 'bggr':
-        maskGb[0::2, 1::2] = 1
-        maskGr[1::2, 0::2] = 1
-        maskB [0::2, 0::2] = 1
-        maskR [1::2, 1::2] = 1
+    if phase[0] != target[0]:
+        # vertical neighbours: the horizontal case on the transposed planes
+        phase_neighbours_mean(plane.T, phase[::-1], target[::-1], dst.T)
+        return dst
+
+    n, m = dst.shape[1], plane.shape[1]
+    dst[:, :min(n, m)] = plane[:, :n]
+    dst[:, m:] = 0
+    if target[1] < phase[1]:
+        # the neighbours of target column j are the columns j - 1 and j of the plane
+        k = min(n, m + 1)
+        dst[:, 1:k] += plane[:, :k - 1]
+    else:
+        # the neighbours of target column j are the columns j and j + 1 of the plane
+        k = min(n, m - 1)
+        dst[:, :k] += plane[:, 1:k + 1]
+    dst *= 0.5
+    return dst
 
-    return maskGr, maskGb, maskR, maskB
\ No newline at end of file
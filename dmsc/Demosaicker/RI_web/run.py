@@ -27,28 +27,39 @@
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
 
-from mosaic_bayer import mosaic_bayer
+import numpy as np
+from mosaic_bayer import mosaic_bayer, mosaic_cfa
 from demosaic_ARI import demosaic_ARI
 from demosaic_HA import demosaic_HA
 from demosaic_RI import demosaic_RI
 
 
-def demosaick(rgb, pattern, sigma, Algorithm):
+def demosaick(rgb, pattern, sigma, Algorithm, dtype=np.float64, min_improved=None, iterations=None, active_tile_size=None,
+              workspace=None):
     """
     wrapper for calling different demosaicking algorithms ('ARI', 'HA', 'GBTF', 'RI', 'MLRI', 'WMLRI')
+    rgb is either a full RGB image, which is mosaicked first, or a single plane HxW CFA
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
+    min_improved and iterations set the early exit of the ARI green iterations and report their number,
+    active_tile_size enables their active-set mode (see ARIgreen_interpolation)
+    workspace is an optional filtertools.Workspace reused by the calls on images of the same size (not used by HA)
     """
 
-    # mosaic and mask
-    mosaic, mask = mosaic_bayer(rgb, pattern)
+    if rgb.ndim == 2:
+        # already a CFA, the algorithms take it directly
+        mosaic = rgb
+    else:
+        # single plane CFA of the pattern
+        mosaic = mosaic_cfa(rgb, pattern, dtype)
 
     if Algorithm == 'ARI':
-        rgb_dem = demosaic_ARI(mosaic, pattern)
+        rgb_dem = demosaic_ARI(mosaic, pattern, dtype, min_improved, iterations, active_tile_size, workspace)
 
     elif Algorithm == 'HA':
-        rgb_dem = demosaic_HA(mosaic, pattern)
+        rgb_dem = demosaic_HA(mosaic, pattern, dtype)
 
     else: # ('GBTF', 'RI', 'MLRI', 'WMLRI')  
-        rgb_dem = demosaic_RI(mosaic, pattern, sigma, Algorithm)
+        rgb_dem = demosaic_RI(mosaic, pattern, sigma, Algorithm, dtype, workspace)
 
     return rgb_dem
 
@@ -84,9 +95,13 @@ def main(args):
     # demosaicking
     #sigma = 1  # sigma : standard deviation of gaussian filter(default : 1) * For Kodak image data set, 1e8 works well.
     Algorithm = args.Algorithm  # 'HA', 'RI' , 'MLRI' , 'WMLRI', 'ARI'
+    iterations = {}
     tic()
-    rgb_dem = demosaick(rgb, pattern, args.sigma, Algorithm)
+    rgb_dem = demosaick(rgb, pattern, args.sigma, Algorithm, np.dtype(args.dtype), args.min_improved, iterations,
+                        args.active_tile_size)
     toc()
+    for branch, improved in iterations.items():
+        print('{} iterations: {}'.format(branch, len(improved)))
 
 
     # save output image
@@ -103,8 +118,7 @@ def main(args):
         imsave(args.output_diff, ((rgb_orig - rgb_dem)*10+128. ).clip(0,255).astype('uint8'))
 
     # calculate PSNR and CPSNR
-    psnr = impsnr(rgb_orig, rgb_dem, 255, 10)
-    cpsnr = imcpsnr(rgb_orig, rgb_dem, 255, 10)
+    psnr, cpsnr, _ = image_metrics(rgb_orig, rgb_dem, 255, 10, with_ssim=False)
 
     print('Red:{:.4f} dB'.format(psnr[0]))
     print('Green:{:.4f} dB'.format(psnr[1]))
@@ -121,7 +135,8 @@ def main(args):
 
 if __name__ == "__main__":
         
-    from impsnr import impsnr, imcpsnr
+    import dmsc_root  # makes metrics importable
+    from metrics import image_metrics
     import argparse
 
     Test_input = 'Sans_bruit_13.PNG'
@@ -138,6 +153,9 @@ if __name__ == "__main__":
     parser.add_argument("--noise_sigma", default=0, help="added noise standard devation", type=float)
     parser.add_argument("--mosaic", default="", help="export the noisy mosaic", type=str)
     parser.add_argument("--sigma", default=1, help="standard deviation of the regularization gaussian used in RI, MLRI, WMLRI", type=float)
+    parser.add_argument("--dtype", default="float64", help="type of the intermediate images: float64 or float32", type=str)
+    parser.add_argument("--min_improved", default=None, help="ARI: stop the green iterations improving less than this fraction of the pixels (e.g. 0.01)", type=float)
+    parser.add_argument("--active_tile_size", default=None, help="ARI: stop recomputing the tiles of this size (e.g. 128) no longer improved by the green iterations (approximation: the result depends on the tile size)", type=int)
     
 
     args = parser.parse_args()
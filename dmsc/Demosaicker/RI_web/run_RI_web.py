@@ -0,0 +1,59 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from run import demosaick
+from filtertools import Workspace
+
+# pixels of CFA needed around a tile by each algorithm (see tiling.demosaic_tiled):
+# the support of its chained filters, rounded up to an even number.
+# ARI rebuilds its guides from the guided filters of the previous iteration, so the windows of its
+# 11 green iterations add up (~330 pixels) before the two red and blue steps
+HALO = {'HA': 4, 'GBTF': 10, 'RI': 28, 'MLRI': 28, 'WMLRI': 28, 'ARI': 416}
+
+# number of image shapes whose workspace is kept by each thread (see thread_workspace)
+WORKSPACE_CACHE_SIZE = 2
+
+# workspaces of each thread, keyed by image shape
+_thread_workspaces = threading.local()
+
+
+def thread_workspace(shape):
+    """
+    returns the Workspace of the calling thread for the images of the given shape, created at its first call:
+    the images demosaicked one after the other by a thread (or a worker process) reuse its scratch buffers.
+    The workspaces of the WORKSPACE_CACHE_SIZE most recent shapes are kept (e.g. landscape and portrait).
+    """
+    workspaces = getattr(_thread_workspaces, 'workspaces', None)
+    if workspaces is None:
+        workspaces = _thread_workspaces.workspaces = OrderedDict()
+
+    workspace = workspaces.pop(shape, None)
+    if workspace is None:
+        workspace = Workspace()
+    workspaces[shape] = workspace
+    while len(workspaces) > WORKSPACE_CACHE_SIZE:
+        workspaces.popitem(last=False)
+
+    return workspace
+
+
+def demosaic_function(mosaic_data, Algorithm='ARI', sigma=1, dtype=np.float64, min_improved=None, active_tile_size=None,
+                      workspace=None):
+    """
+    Entry point used by CDMImager to run the RI_web algorithms ('HA', 'RI', 'MLRI', 'WMLRI', 'ARI')
+    mosaic_data is the (mosaic, mask, pattern) or (cfa, pattern) tuple passed to every run_<method>.py
+    dtype (np.float64 or np.float32) is the type of all the intermediate images
+    min_improved and active_tile_size enable the early exit and the active-set mode of the ARI green iterations
+    (see ARIgreen_interpolation)
+    workspace is an optional filtertools.Workspace whose scratch buffers are reused by the calls on images
+    of the same size, or True for the workspace of the calling thread for the image size (see thread_workspace)
+    Returns the demosaicked uint8 image, like the other methods
+    """
+    # the mask is rebuilt from the pattern by the algorithms
+    mosaic, pattern = mosaic_data[0], mosaic_data[-1]
+    if workspace is True:
+        workspace = thread_workspace(mosaic.shape[:2])
+
+    rgb_dem = demosaick(mosaic, pattern, sigma, Algorithm, dtype, min_improved, None, active_tile_size, workspace)
+
+    return np.clip(rgb_dem, 0, 255).astype(np.uint8)
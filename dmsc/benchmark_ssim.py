@@ -0,0 +1,69 @@
+#-*-coding:utf-8-*-
+# Benchmark of metrics.ssim against skimage.metrics.structural_similarity.
+#
+# For each window (box and gaussian) it reports the best run time of skimage, of metrics.ssim in float64
+# and float32 (mean only and with the full map), and the largest differences of the mean SSIM and of the map.
+# The distorted image is the ground truth with uniform noise, or the demosaicked image if a method is given.
+#
+# $ python benchmark_ssim.py --input data/kodak/GT/kodim19.png --method GBTF --repeat 5
+
+import time
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity
+from metrics import ssim
+
+
+def best_time(func, repeat):
+    """
+    runs func() repeat times, returns the last result and the best run time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(args):
+    gt = cv2.imread(args.input)
+    if args.method:
+        from CDMImager import CDMImager
+        cdm_imager = CDMImager.__new__(CDMImager)
+        cdm_imager.demosaicker_folder = "Demosaicker"
+        cdm_imager.dtype = np.float64
+        demosaic_function = cdm_imager.load_demosaic_method(args.method)
+        dem = demosaic_function((cdm_imager.mosaic_cfa(gt, 'grbg'), 'grbg'), dtype=np.float64)
+    else:
+        noise = np.random.default_rng(2021).integers(-args.noise, args.noise + 1, gt.shape)
+        dem = np.clip(gt.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    print('{:8s} {:10s} {:>10s} {:>8s} {:>14s} {:>14s}'.format('window', 'ssim', 'time (s)', 'speedup', 'mean diff', 'map diff'))
+
+    for gaussian in (False, True):
+        window = 'gaussian' if gaussian else 'box'
+        (ref, ref_map), ref_time = best_time(lambda: structural_similarity(
+            gt, dem, data_range=255, channel_axis=2, gaussian_weights=gaussian, full=True), args.repeat)
+        print('{:8s} {:10s} {:10.4f}'.format(window, 'skimage', ref_time))
+
+        for dtype in (np.float64, np.float32):
+            (mssim, ssim_map), full_time = best_time(lambda: ssim(gt, dem, gaussian=gaussian, full=True, dtype=dtype), args.repeat)
+            _, mean_time = best_time(lambda: ssim(gt, dem, gaussian=gaussian, dtype=dtype), args.repeat)
+            for name, elapsed in (('mean', mean_time), ('full', full_time)):
+                print('{:8s} {:10s} {:10.4f} {:7.2f}x {:14.3e} {:14.3e}'.format(
+                    window, f'{np.dtype(dtype).name} {name}', elapsed, ref_time / elapsed,
+                    abs(mssim - ref), np.abs(ssim_map - ref_map).max()))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default='data/kodak/GT/kodim19.png', help="ground truth image")
+    parser.add_argument("--method", default='', help="demosaicking method giving the distorted image (noise if empty)", type=str)
+    parser.add_argument("--noise", default=6, help="amplitude of the uniform noise of the distorted image", type=int)
+    parser.add_argument("--repeat", default=5, help="number of runs of each SSIM, the best time is reported", type=int)
+
+    args = parser.parse_args()
+    main(args)
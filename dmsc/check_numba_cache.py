@@ -0,0 +1,57 @@
+#-*-coding:utf-8-*-
+# Regression check of the on-disk numba cache of the 'numba' backend of GBTF and Prop.
+#
+# Each run demosaics kodim19 with the 'numba' backend in a fresh process, the method being loaded
+# through CDMImager.import_method_script (twice, the second run loading the cache written by the first)
+# and then by a direct import of its run script: every run must load the cache and match the 'opencv' backend.
+# The check exits with status 1 if a run fails. Without numba, the 'numba' backend falls back to 'opencv'.
+#
+# $ python check_numba_cache.py --method GBTF Prop
+
+import os
+import subprocess
+import sys
+
+# demosaics with both backends in the child process, prints whether they agree
+RUN = '''
+import sys, os, cv2, numpy as np
+from CDMImager import CDMImager
+method, mode, image = sys.argv[1:4]
+cdm_imager = CDMImager.__new__(CDMImager)
+cdm_imager.demosaicker_folder = "Demosaicker"
+cdm_imager.dtype = np.float64
+cfa = cdm_imager.mosaic_cfa(cv2.imread(image), 'grbg')
+if mode == 'direct':
+    sys.path.insert(0, os.path.join("Demosaicker", method))
+    demosaic_function = __import__('run_' + method).demosaic_function
+else:
+    demosaic_function = cdm_imager.load_demosaic_method(method)
+print(np.array_equal(demosaic_function((cfa, 'grbg'), backend='numba'), demosaic_function((cfa, 'grbg'))))
+'''
+
+
+def main(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    failed = False
+    for method in args.method:
+        for mode in ('CDMImager', 'CDMImager', 'direct'):
+            run = subprocess.run([sys.executable, '-c', RUN, method, mode, args.input],
+                                 cwd=root, capture_output=True, text=True)
+            ok = run.returncode == 0 and run.stdout.strip().endswith('True')
+            failed |= not ok
+            print('{:6s} {:10s} {}'.format(method, mode, 'ok' if ok else 'FAILED'))
+            if not ok:
+                print(run.stdout + run.stderr)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default='data/kodak/GT/kodim19.png', help="image demosaicked by the runs")
+    parser.add_argument("--method", default=['GBTF', 'Prop'], nargs='+', help="methods with a 'numba' backend", type=str)
+
+    args = parser.parse_args()
+    main(args)
@@ -1,6 +1,7 @@
 import CDMImager
 
-dataset_name = 'kodak'
-cdm_imager = CDMImager.CDMImager(dataset_name)
-cdm_imager.process_images(demosaic_method='GBTF')  # You can change the method as needed
-
+if __name__ == "__main__":
+    # the guard is needed by process_images(workers > 1): worker processes re-import this module
+    dataset_name = 'kodak'
+    cdm_imager = CDMImager.CDMImager(dataset_name)
+    cdm_imager.process_images(demosaic_method='GBTF', workers=1)  # You can change the method and the number of worker processes as needed
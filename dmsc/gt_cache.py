@@ -0,0 +1,73 @@
+import os
+import time
+import hashlib
+import cv2
+import numpy as np
+
+# age (in seconds) after which a temporary file of the cache is left by a killed process and removed
+TEMPORARY_MAX_AGE = 60
+
+
+def cache_entry(img_path, cache_folder, dtype=np.uint8):
+    """
+    Returns the path of the cached array of img_path in cache_folder: its name holds the file name,
+    a hash of the absolute path, the size and modification time of the image and the dtype of the array,
+    so images of different folders do not collide and an image that is replaced or modified gets a new entry.
+    """
+    stat = os.stat(img_path)
+    name = os.path.basename(img_path)
+    path_hash = hashlib.sha1(os.path.abspath(img_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_folder,
+                        f"{name}.{path_hash}.{stat.st_size}.{stat.st_mtime_ns}.{np.dtype(dtype).name}.npy")
+
+
+def remove_stale_entries(cache_folder, entry):
+    """
+    Removes the entries of cache_folder (of any dtype) of older versions of the image of entry,
+    and the temporary files left by the processes killed while writing an entry.
+    """
+    name, path_hash, size, mtime, _, _ = os.path.basename(entry).rsplit('.', 5)
+    now = time.time()
+    for file_name in os.listdir(cache_folder):
+        path = os.path.join(cache_folder, file_name)
+        parts = file_name.rsplit('.', 5)
+        try:
+            if file_name.endswith('.tmp'):
+                # a temporary file is written in milliseconds, an old one belongs to no running process
+                if now - os.path.getmtime(path) > TEMPORARY_MAX_AGE:
+                    os.remove(path)
+            elif len(parts) == 6 and parts[:2] == [name, path_hash] and parts[5] == 'npy' \
+                    and parts[2:4] != [size, mtime]:
+                os.remove(path)
+        except FileNotFoundError:
+            # already removed by another process
+            pass
+
+
+def cached_image(img_path, cache_folder, dtype=np.uint8):
+    """
+    Returns the image of img_path as decoded by cv2.imread (HxWx3 BGR), converted to dtype (np.uint8 or
+    e.g. np.float32), as a read-only array memory-mapped from a .npy file of cache_folder.
+    The image is decoded (and converted) once: the later calls, from any process, map the same file,
+    so the processes share its pages. The entry is rebuilt when the size or modification time of the
+    image change. Returns None if the image cannot be read.
+    """
+    entry = cache_entry(img_path, cache_folder, dtype)
+    if not os.path.exists(entry):
+        if np.dtype(dtype) == np.uint8:
+            img = cv2.imread(img_path)
+        else:
+            # the conversions start from the cached decoded image
+            img = cached_image(img_path, cache_folder)
+        if img is None:
+            return None
+
+        os.makedirs(cache_folder, exist_ok=True)
+        remove_stale_entries(cache_folder, entry)
+        # written under a temporary name then renamed, a process never maps a partly written entry
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            np.save(file, img.astype(dtype, copy=False))
+        os.replace(temporary, entry)
+
+    return np.load(entry, mmap_mode='r')
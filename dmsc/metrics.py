@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+# maximum value of the 8 bit images compared by default
+PEAK = 255
+
+# side of the square window of the local SSIM statistics and the SSIM constants (those of skimage)
+SSIM_WINDOW = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+# standard deviation of the gaussian window of the local SSIM statistics, truncated at SSIM_TRUNCATE * SSIM_SIGMA
+# as skimage (gaussian_weights=True) does, i.e. an 11 x 11 window
+SSIM_SIGMA = 1.5
+SSIM_TRUNCATE = 3.5
+
+
+def crop(img, border):
+    """
+    returns a view of img without `border` pixels on each side
+    """
+    if border > 0:
+        return img[border:img.shape[0] - border, border:img.shape[1] - border]
+    return img
+
+
+def psnr(mse, peak=PEAK):
+    """
+    converts a mean squared error (a scalar or an array) into a PSNR in dB
+    """
+    return 10 * np.log10(peak * peak / (np.asarray(mse, dtype=np.float64) + 1e-32))
+
+
+def channel_mse(x, y):
+    """
+    mean squared error of each channel between the HxWxC images x and y,
+    from a single float64 difference buffer
+    """
+    dif = np.subtract(x, y, dtype=np.float64)
+    # per channel sum of squares without a second HxWxC buffer
+    return np.einsum('ijk,ijk->k', dif, dif) / (dif.shape[0] * dif.shape[1])
+
+
+def ssim(x, y, peak=PEAK, gaussian=False, full=False, dtype=np.float32):
+    """
+    mean structural similarity between the HxWxC images x and y, averaged over the channels,
+    with the default settings of skimage.metrics.structural_similarity(x, y, data_range=peak, channel_axis=2):
+    local statistics over SSIM_WINDOW x SSIM_WINDOW windows with the sample covariance,
+    the windows crossing the image border are left out of the mean.
+    With gaussian, the windows are gaussian of standard deviation SSIM_SIGMA (gaussian_weights=True of skimage).
+    With full, the HxWxC SSIM map (borders computed with reflected images) is returned with the mean.
+    The statistics are computed in dtype, float32 by default: the box and gaussian filters of OpenCV accumulate
+    float32 images in float64, and the moments are those of the images shifted by peak / 2 to limit the
+    cancellation of the variances.
+    The 5 local moments share a single buffer, all the channels of a moment are filtered by one OpenCV call.
+    """
+    if gaussian:
+        win_size = 2 * int(SSIM_TRUNCATE * SSIM_SIGMA + 0.5) + 1
+        kernel = cv2.getGaussianKernel(win_size, SSIM_SIGMA)
+        window_mean = lambda moment: cv2.sepFilter2D(moment, -1, kernel, kernel, dst=moment,
+                                                     borderType=cv2.BORDER_REFLECT)
+    else:
+        win_size = SSIM_WINDOW
+        window_mean = lambda moment: cv2.boxFilter(moment, -1, (win_size, win_size), dst=moment,
+                                                   borderType=cv2.BORDER_REFLECT)
+    if min(x.shape[:2]) < win_size:
+        raise ValueError(f"the images must be at least {win_size}x{win_size} for the SSIM window, got shape {x.shape}")
+
+    # x, y, x^2, y^2 and xy of the images shifted by peak / 2, each moment contiguous so that the arithmetic
+    # below runs on contiguous rows: the shift divides the squares (and their cancellation errors) by 4
+    shift = peak / 2
+    moments = np.empty((5,) + x.shape, dtype=dtype)
+    mx, my, mxx, myy, mxy = moments
+    np.subtract(x, shift, out=mx, dtype=dtype)
+    np.subtract(y, shift, out=my, dtype=dtype)
+    np.multiply(mx, mx, out=mxx)
+    np.multiply(my, my, out=myy)
+    np.multiply(mx, my, out=mxy)
+    for moment in moments:
+        window_mean(moment)
+
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1)
+    c1, c2 = (SSIM_K1 * peak) ** 2, (SSIM_K2 * peak) ** 2
+
+    # the statistics are computed in place on whole (contiguous) moments, myy is the scratch buffer
+    # 2 vxy + c2 into mxy, vxx + vyy + c2 into mxx
+    mxx += myy
+    np.multiply(mx, my, out=myy)
+    mxy -= myy
+    mxy *= 2 * cov_norm
+    mxy += c2
+    np.multiply(mx, mx, out=myy)
+    mxx -= myy
+    np.multiply(my, my, out=myy)
+    mxx -= myy
+    mxx *= cov_norm
+    mxx += c2
+    # 2 ux uy + c1 into myy, ux^2 + uy^2 + c1 into mx, with the local means of the images
+    mx += shift
+    my += shift
+    np.multiply(mx, my, out=myy)
+    myy *= 2
+    myy += c1
+    mx *= mx
+    my *= my
+    mx += my
+    mx += c1
+
+    mxy *= myy
+    mxx *= mx
+    mxy /= mxx
+    # only the windows inside the image are used, the mean over them is the mean of the channel means
+    mssim = float(crop(mxy, (win_size - 1) // 2).mean(dtype=np.float64))
+    if full:
+        return mssim, mxy
+    return mssim
+
+
+def image_metrics(x, y, peak=PEAK, border=0, with_ssim=True):
+    """
+    Computes the quality of the HxWxC image y (e.g. demosaicked) with respect to the reference x,
+    both without `border` pixels on each side:
+    returns the PSNR of each channel, the color PSNR (CPSNR, from the mean squared error over all the channels)
+    and, if with_ssim, the mean SSIM over the channels (None otherwise).
+    The squared differences are computed once for the per channel and color PSNR.
+    """
+    x, y = crop(x, border), crop(y, border)
+    mse = channel_mse(x, y)
+    channel_psnr = [float(p) for p in psnr(mse, peak)]
+    cpsnr = float(psnr(mse.mean(), peak))
+    ssim_value = ssim(x, y, peak) if with_ssim else None
+
+    return channel_psnr, cpsnr, ssim_value
@@ -0,0 +1,85 @@
+import queue
+import threading
+
+# default number of items waiting between two stages of run_pipeline
+QUEUE_SIZE = 2
+
+# marks the end of the items in the queues of run_pipeline
+_DONE = object()
+
+
+def run_pipeline(items, stages, queue_size=QUEUE_SIZE):
+    """
+    Generator running each item through the chain of stages (functions of the output of the previous stage),
+    each stage in its own thread: the stages process successive items concurrently (NumPy, OpenCV and the
+    file I/O release the GIL) and the outputs of the last stage are yielded in the order of the items.
+    The stages are connected by queues of queue_size items, which bounds the number of items in flight
+    (and the memory they use) to about (len(stages) + 1) * (queue_size + 1).
+    An exception raised by a stage stops the pipeline and is raised again by the generator.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    errors = []
+
+    def put(q, item):
+        # a full queue is waited for until the pipeline is stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def feed():
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+            return
+        put(queues[0], _DONE)
+
+    def work(stage, src, dst):
+        try:
+            while True:
+                item = get(src)
+                if item is _DONE:
+                    break
+                if not put(dst, stage(item)):
+                    return
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+            return
+        put(dst, _DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]), daemon=True)
+                for i, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _DONE:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        # also stops the threads when the generator is closed early
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,170 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# default tile size (in pixels) of demosaic_tiled
+TILE_SIZE = 512
+
+# default minimum number of rows demosaicked at once by RowStream
+STREAM_ROWS = 32
+
+
+def even(n):
+    """
+    rounds n up to the next even integer
+    """
+    return n + n % 2
+
+
+def tile_slices(height, width, tile_size, halo):
+    """
+    Splits a height x width frame into tiles of tile_size x tile_size pixels (smaller on the last row and column).
+    Yields for each tile the (rows, cols) slices of the tile extended by `halo` pixels on each side
+    (clipped to the frame) and the (rows, cols) slices of the tile core inside that extended tile.
+    tile_size and halo must be even: every extended tile then starts on the same phase of the 2x2 Bayer cell
+    as the frame, so it is demosaicked with the frame's pattern.
+    """
+    if tile_size <= 0 or tile_size % 2 or halo < 0 or halo % 2:
+        raise ValueError(f"tile_size must be positive and even and halo non negative and even, got {tile_size} and {halo}")
+
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            y0, x0 = max(y - halo, 0), max(x - halo, 0)
+            y1, x1 = min(y + tile_size + halo, height), min(x + tile_size + halo, width)
+            rows, cols = min(tile_size, height - y), min(tile_size, width - x)
+
+            extended = (slice(y0, y1), slice(x0, x1))
+            core = (slice(y - y0, y - y0 + rows), slice(x - x0, x - x0 + cols))
+            yield (slice(y, y + rows), slice(x, x + cols)), extended, core
+
+
+def demosaic_tiled(demosaic_function, cfa, pattern, tile_size=TILE_SIZE, halo=16, threads=1, timings=None, **kwargs):
+    """
+    Demosaics a single plane HxW CFA tile by tile with a method's demosaic_function.
+    Each tile is demosaicked with `halo` extra pixels of CFA on each side and only its core is kept,
+    so the intermediates of the method are allocated per tile: the peak memory is bounded by
+    (tile_size + 2*halo)^2 pixels instead of the frame size.
+    halo must cover the support of the method (the HALO declared in its run script): the stitched
+    image is then identical to the full frame one, up to the rounding of cv2.boxFilter running sums
+    for the methods built on guided filters.
+    tile_size and halo are rounded up to even values to keep the tiles aligned with the Bayer pattern.
+    With threads > 1 the tiles are demosaicked by a pool of `threads` threads (NumPy and OpenCV release
+    the GIL in their array operations); the result does not depend on the number of threads.
+    If timings is a list, a (row, col, seconds) tuple is appended to it for each tile, in tile order,
+    with the position of the tile in the frame and its demosaicking time.
+    kwargs (e.g. dtype) are passed to demosaic_function.
+    """
+    height, width = cfa.shape
+    tiles = list(tile_slices(height, width, even(tile_size), even(halo)))
+
+    def demosaic_tile(tile):
+        frame, extended, core = tile
+        start = time.perf_counter()
+        tile_dem = demosaic_function((np.ascontiguousarray(cfa[extended]), pattern), **kwargs)
+        # only the core is kept, the halo of the finished tiles waiting to be stitched is released
+        return tile_dem[core].copy(), time.perf_counter() - start
+
+    if threads > 1:
+        executor = ThreadPoolExecutor(max_workers=threads)
+        results = executor.map(demosaic_tile, tiles)
+    else:
+        executor = None
+        results = map(demosaic_tile, tiles)
+
+    rgb_dem = None
+    try:
+        for (frame, _, _), (core_dem, seconds) in zip(tiles, results):
+            if rgb_dem is None:
+                rgb_dem = np.empty((height, width) + core_dem.shape[2:], dtype=core_dem.dtype)
+            rgb_dem[frame] = core_dem
+
+            if timings is not None:
+                timings.append((frame[0].start, frame[1].start, seconds))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return rgb_dem
+
+
+class RowStream:
+    """
+    Streaming demosaicking of a single plane CFA received band by band (a few rows at a time, e.g. from a
+    line-scan sensor readout), with a method's demosaic_function.
+    push(band) appends the next rows of the CFA and returns the RGB rows that are finished: a row is
+    demosaicked once the `halo` rows below it are received, with the `halo` rows above it, so only
+    a rolling window of the CFA is kept in memory, of about (min_rows + 2*halo) rows plus a band.
+    close() ends the frame and returns its last rows.
+    Like the tiles of demosaic_tiled, the rows are identical to those of the full frame when halo covers
+    the support of the method (the HALO declared in its run script), up to the rounding of cv2.boxFilter
+    running sums for the methods built on guided filters.
+    The rows are demosaicked by chunks of at least min_rows (except the last one): smaller chunks lower
+    the latency of the first rows, larger ones spend less time on the halo rows computed again.
+    halo and min_rows are rounded up to even values to keep the chunks aligned with the Bayer pattern.
+    kwargs (e.g. dtype) are passed to demosaic_function.
+    """
+    def __init__(self, demosaic_function, pattern, halo, min_rows=STREAM_ROWS, **kwargs):
+        if min_rows <= 0 or halo < 0:
+            raise ValueError(f"min_rows must be positive and halo non negative, got {min_rows} and {halo}")
+        self.demosaic_function = demosaic_function
+        self.pattern = pattern
+        self.halo = even(halo)
+        self.min_rows = even(min_rows)
+        self.kwargs = kwargs
+        # rows [start, start + len(window)) of the CFA, the RGB rows before next are returned
+        self.window = None
+        self.start = 0
+        self.next = 0
+
+    def push(self, band):
+        """
+        appends band (rows x width, the next rows of the CFA) and returns the list of the (row, rgb_rows)
+        chunks finished by it: rgb_rows are the RGB rows of the frame from row on
+        """
+        band = np.asarray(band)
+        if band.ndim != 2 or (self.window is not None and band.shape[1] != self.window.shape[1]):
+            width = None if self.window is None else self.window.shape[1]
+            raise ValueError(f"band must be a rows x width array (width {width}), got shape {band.shape}")
+        self.window = band if self.window is None else np.concatenate((self.window, band))
+
+        # the rows ready are followed by halo received rows, an even number of them keeps the chunks aligned
+        ready = self.start + len(self.window) - self.halo
+        ready -= ready % 2
+        if ready - self.next < self.min_rows:
+            return []
+        return [self.demosaic(ready)]
+
+    def close(self):
+        """
+        ends the frame: returns the list of the (row, rgb_rows) chunks of its remaining rows,
+        demosaicked with the bottom border of the frame
+        """
+        if self.window is None or self.next == self.start + len(self.window):
+            return []
+        return [self.demosaic(self.start + len(self.window))]
+
+    def demosaic(self, ready):
+        """
+        demosaics the rows [next, ready) with halo rows around them, drops the rows no longer needed
+        """
+        rows = slice(self.next - self.start - min(self.next, self.halo), ready + self.halo - self.start)
+        chunk = self.demosaic_function((np.ascontiguousarray(self.window[rows]), self.pattern), **self.kwargs)
+        core = chunk[self.next - self.start - rows.start:ready - self.start - rows.start].copy()
+
+        row, self.next = self.next, ready
+        # the window keeps the halo rows above the next chunk
+        drop = max(self.next - self.halo, 0) - self.start
+        self.window = self.window[drop:].copy()
+        self.start += drop
+        return row, core
+
+
+def demosaic_stream(demosaic_function, bands, pattern, halo, min_rows=STREAM_ROWS, **kwargs):
+    """
+    Generator demosaicking a single plane CFA given as an iterable of bands of rows (see RowStream):
+    yields the (row, rgb_rows) chunks of the frame as soon as they are finished.
+    """
+    stream = RowStream(demosaic_function, pattern, halo, min_rows, **kwargs)
+    for band in bands:
+        yield from stream.push(band)
+    yield from stream.close()
@@ -1,12 +1,61 @@
 import cv2
 import numpy as np
+from functools import lru_cache
 
-def filter2D(im, ker):
+# number of (height, width, pattern, dtype) mask sets kept in memory by bayer_masks
+MASK_CACHE_SIZE = 4
+
+# filter2D dispatches the kernels of rank <= SEPARABLE_MAX_RANK to cv2.sepFilter2D (see separableKernel),
+# a rank r kernel being filtered as the sum of r separable ones
+SEPARABLE_MAX_RANK = 1
+
+@lru_cache(maxsize=None)
+def _separableKernel(data, shape, max_rank):
+    """
+    cached implementation of separableKernel, the kernel is given by its float64 bytes and shape
+    """
+    ker = np.frombuffer(data).reshape(shape)
+    u, s, vt = np.linalg.svd(ker)
+    rank = int(np.sum(s > s[0] * 1e-12)) if s[0] > 0 else 0
+    # cv2.filter2D only computes the non null taps of the kernel, and a separable filter costs one pass per dimension
+    if rank == 0 or rank > max_rank or 2 * rank * sum(shape) > np.count_nonzero(ker):
+        return None
+
+    pairs = tuple((u[:, i] * s[i], vt[i].copy()) for i in range(rank))
+    for column, row in pairs:
+        column.flags.writeable = False
+        row.flags.writeable = False
+    return pairs
+
+def separableKernel(ker, max_rank=None):
+    """
+    decomposes the 2d kernel (ker) by SVD into a sum of separable kernels (outer products of a column and a row)
+    returns the tuple of their (column, row) 1d kernels (read-only, the decomposition is cached per kernel)
+    when ker has rank <= max_rank (default SEPARABLE_MAX_RANK) and filtering with them is cheaper than
+    with ker, None otherwise (e.g. for 1d kernels)
+    """
+    if ker.ndim != 2 or min(ker.shape) == 1:
+        return None
+    ker = np.asarray(ker, dtype=np.float64)
+    return _separableKernel(ker.tobytes(), ker.shape, SEPARABLE_MAX_RANK if max_rank is None else max_rank)
+
+def filter2D(im, ker, dst=None):
     """
     convolve the 2d  image (im) with the 2d kernel (ker) and return a 2d  image
     pads the image to preserve the shape by replicating boundaries
+    the kernels of low rank (see separableKernel) are filtered with cv2.sepFilter2D, the result is the same
+    up to the rounding of the decomposition
+    dst: optional 2d array (or view with contiguous rows) of the shape and type of im (not im itself) receiving the result
     """
-    return cv2.filter2D(im,  -1, kernel=ker, borderType=cv2.BORDER_REPLICATE)
+    pairs = separableKernel(ker)
+    if pairs is None:
+        return cv2.filter2D(im,  -1, kernel=ker, dst=dst, borderType=cv2.BORDER_REPLICATE)
+
+    (column, row), pairs = pairs[0], pairs[1:]
+    out = cv2.sepFilter2D(im, -1, row, column, dst=dst, borderType=cv2.BORDER_REPLICATE)
+    for column, row in pairs:
+        out += cv2.sepFilter2D(im, -1, row, column, borderType=cv2.BORDER_REPLICATE)
+    return out
 
 
 def boxFilter(im, sz):
@@ -23,36 +72,105 @@ def getGaussianKernel(sz,sigma):
     """
     return cv2.getGaussianKernel(sz, sigma)
 
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _bayer_masks(height, width, pattern, dtype):
+    """
+    cached implementation of bayer_masks, dtype must be a np.dtype
+    """
+    maskGr = np.zeros((height, width), dtype=dtype)
+    maskGb = np.zeros((height, width), dtype=dtype)
+    maskR  = np.zeros((height, width), dtype=dtype)
+    maskB  = np.zeros((height, width), dtype=dtype)
+
+    if pattern == 'grbg':
+        maskGr[0::2, 0::2] = 1
+        maskGb[1::2, 1::2] = 1
+        maskR [0::2, 1::2] = 1
+        maskB [1::2, 0::2] = 1
+    elif pattern == 'rggb':
+        maskGr[0::2, 1::2] = 1
+        maskGb[1::2, 0::2] = 1
+        maskB [1::2, 1::2] = 1
+        maskR [0::2, 0::2] = 1
+    elif pattern == 'gbrg':
+        maskGb[0::2, 0::2] = 1
+        maskGr[1::2, 1::2] = 1
+        maskR [1::2, 0::2] = 1
+        maskB [0::2, 1::2] = 1
+    elif pattern == 'bggr':
+        maskGb[0::2, 1::2] = 1
+        maskGr[1::2, 0::2] = 1
+        maskB [0::2, 0::2] = 1
+        maskR [1::2, 1::2] = 1
+    else:
+        raise ValueError(f"Unknown Bayer pattern: {pattern}")
+
+    mask = np.zeros((height, width, 3), dtype=dtype)
+    mask[:, :, 0] = maskR
+    mask[:, :, 1] = maskGr + maskGb
+    mask[:, :, 2] = maskB
+
+    for m in (mask, maskGr, maskGb, maskR, maskB):
+        m.flags.writeable = False
+
+    return mask, maskGr, maskGb, maskR, maskB
+
+
+def bayer_masks(height, width, pattern, dtype=np.float64):
+    """
+    computes the masks of a (height, width) mosaic with the given pattern.
+    The masks are computed once per (height, width, pattern, dtype) and shared by all the callers,
+    the least recently used ones are dropped when more than MASK_CACHE_SIZE sets are cached.
+    The arrays are read-only, copy them before modifying them.
+    returns:  mask (3 channels, as in mosaic_bayer), maskGr, maskGb, maskR, maskB
+    """
+    return _bayer_masks(height, width, pattern, np.dtype(dtype))
+
+
+def mosaic_cfa(rgb, pattern, dtype=np.float64):
+    """
+    generate a single plane (HxW) Bayer CFA of the given dtype from a rgb image (or a 3 channel mosaic)
+    pattern can be: 'grbg', 'rggb', 'gbrg', 'bggr'
+    the algorithms work on this raw CFA data (rawq) and the masks of the pattern, with no 3 channel mosaic
+    """
+    if pattern not in ('grbg', 'rggb', 'gbrg', 'bggr'):
+        raise ValueError(f"Unknown Bayer pattern: {pattern}")
+    channel = {'r': 0, 'g': 1, 'b': 2}
+    cfa = np.empty(rgb.shape[:2], dtype=dtype)
+
+    # each of the 4 phases of the 2x2 Bayer cell takes the channel given by the pattern
+    for phase, (i, j) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+        cfa[i::2, j::2] = rgb[i::2, j::2, channel[pattern[phase]]]
+
+    return cfa
+
+
 def get_mosaic_masks(mosaic, pattern):
         """
         generate the mosaic masks assuming a given pattern
-        returns:  maskGr, maskGb, maskR, maskB
+        returns:  maskGr, maskGb, maskR, maskB  (read-only, see bayer_masks)
+        the masks have the dtype of mosaic when it is a floating point array, float64 otherwise
         """
         size_rawq = mosaic.shape
-        maskGr = np.zeros((size_rawq[0], size_rawq[1]))
-        maskGb = np.zeros((size_rawq[0], size_rawq[1]))
-        maskR  = np.zeros((size_rawq[0], size_rawq[1]))
-        maskB  = np.zeros((size_rawq[0], size_rawq[1]))
-
-        if pattern == 'grbg':
-            maskGr[0::2, 0::2] = 1
-            maskGb[1::2, 1::2] = 1
-            maskR [0::2, 1::2] = 1
-            maskB [1::2, 0::2] = 1
-        elif pattern == 'rggb':
-            maskGr[0::2, 1::2] = 1
-            maskGb[1::2, 0::2] = 1
-            maskB [1::2, 1::2] = 1
-            maskR [0::2, 0::2] = 1
-        elif pattern == 'gbrg':
-            maskGb[0::2, 0::2] = 1
-            maskGr[1::2, 1::2] = 1
-            maskR [1::2, 0::2] = 1
-            maskB [0::2, 1::2] = 1
-        elif pattern == 'bggr':
-            maskGb[0::2, 1::2] = 1
-            maskGr[1::2, 0::2] = 1
-            maskB [0::2, 0::2] = 1
-            maskR [1::2, 1::2] = 1
+        dtype = mosaic.dtype if np.issubdtype(mosaic.dtype, np.floating) else np.float64
+        _, maskGr, maskGb, maskR, maskB = bayer_masks(size_rawq[0], size_rawq[1], pattern, dtype)
 
         return maskGr, maskGb, maskR, maskB
+
+
+def mask_phase(M):
+    """
+    returns the (row, col) offset in the 2x2 Bayer cell of the pixels selected by the single phase mask M
+    (maskGr, maskGb, maskR, maskB, mask[:, :, 0] or mask[:, :, 2])
+    """
+    row, col = np.argwhere(M[:2, :2])[0]
+    return int(row), int(col)
+
+
+def phase_plane(im, phase):
+    """
+    returns the H/2 x W/2 plane (a view) of the pixels of the HxW image im on the (row, col) phase of the 2x2 Bayer cell.
+    The four planes store the CFA without the 3/4 of zeros of the masked full resolution planes:
+    a computation restricted to one phase of the mosaic is done on its plane.
+    """
+    return im[phase[0]::2, phase[1]::2]
@@ -0,0 +1,100 @@
+import os
+import threading
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# output formats of the result images and their file extension
+OUTPUT_FORMATS = {'png': '.png', 'tiff': '.tiff', 'ppm': '.ppm', 'npy': '.npy'}
+
+
+def result_path(folder, img_name, output_format):
+    """
+    Returns the path of the result image of img_name in folder, with the extension of output_format.
+    """
+    return os.path.join(folder, os.path.splitext(img_name)[0] + OUTPUT_FORMATS[output_format])
+
+
+def write_image(path, img, output_format, png_compression=None):
+    """
+    Writes an image in output_format: 'png' (compression level png_compression from 0 to 9,
+    OpenCV's default if None), uncompressed 'tiff', binary 'ppm' or 'npy' (the array as is).
+    """
+    if output_format == 'npy':
+        np.save(path, img)
+        return
+
+    params = []
+    if output_format == 'png' and png_compression is not None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    elif output_format == 'tiff':
+        params = [cv2.IMWRITE_TIFF_COMPRESSION, 1]  # no compression
+    elif output_format == 'ppm':
+        params = [cv2.IMWRITE_PXM_BINARY, 1]
+
+    if not cv2.imwrite(path, img, params):
+        raise IOError(f"Failed to write image: {path}")
+
+
+class ResultWriter:
+    """
+    Writes the result images in the background, in a pool of `threads` threads (cv2.imwrite and np.save
+    release the GIL while encoding), so that the encoding of an image overlaps the processing of the next ones.
+    write() blocks while max_pending images (2 per thread by default) are waiting to be written,
+    which bounds the memory they hold. With threads=0 the images are written synchronously.
+    flush() waits for the pending images and raises the first error of their writes;
+    close(), also called when leaving a with block, flushes and stops the threads.
+    """
+    def __init__(self, output_format='png', png_compression=None, threads=1, max_pending=None):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {list(OUTPUT_FORMATS)}, got {output_format}")
+        self.output_format = output_format
+        self.png_compression = png_compression
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.slots = threading.Semaphore(2 * threads if max_pending is None else max_pending)
+        self.futures = []
+
+    def write(self, path, img, written=None):
+        """
+        writes img to path in the background (synchronously without threads),
+        written(path) is then called once the image is written, in the writing thread
+        """
+        if self.executor is None:
+            self.write_and_report(path, img, written)
+            return
+
+        self.slots.acquire()
+        future = self.executor.submit(self.write_and_report, path, img, written)
+        future.add_done_callback(lambda _: self.slots.release())
+        # the finished writes are only kept for their errors
+        self.futures = [f for f in self.futures if not f.done() or f.exception() is not None]
+        self.futures.append(future)
+
+    def write_and_report(self, path, img, written):
+        """
+        writes img to path, then calls written(path) if given
+        """
+        write_image(path, img, self.output_format, self.png_compression)
+        if written is not None:
+            written(path)
+
+    def flush(self):
+        """
+        waits for all the pending writes, raises the first error of their writes
+        """
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()